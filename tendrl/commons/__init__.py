@@ -3,13 +3,15 @@ import importlib
 import inspect
 import pkgutil
 
-import etcd
 import maps
-import sys
-import time
+from tendrl.commons import event
 from tendrl.commons import flows
+from tendrl.commons import message
 from tendrl.commons import objects
+from tendrl.commons.utils.central_store import cache
+from tendrl.commons.utils.central_store import connection
 from tendrl.commons.utils.central_store import utils as cs_utils
+from tendrl.commons.utils.central_store import write_behind
 from tendrl.commons.objects import BaseAtom
 from tendrl.commons.utils import log_utils as logger
 
@@ -31,6 +33,10 @@ class TendrlNS(object):
                     % (ns_name, ns_src)})
         self.ns_name = ns_name
         self.ns_src = ns_src
+        # Definitions built by get_obj_definition() and
+        # get_atom_definition(), with the raw definitions they came from
+        self._obj_defs = {}
+        self._atom_defs = {}
 
         self._create_ns()
 
@@ -241,35 +247,85 @@ class TendrlNS(object):
                        self.ns_name})
             self.current_ns.config = self.current_ns.objects.Config()
             NS.config = self.current_ns.config
-            NS._int.etcd_kwargs = {
-                'port': self.current_ns.config.data['etcd_port'],
-                'host': self.current_ns.config.data['etcd_connection'],
-                'allow_reconnect': True}
+            # Messages of a lower priority are dropped before they are
+            # built, message.set_min_priority() switches it at runtime
+            message.set_min_priority(
+                self.current_ns.config.data.get('log_priority', "debug"))
+            # Messages of the other priorities do not record their caller
+            message.set_caller_priorities(
+                self.current_ns.config.data.get('log_caller_priorities',
+                                                message.PRIORITIES))
+            if self.current_ns.config.data.get('etcd_endpoints'):
+                # Members of the central store cluster, see
+                # connection.ConnectionManager
+                NS._int.etcd_kwargs = {
+                    'host': connection.etcd_hosts(
+                        self.current_ns.config.data['etcd_endpoints'],
+                        self.current_ns.config.data.get('etcd_port', 2379)),
+                    'allow_reconnect': True}
+            else:
+                NS._int.etcd_kwargs = {
+                    'port': self.current_ns.config.data['etcd_port'],
+                    'host': self.current_ns.config.data['etcd_connection'],
+                    'allow_reconnect': True}
 
             logger.log("debug", NS.get("publisher_id", None),
                        {"message": "Setup central store clients for "
                        "namespace.%s" % self.ns_name})
+            # Connects, health checks (once started, see Manager.start())
+            # and reconnects the central store clients
+            NS._int.connection = connection.ConnectionManager(
+                NS._int.etcd_kwargs,
+                pool_size=self.current_ns.config.data.get(
+                    'etcd_pool_size', 10),
+                health_interval=self.current_ns.config.data.get(
+                    'etcd_health_interval', 30)
+            )
             # Use this for central store writes, TTL refresh
-            NS._int.wclient = None
-            while not NS._int.wclient:
-                try:
-                    NS._int.wclient = etcd.Client(**NS._int.etcd_kwargs)
-                except etcd.EtcdException:
-                    sys.stdout.write(
-                        "Error connecting to central store (etcd), trying "
-                        "again...")
-                    time.sleep(2)
+            NS._int.wclient = NS._int.connection.connect("wclient")
 
             # Use this for central store read, watch
-            NS._int.client = None
-            while not NS._int.client:
-                try:
-                    NS._int.client = etcd.Client(**NS._int.etcd_kwargs)
-                except etcd.EtcdException:
-                    sys.stdout.write(
-                        "Error connecting to central store (etcd), trying "
-                        "again...")
-                    time.sleep(2)
+            NS._int.client = NS._int.connection.connect()
+
+            _backend = self.current_ns.config.data.get(
+                'central_store_backend', "etcd2")
+            if _backend != "etcd2":
+                # The flows, the node context and the logger (in-order job
+                # messages) still use the v2 clients, they would not see
+                # the keys written through backend.Etcd3Backend
+                msg = "Central store backend %s is not supported yet, " \
+                      "use etcd2" % _backend
+                logger.log("error", NS.get("publisher_id", None),
+                           {"message": msg})
+                raise Exception(msg)
+
+            # Read-through cache of central store objects, served only
+            # once its watcher is started (see Manager.start())
+            if "cache" not in NS._int:
+                NS._int.cache = cache.ObjectCache(
+                    max_size=self.current_ns.config.data.get(
+                        'cache_max_size', 1024)
+                )
+            # Queue of the saves of write-behind objects, flushing once
+            # started (see Manager.start())
+            if "write_behind" not in NS._int:
+                NS._int.write_behind = write_behind.WriteBehindQueue(
+                    max_size=self.current_ns.config.data.get(
+                        'write_behind_max_size', 1024),
+                    flush_interval=self.current_ns.config.data.get(
+                        'write_behind_interval', 5)
+                )
+            # Queue of the Events of the process, emitted by a background
+            # greenlet once started (see Manager.start())
+            if "event_queue" not in NS._int:
+                NS._int.event_queue = event.EventQueue(
+                    max_size=self.current_ns.config.data.get(
+                        'event_queue_size', 1024),
+                    batch_size=self.current_ns.config.data.get(
+                        'event_batch_size', 64),
+                    policy=self.current_ns.config.data.get(
+                        'event_queue_policy', "drop_oldest")
+                )
 
         # NodeContext, if the namespace has implemented its own
         if "NodeContext" in self.current_ns.objects:
@@ -384,14 +440,32 @@ class TendrlNS(object):
             raw_obj = self.current_ns.definitions.get_parsed_defs()[raw_ns][
                 'objects'][obj_name]
 
-        return maps.NamedDict(attrs=raw_obj['attrs'],
-                              enabled=raw_obj['enabled'],
-                              obj_list=raw_obj.get('list', ""),
-                              obj_value=raw_obj['value'],
-                              atoms=raw_obj.get('atoms', {}),
-                              flows=raw_obj.get('flows', {}),
-                              help=raw_obj['help']
-                              )
+        # Built once per object type and shared by all its instances, until
+        # the definitions are reloaded (eg: NS.compiled_definitions is set)
+        _cached = self._obj_defs.get(obj_name)
+        if _cached is not None and _cached[0] is raw_obj:
+            return _cached[1]
+
+        attr_types = {}
+        for attr, attr_def in (raw_obj['attrs'] or {}).iteritems():
+            if (attr_def or {}).get('type'):
+                attr_types[attr] = attr_def['type'].lower()
+        obj_def = maps.NamedDict(attrs=raw_obj['attrs'],
+                                 attr_types=attr_types,
+                                 enabled=raw_obj['enabled'],
+                                 obj_list=raw_obj.get('list', ""),
+                                 obj_value=raw_obj['value'],
+                                 atoms=raw_obj.get('atoms', {}),
+                                 flows=raw_obj.get('flows', {}),
+                                 help=raw_obj['help'],
+                                 cache_ttl=raw_obj.get('cache_ttl'),
+                                 storage=raw_obj.get('storage'),
+                                 write_behind=raw_obj.get('write_behind',
+                                                          False),
+                                 consistency=raw_obj.get('consistency')
+                                 )
+        self._obj_defs[obj_name] = (raw_obj, obj_def)
+        return obj_def
 
     def get_obj_flow_definition(self, obj_name, flow_name):
         obj_def = self.get_obj_definition(obj_name)
@@ -408,11 +482,18 @@ class TendrlNS(object):
     def get_atom_definition(self, obj_name, atom_name):
         obj_def = self.get_obj_definition(obj_name)
         raw_atom = obj_def.atoms[atom_name]
-        return maps.NamedDict(help=raw_atom['help'],
-                              enabled=raw_atom['enabled'],
-                              inputs=raw_atom.get('inputs').get('mandatory'),
-                              outputs=raw_atom.get('outputs', []),
-                              uuid=raw_atom['uuid'])
+        _cached = self._atom_defs.get((obj_name, atom_name))
+        if _cached is not None and _cached[0] is raw_atom:
+            return _cached[1]
+
+        atom_def = maps.NamedDict(help=raw_atom['help'],
+                                  enabled=raw_atom['enabled'],
+                                  inputs=raw_atom.get('inputs').get(
+                                      'mandatory'),
+                                  outputs=raw_atom.get('outputs', []),
+                                  uuid=raw_atom['uuid'])
+        self._atom_defs[(obj_name, atom_name)] = (raw_atom, atom_def)
+        return atom_def
 
     def get_flow_definition(self, flow_name):
         raw_ns = "namespace.%s" % self.ns_name
@@ -1,58 +1,363 @@
+import collections
+import os
 import struct
 
+import gevent
+import gevent.event
+import gevent.lock
 from gevent import socket
 from gevent.socket import error as socket_error
 from gevent.socket import timeout as socket_timeout
 import sys
 from tendrl.commons.message import Message
+from tendrl.commons.message import PRIORITIES
+from tendrl.commons.message import priority_enabled
 from tendrl.commons.logger import Logger
 import traceback
 
 
 class Event(object):
     def __init__(self, message, socket_path=None):
+        if not priority_enabled(message.priority):
+            return
         if message.publisher == "node_agent":
-            try:
-                json_str = Message.to_json(message)
-                message = Message.from_json(json_str)
-                Logger(message)
-            except (TypeError, ValueError, KeyError, AttributeError):
-                sys.stderr.write(
-                    "Unable to log the message.%s\n" % message)
-                exc_type, exc_value, exc_tb = sys.exc_info()
-                traceback.print_exception(
-                    exc_type, exc_value, exc_tb, file=sys.stderr)
+            # Logged by this process
+            self.socket_path = None
         else:
-            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             self.socket_path = socket_path
             if self.socket_path is None:
                 self.socket_path = NS.config.data['logging_socket_path']
-            self._write(message)
+        _queue = _event_queue()
+        if _queue is not None and _queue.enabled:
+            _queue.put(message, self.socket_path)
+        else:
+            emit([(message, self.socket_path)])
+
+
+def emit(events):
+    """Logs or sends to their logging socket the (message, socket_path)
+
+    events, in order. The messages sent to a socket together are sent in
+    a single write.
+    """
+    _batch = []
+    for message, socket_path in events:
+        if _batch and socket_path != _batch[0][1]:
+            _send(_batch)
+            _batch = []
+        if socket_path is None:
+            _log(message)
+        else:
+            _batch.append((message, socket_path))
+    if _batch:
+        _send(_batch)
+
+
+def _log(message):
+    try:
+        Logger(Message.validated(message))
+    except (TypeError, ValueError, KeyError, AttributeError):
+        sys.stderr.write(
+            "Unable to log the message.%s\n" % message)
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        traceback.print_exception(
+            exc_type, exc_value, exc_tb, file=sys.stderr)
+
 
-    def _write(self, message):
+def _send(batch):
+    _json_strs = []
+    for message, socket_path in batch:
         try:
-            json_str = Message.to_json(message)
-            self.sock.connect(self.socket_path)
-            self._pack_and_send(json_str)
-        except (socket_error, socket_timeout, TypeError):
-            msg = Message.to_json(message)
+            _json_strs.append(Message.to_json(message))
+        except TypeError:
             exc_type, exc_value, exc_tb = sys.exc_info()
             traceback.print_exception(
                 exc_type, exc_value, exc_tb, file=sys.stderr)
+            sys.stderr.write(
+                "Unable to pass the message into socket.%s\n" %
+                message.__dict__)
+    if not _json_strs:
+        return
+    try:
+        transport(batch[0][1]).send(*_json_strs)
+    except (socket_error, socket_timeout):
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        traceback.print_exception(
+            exc_type, exc_value, exc_tb, file=sys.stderr)
+        for msg in _json_strs:
             sys.stderr.write(
                 "Unable to pass the message into socket.%s\n" % msg)
+
+
+class EventQueue(object):
+    """Bounded queue of the Events of the process.
+
+    While its emitter greenlet runs, Events are queued here instead of
+    being serialized and sent (or logged) by the caller. The emitter
+    wakes up on the first queued Event and emits the queued ones in
+    batches of batch_size, in order.
+
+    Once max_size Events are queued, the policy applies:
+    - "drop_oldest": the oldest queued Event is dropped (ring buffer)
+    - "drop_newest": the new Event is dropped
+    - "block": the caller emits a batch itself before queueing
+    Only debug and info messages which are not part of a job are ever
+    dropped. When there is none to drop, the caller emits a batch itself
+    as with "block". Dropped and blocked puts are counted in stats().
+    """
+
+    POLICIES = ["drop_oldest", "drop_newest", "block"]
+
+    def __init__(self, max_size=1024, batch_size=64, policy="drop_oldest"):
+        """Initializes a new EventQueue instance.
+
+        :param max_size: Max number of Events queued
+        :type max_size: int
+        :param batch_size: Max number of Events emitted at once
+        :type batch_size: int
+        :param policy: What to do of an Event while the queue is full
+        :type policy: str
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown event queue policy %s" % policy)
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.policy = policy
+        self.queued = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.emitted = 0
+        self.failures = 0
+        self._events = collections.deque()
+        self._emitter = None
+        self._ready = gevent.event.Event()
+        self._complete = gevent.event.Event()
+
+    @property
+    def enabled(self):
+        """Events are queued only while the emitter is running
+
+        """
+        return self._emitter is not None and not self._emitter.dead
+
+    def put(self, message, socket_path=None):
+        """Queues an Event, never blocks unless the policy is "block" or
+
+        none of the queued Events may be dropped
+
+        :param socket_path: Logging socket of the message, None to log it
+                            in this process
+        :type socket_path: str
+        """
+        if len(self._events) >= self.max_size:
+            if self.policy == "drop_newest" and _droppable(message):
+                self.dropped += 1
+                return
+            if self.policy != "drop_oldest" or not self._drop_oldest():
+                self.blocked += 1
+                self.flush(self.batch_size)
+        self._events.append((message, socket_path))
+        self.queued += 1
+        self._ready.set()
+
+    def flush(self, count=None):
+        """Emits the queued Events (or the count oldest ones)
+
+        :returns: Number of Events emitted
+        :rtype: int
+        """
+        if count is None:
+            count = len(self._events)
+        _events = [self._events.popleft()
+                   for _ in range(min(count, len(self._events)))]
+        if not _events:
+            return 0
+        try:
+            emit(_events)
+            self.emitted += len(_events)
+        except Exception:
+            # Never let a failed emit kill the emitter
+            self.failures += 1
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            traceback.print_exception(
+                exc_type, exc_value, exc_tb, file=sys.stderr)
+        return len(_events)
+
+    def _drop_oldest(self):
+        for idx, (message, socket_path) in enumerate(self._events):
+            if _droppable(message):
+                del self._events[idx]
+                self.dropped += 1
+                return True
+        return False
+
+    def stats(self):
+        return dict(queued=self.queued,
+                    dropped=self.dropped,
+                    blocked=self.blocked,
+                    emitted=self.emitted,
+                    failures=self.failures,
+                    size=len(self._events))
+
+    def start(self):
+        if self.enabled:
+            return
+        self._complete.clear()
+        self._emitter = gevent.spawn(self._run)
+
+    def stop(self):
+        """Stops the emitter and emits the queued Events
+
+        """
+        self._complete.set()
+        if self._emitter is not None:
+            self._emitter.kill(block=False)
+        self._emitter = None
+        self.flush()
+
+    def _run(self):
+        while not self._complete.is_set():
+            self._ready.wait()
+            self._ready.clear()
+            while self._events and not self._complete.is_set():
+                self.flush(self.batch_size)
+                # Let the callers run between two batches
+                gevent.sleep(0)
+
+
+# Messages of higher priorities are never dropped by an EventQueue
+_DROPPABLE_PRIORITIES = PRIORITIES[:PRIORITIES.index("info") + 1]
+
+
+def _droppable(message):
+    # Neither are the messages of a job
+    return getattr(message, "priority", None) in _DROPPABLE_PRIORITIES \
+        and getattr(message, "job_id", None) is None
+
+
+def _event_queue():
+    if "_int" not in NS:
+        return None
+    return NS._int.get("event_queue")
+
+
+class SocketTransport(object):
+    """Connection of the process to a logging socket, shared by its Events.
+
+    Each message is framed with its length ("=I" header). By default each
+    message is sent over its own connection, the node agent reading a
+    single frame per connection.
+
+    A persistent transport (only for receivers reading frames until the
+    connection closes) opens its connection on the first send and keeps
+    it open, a send failing on a connection closed by the other end (eg:
+    the node agent restarted) reconnects and sends once more. A forked
+    process opens its own connection. Several messages sent together are
+    framed in a single buffer and written out at once.
+
+    Sends of the greenlets are serialized so that their messages are
+    never interleaved.
+    """
+
+    def __init__(self, socket_path, timeout=5, persistent=False):
+        """Initializes a new SocketTransport instance.
+
+        :param socket_path: Path of the AF_UNIX logging socket
+        :type socket_path: str
+        :param timeout: Seconds a connect or a send may block
+        :type timeout: int
+        :param persistent: Send all the messages over one connection
+        :type persistent: bool
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.persistent = persistent
+        self.connects = 0
+        self.failures = 0
+        self.sent = 0
+        self._sock = None
+        self._pid = None
+        self._lock = gevent.lock.BoundedSemaphore()
+
+    def send(self, *messages):
+        """Sends the messages (JSON strings), in order
+
+        :raises socket.error: If the socket is down
+        """
+        if not self.persistent:
+            with self._lock:
+                for msg in messages:
+                    self._send_once(msg)
+            return
+        _frames = "".join(_frame(msg) for msg in messages)
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None or self._pid != os.getpid():
+                        self._connect()
+                    self._sock.sendall(_frames)
+                    self.sent += len(messages)
+                    return
+                except (socket_error, socket_timeout):
+                    self.failures += 1
+                    self.close()
+                    if attempt:
+                        raise
+
+    def _send_once(self, msg):
+        try:
+            self._connect()
+            self._sock.sendall(_frame(msg))
+            self.sent += 1
+        except (socket_error, socket_timeout):
+            self.failures += 1
+            raise
         finally:
-            self.sock.close()
-    
-    def _pack_and_send(self, msg):
-        frmt = "=%ds" % len(msg)
-        packedMsg = struct.pack(frmt, msg)
-        packedHdr = struct.pack('=I', len(packedMsg))
-        self._send(packedHdr)
-        self._send(packedMsg)
-
-    def _send(self, msg):
-        sent = 0
-        while sent < len(msg):
-            sent += self.sock.send(msg[sent:])
+            self.close()
+
+    def close(self):
+        if self._sock is not None and self._pid == os.getpid():
+            self._sock.close()
+        self._sock = None
+
+    def stats(self):
+        return dict(connects=self.connects, failures=self.failures,
+                    sent=self.sent)
+
+    def _connect(self):
+        self._sock = None
+        _sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        _sock.settimeout(self.timeout)
+        try:
+            _sock.connect(self.socket_path)
+        except (socket_error, socket_timeout):
+            _sock.close()
+            raise
+        self._sock = _sock
+        self._pid = os.getpid()
+        self.connects += 1
+
+
+_transports = {}
+
+
+def transport(socket_path):
+    """The SocketTransport of the process to socket_path
+
+    The connection is kept open only if the logging_socket_persistent
+    config is set, ie: the receiver reads several frames per connection.
+    """
+    if socket_path not in _transports:
+        _persistent = False
+        if "config" in NS:
+            _persistent = NS.config.data.get('logging_socket_persistent',
+                                             False)
+        _transports[socket_path] = SocketTransport(socket_path,
+                                                   persistent=_persistent)
+    return _transports[socket_path]
+
 
+def _frame(msg):
+    frmt = "=%ds" % len(msg)
+    packedMsg = struct.pack(frmt, msg)
+    return struct.pack('=I', len(packedMsg)) + packedMsg
@@ -71,42 +71,30 @@ class CreateCluster(flows.BaseFlow):
                         self.parameters
                     )
 
-            while True:
-                gevent.sleep(3)
-                all_status = {}
-                for job_id in ssh_job_ids:
-                    # noinspection PyUnresolvedReferences
-                    all_status[job_id] = NS._int.client.read(
-                        "/queue/%s/status" % job_id).value
-
-                _failed = {_jid: status for _jid, status in
-                           all_status.iteritems() if status == "failed"}
-                if _failed:
-                    raise FlowExecutionFailedError(
-                        "SSH setup failed for jobs %s cluster %s" % (str(
-                            _failed), integration_id))
-                if all([status == "finished" for status in
-                        all_status.values()]):
-                    Event(
-                        Message(
-                            job_id=self.parameters['job_id'],
-                            flow_id=self.parameters['flow_id'],
-                            priority="info",
-                            publisher=NS.publisher_id,
-                            payload={"message": "SSH setup completed for all "
-                                                "nodes in cluster %s" %
-                                                integration_id
-                                     }
-                        )
-                    )
-                    # set this node as gluster provisioner
-                    if "gluster" in self.parameters["TendrlContext.sds_name"]:
-                        tags = ["provisioner/%s" % integration_id]
-                        NS.node_context = NS.node_context.load()
-                        tags += NS.node_context.tags
-                        NS.node_context.tags = list(set(tags))
-                        NS.node_context.save()
-                    break
+            _failed = create_cluster_utils.wait_for_jobs(ssh_job_ids)
+            if _failed:
+                raise FlowExecutionFailedError(
+                    "SSH setup failed for jobs %s cluster %s" % (str(
+                        _failed), integration_id))
+            Event(
+                Message(
+                    job_id=self.parameters['job_id'],
+                    flow_id=self.parameters['flow_id'],
+                    priority="info",
+                    publisher=NS.publisher_id,
+                    payload={"message": "SSH setup completed for all "
+                                        "nodes in cluster %s" %
+                                        integration_id
+                             }
+                )
+            )
+            # set this node as gluster provisioner
+            if "gluster" in self.parameters["TendrlContext.sds_name"]:
+                tags = ["provisioner/%s" % integration_id]
+                NS.node_context = NS.node_context.load()
+                tags += NS.node_context.tags
+                NS.node_context.tags = list(set(tags))
+                NS.node_context.save()
 
             Event(
                 Message(
@@ -1,15 +1,28 @@
 import copy
+import time
 import uuid
 
-from etcd import EtcdKeyNotFound
+import etcd
 
 from tendrl.commons.event import Event
 from tendrl.commons.flows.exceptions import FlowExecutionFailedError
 from tendrl.commons.message import Message
 from tendrl.commons.objects.job import Job
 from tendrl.commons.utils import ansible_module_runner
+from tendrl.commons.utils import etcd_utils
+from tendrl.commons.utils.central_store import lock
 from tendrl.commons.utils.ssh import authorize_key
 
+# Seconds a node lock outlives its holder, held locks are refreshed by a
+# heartbeat greenlet
+NODE_LOCK_TTL = 60
+
+# Node locks held by the jobs running in this process, by job id
+_node_locks = {}
+
+# Seconds a flow waits for its child jobs
+JOB_WAIT_TIMEOUT = 3600
+
 
 def ceph_create_ssh_setup_jobs(parameters):
     node_list = parameters['Node[]']
@@ -198,65 +211,114 @@ def acquire_node_lock(parameters):
     if "parent" in job.payload:
         p_job_id = job.payload['parent']
 
-    for node in parameters['Node[]']:
-        key = "/nodes/%s/locked_by" % node
-        try:
-            lock_owner_job = NS._int.client.read(key).value
-            # If the parent job has aquired lock on participating nodes,
-            # dont you worry child job :)
-            if p_job_id == lock_owner_job:
-                continue
-            else:
-                raise FlowExecutionFailedError("Cannot proceed further, "
-                                               "Node (%s) is already locked "
-                                               "by Job (%s)" % (node,
-                                                                lock_owner_job)
-                                               )
-        except EtcdKeyNotFound:
-            # To check what are all the nodes are already locked
-            continue
+    # If the parent job has aquired lock on participating nodes,
+    # dont you worry child job :)
+    _lock = lock.Lock(
+        [_node_lock_key(node) for node in parameters['Node[]']],
+        str(parameters['job_id']),
+        ttl=NODE_LOCK_TTL,
+        shared_with=[p_job_id] if p_job_id else []
+    )
+    try:
+        _lock.acquire()
+    except lock.LockHeldError as ex:
+        raise FlowExecutionFailedError("Cannot proceed further, "
+                                       "Node (%s) is already locked "
+                                       "by Job (%s)" % (
+                                           ex.key.split("/")[2], ex.owner)
+                                       )
+    _node_locks[str(parameters['job_id'])] = _lock
 
-    for node in parameters['Node[]']:
-        try:
-            lock_owner_job = NS._int.client.read(key).value
-            if p_job_id == lock_owner_job:
-                continue
-        except EtcdKeyNotFound:
-            lock_owner_job = str(parameters["job_id"])
-            key = "nodes/%s/locked_by" % node
-            NS._int.client.write(key, lock_owner_job)
-            Event(
-                Message(
-                    job_id=parameters['job_id'],
-                    flow_id=parameters['flow_id'],
-                    priority="info",
-                    publisher=NS.publisher_id,
-                    payload={
-                        "message": "Acquired lock (%s) for Node (%s)" % (
-                            lock_owner_job, node)
-                    }
-                )
+    for key in _lock.owned:
+        Event(
+            Message(
+                job_id=parameters['job_id'],
+                flow_id=parameters['flow_id'],
+                priority="info",
+                publisher=NS.publisher_id,
+                payload={
+                    "message": "Acquired lock (%s) for Node (%s)" % (
+                        _lock.owner, key.split("/")[2])
+                }
             )
+        )
 
 
 def release_node_lock(parameters):
-    for node in parameters['Node[]']:
-        key = "/nodes/%s/locked_by" % node
-        try:
-            lock_owner_job = NS._int.client.read(key).value
-            if lock_owner_job == parameters['job_id']:
-                NS._int.client.delete(key)
-                Event(
-                    Message(
-                        job_id=parameters['job_id'],
-                        flow_id=parameters['flow_id'],
-                        priority="info",
-                        publisher=NS.publisher_id,
-                        payload={
-                            "message": "Released lock (%s) for Node (%s)" %
-                                       (lock_owner_job, node)
-                        }
-                    )
-                )
-        except EtcdKeyNotFound:
-            continue
+    _lock = _node_locks.pop(str(parameters['job_id']), None)
+    if _lock is None:
+        # Not locked by this process (eg: the agent restarted), release
+        # whatever is still held by the job
+        _lock = lock.Lock(
+            [_node_lock_key(node) for node in parameters['Node[]']],
+            str(parameters['job_id'])
+        )
+        _lock.owned = list(_lock.keys)
+
+    for key in _lock.release():
+        Event(
+            Message(
+                job_id=parameters['job_id'],
+                flow_id=parameters['flow_id'],
+                priority="info",
+                publisher=NS.publisher_id,
+                payload={
+                    "message": "Released lock (%s) for Node (%s)" %
+                               (_lock.owner, key.split("/")[2])
+                }
+            )
+        )
+
+
+def _node_lock_key(node):
+    return "/nodes/%s/locked_by" % node
+
+
+def wait_for_jobs(job_ids, timeout=JOB_WAIT_TIMEOUT):
+    """Waits for the jobs to finish, following their status with a watch
+
+    :returns: As soon as all jobs are "finished" ({}) or any "failed"
+              ({job_id: "failed"})
+    :rtype: dict
+    :raises FlowExecutionFailedError: when the jobs are still running
+                                      after timeout seconds
+    """
+    _deadline = time.time() + timeout
+    _pending = set(job_ids)
+    while _pending:
+        # Status of the pending jobs, the watch below resumes from the
+        # first read so that no change in between is missed
+        _reads = []
+        for job_id in list(_pending):
+            _status = etcd_utils.read("/queue/%s/status" % job_id)
+            _reads.append(_status)
+            if _status.value == "failed":
+                return {job_id: "failed"}
+            if _status.value == "finished":
+                _pending.discard(job_id)
+        if _pending:
+            _etcd_index = _reads[0].etcd_index
+
+        while _pending:
+            _remaining = _deadline - time.time()
+            if _remaining <= 0:
+                raise FlowExecutionFailedError(
+                    "Timed out waiting for jobs %s" % sorted(_pending))
+            try:
+                _change = etcd_utils.watch("/queue", _etcd_index,
+                                           timeout=_remaining)
+            except etcd.EtcdWatchTimedOut:
+                continue
+            except etcd.EtcdEventIndexCleared:
+                # Missed changes, read the status again
+                break
+            _etcd_index = _change.modifiedIndex
+            _parts = _change.key.strip("/").split("/")
+            if len(_parts) != 3 or _parts[2] != "status" or \
+                    _parts[1] not in _pending:
+                continue
+            if _change.value == "failed":
+                return {_parts[1]: "failed"}
+            if _change.value == "finished":
+                _pending.discard(_parts[1])
+    return {}
@@ -45,35 +45,23 @@ class ExpandCluster(flows.BaseFlow):
                         skip_current_node=True
                     )
 
-            while True:
-                gevent.sleep(3)
-                all_status = {}
-                for job_id in ssh_job_ids:
-                    all_status[job_id] = NS._int.client.read(
-                        "/queue/%s/status" % job_id).value
-
-                _failed = {_jid: status for _jid, status in
-                           all_status.iteritems() if status == "failed"}
-                if _failed:
-                    raise FlowExecutionFailedError(
-                        "SSH setup failed for jobs %s cluster %s" % (str(
-                            _failed), integration_id))
-                if all([status == "finished" for status in
-                        all_status.values()]):
-                    Event(
-                        Message(
-                            job_id=self.parameters['job_id'],
-                            flow_id=self.parameters['flow_id'],
-                            priority="info",
-                            publisher=NS.publisher_id,
-                            payload={
-                                "message": "SSH setup completed for all "
-                                "nodes in cluster %s" % integration_id
-                            }
-                        )
-                    )
-
-                    break
+            _failed = create_cluster_utils.wait_for_jobs(ssh_job_ids)
+            if _failed:
+                raise FlowExecutionFailedError(
+                    "SSH setup failed for jobs %s cluster %s" % (str(
+                        _failed), integration_id))
+            Event(
+                Message(
+                    job_id=self.parameters['job_id'],
+                    flow_id=self.parameters['flow_id'],
+                    priority="info",
+                    publisher=NS.publisher_id,
+                    payload={
+                        "message": "SSH setup completed for all "
+                        "nodes in cluster %s" % integration_id
+                    }
+                )
+            )
 
             # SSH setup jobs finished above, now install sds
             # bits and create cluster
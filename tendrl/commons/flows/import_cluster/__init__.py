@@ -2,7 +2,6 @@ import json
 import uuid
 
 import etcd
-import gevent
 
 from tendrl.commons.event import Event
 from tendrl.commons import flows
@@ -112,46 +111,35 @@ class ImportCluster(flows.BaseFlow):
                         create_cluster_utils.gluster_create_ssh_setup_jobs(
                             self.parameters)
 
-                    while True:
-                        gevent.sleep(3)
-                        all_status = {}
-                        for job_id in ssh_job_ids:
-                            all_status[job_id] = NS._int.client.read(
-                                "/queue/%s/status" % job_id).value
-
-                        _failed = {_jid: status for _jid, status in
-                                   all_status.iteritems() if status ==
-                                   "failed"}
-                        if _failed:
-                            _msg = "SSH setup failed for jobs %s cluster %s" \
-                                   % (str(_failed), integration_id)
-                            raise FlowExecutionFailedError(_msg)
-                        if all([status == "finished" for status in
-                                all_status.values()]):
-                            Event(
-                                Message(
-                                    job_id=self.parameters['job_id'],
-                                    flow_id=self.parameters['flow_id'],
-                                    priority="info",
-                                    publisher=NS.publisher_id,
-                                    payload={"message": "SSH setup completed "
-                                                        "for all nodes in "
-                                                        "cluster %s" %
-                                                        integration_id
-                                             }
-                                )
-                            )
-                            # set this node as gluster provisioner
-                            tags = ["provisioner/%s" % integration_id]
-                            NS.node_context = NS.node_context.load()
-                            tags += NS.node_context.tags
-                            NS.node_context.tags = list(set(tags))
-                            NS.node_context.save()
+                    _failed = create_cluster_utils.wait_for_jobs(
+                        ssh_job_ids)
+                    if _failed:
+                        _msg = "SSH setup failed for jobs %s cluster %s" \
+                               % (str(_failed), integration_id)
+                        raise FlowExecutionFailedError(_msg)
+                    Event(
+                        Message(
+                            job_id=self.parameters['job_id'],
+                            flow_id=self.parameters['flow_id'],
+                            priority="info",
+                            publisher=NS.publisher_id,
+                            payload={"message": "SSH setup completed "
+                                                "for all nodes in "
+                                                "cluster %s" %
+                                                integration_id
+                                     }
+                        )
+                    )
+                    # set this node as gluster provisioner
+                    tags = ["provisioner/%s" % integration_id]
+                    NS.node_context = NS.node_context.load()
+                    tags += NS.node_context.tags
+                    NS.node_context.tags = list(set(tags))
+                    NS.node_context.save()
 
-                            # set gdeploy_provisioned to true so that no
-                            # other nodes tries to configure gdeploy
-                            self.parameters['gdeploy_provisioned'] = True
-                            break
+                    # set gdeploy_provisioned to true so that no
+                    # other nodes tries to configure gdeploy
+                    self.parameters['gdeploy_provisioned'] = True
 
             NS.tendrl_context = NS.tendrl_context.load()
             NS.tendrl_context.integration_id = integration_id
@@ -352,34 +340,26 @@ class ImportCluster(flows.BaseFlow):
                 )
             )
 
-            # An import is sucessfull once all Node[] register to
-            # /clusters/:integration_id/nodes/:node_id
-            while True:
-                _all_node_status = []
-                gevent.sleep(3)
-                for node_id in self.parameters['Node[]']:
-                    _status = NS.tendrl.ojects.ClusterNodeContext(
-                        node_id=node_id).exists() and \
-                        NS.tendrl.objects.ClusterTendrlContext(
-                        integration_id=integration_id).exists()
-                    _all_node_status.append(_status)
-                if _all_node_status:
-                    if all(_all_node_status):
-                        Event(
-                            Message(
-                                job_id=self.parameters['job_id'],
-                                flow_id=self.parameters['flow_id'],
-                                priority="info",
-                                publisher=NS.publisher_id,
-                                payload={"message": "Import Cluster "
-                                                    "completed for all nodes "
-                                                    "in cluster %s" %
-                                                    integration_id
-                                         }
-                            )
-                        )
-
-                        break
+            # An import is sucessfull once the import jobs of all the
+            # other Node[] are done
+            _failed = create_cluster_utils.wait_for_jobs(cluster_nodes)
+            if _failed:
+                raise FlowExecutionFailedError(
+                    "Import failed for jobs %s cluster %s" % (str(
+                        _failed), integration_id))
+            Event(
+                Message(
+                    job_id=self.parameters['job_id'],
+                    flow_id=self.parameters['flow_id'],
+                    priority="info",
+                    publisher=NS.publisher_id,
+                    payload={"message": "Import Cluster "
+                                        "completed for all nodes "
+                                        "in cluster %s" %
+                                        integration_id
+                             }
+                )
+            )
 
             Event(
                 Message(
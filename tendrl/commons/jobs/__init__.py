@@ -1,27 +1,150 @@
+import collections
 import datetime
 import json
+import sys
+import time
 import traceback
 
 
 import etcd
 import gevent.event
+import gevent.lock
+import gevent.pool
 from pytz import utc
 
 
 from tendrl.commons.event import Event
 from tendrl.commons.flows.exceptions import FlowExecutionFailedError
+from tendrl.commons.jobs import retention
 from tendrl.commons.message import ExceptionMessage
 from tendrl.commons.message import Message
 from tendrl.commons.objects import AtomExecutionFailedError
+from tendrl.commons.objects import job as job_index
 from tendrl.commons.objects.job import Job
+from tendrl.commons.utils import etcd_utils
 from tendrl.commons.utils import time_utils
 
 
+# Seconds after which an idle /queue watch is renewed, this is also the
+# interval at which the tendrl/monitor node rescans the whole queue to
+# time out stale "new" jobs
+JOB_WATCH_TIMEOUT = 60
+
+# Defaults of the job retention config, run by the tendrl/monitor node:
+# terminal jobs older than job_retention_age seconds, or beyond the newest
+# job_retention_max ones, are archived every job_retention_interval seconds
+# and the archive expires after job_archive_ttl seconds
+JOB_RETENTION_INTERVAL = 3600
+JOB_RETENTION_AGE = 7 * 24 * 3600
+JOB_RETENTION_MAX = 1000
+JOB_ARCHIVE_TTL = 30 * 24 * 3600
+
+
+class JobExecutor(object):
+    """Runs process_job() on a bounded pool of greenlets.
+
+    A job is handled by at most one greenlet of this node at a time, and
+    flows listed in flow_concurrency ({flow fqdn: max concurrent jobs})
+    are further limited on top of the pool size. Submitting blocks while
+    the pool is full, which throttles the job consumer.
+
+    A job of a flow with no free slot is left unclaimed, for another node
+    to pick up, and submitted again once a job of the flow is done.
+    """
+
+    def __init__(self, size=32, flow_concurrency=None):
+        self._pool = gevent.pool.Pool(size)
+        self._flow_concurrency = flow_concurrency or {}
+        self._flow_slots = {}
+        # {flow fqdn: OrderedDict(job id: None)} of the jobs left unclaimed
+        self._deferred = {}
+        self._in_flight = set()
+        self.skipped = 0
+        self.deferred = 0
+
+    def submit(self, jid):
+        if jid in self._in_flight:
+            self.skipped += 1
+            return None
+        _flow = self._flow(jid)
+        _slot = self.flow_slot(_flow)
+        if _slot is not None and not _slot.acquire(blocking=False):
+            self._deferred.setdefault(
+                _flow, collections.OrderedDict())[jid] = None
+            self.deferred += 1
+            return None
+        self._in_flight.add(jid)
+        try:
+            greenlet = self._pool.spawn(process_job, jid)
+        except Exception:
+            self._in_flight.discard(jid)
+            if _slot is not None:
+                _slot.release()
+            raise
+        greenlet.link(lambda _greenlet: self._done(jid, _flow, _slot))
+        return greenlet
+
+    def flow_slot(self, flow):
+        if flow not in self._flow_concurrency:
+            return None
+        if flow not in self._flow_slots:
+            self._flow_slots[flow] = gevent.lock.BoundedSemaphore(
+                self._flow_concurrency[flow])
+        return self._flow_slots[flow]
+
+    def _flow(self, jid):
+        # Fqdn of the flow run by the job, when flows are limited
+        if not self._flow_concurrency:
+            return None
+        try:
+            _payload = json.loads(
+                etcd_utils.read("/queue/%s/payload" % jid).value)
+        except (etcd.EtcdKeyNotFound, TypeError, ValueError):
+            return None
+        return (_payload or {}).get("run")
+
+    def _done(self, jid, flow, slot):
+        self._in_flight.discard(jid)
+        if slot is None:
+            return
+        slot.release()
+        _deferred = self._deferred.get(flow)
+        if _deferred:
+            # Links run in the hub, which must not block on the read of
+            # the job. The job may have been claimed by another node
+            # meanwhile, which process_job() checks.
+            _jid, _ = _deferred.popitem(last=False)
+            gevent.spawn(self.submit, _jid)
+
+    def stats(self):
+        """Queue depth of this node
+
+        :returns: in_flight: jobs submitted and not done yet, running: busy
+                  greenlets of the pool, size: pool size, skipped: jobs not
+                  submitted as already in flight, deferred: jobs left
+                  unclaimed as their flow had no free slot, flows: running
+                  jobs per limited flow
+        """
+        _flows = {}
+        for flow, slot in self._flow_slots.iteritems():
+            _flows[flow] = self._flow_concurrency[flow] - slot.counter
+        return dict(in_flight=len(self._in_flight),
+                    running=len(self._pool),
+                    size=self._pool.size,
+                    skipped=self.skipped,
+                    deferred=self.deferred,
+                    flows=_flows)
+
+
 class JobConsumerThread(gevent.greenlet.Greenlet):
 
     def __init__(self):
         super(JobConsumerThread, self).__init__()
         self._complete = gevent.event.Event()
+        self._etcd_index = None
+        self._synced_at = 0
+        self._purged_at = 0
+        self._executor = None
 
     def _run(self):
         Event(
@@ -31,33 +154,146 @@ class JobConsumerThread(gevent.greenlet.Greenlet):
                 payload={"message": "%s running" % self.__class__.__name__}
             )
         )
+        if self._executor is None:
+            self._executor = JobExecutor(
+                size=NS.config.data.get("job_concurrency", 32),
+                flow_concurrency=NS.config.data.get(
+                    "job_flow_concurrency", {})
+            )
         while not self._complete.is_set():
-            _job_sync_interval = 5
-            NS.node_context = NS.node_context.load()
-            if "tendrl/monitor" in NS.node_context.tags:
-                _job_sync_interval = 3
-
-            gevent.sleep(_job_sync_interval)
+            if self._purge_due():
+                self._purged_at = time.time()
+                gevent.spawn(self._purge)
             try:
-                jobs = NS._int.client.read("/queue")
+                if self._etcd_index is None or self._sync_due():
+                    self._sync()
+                else:
+                    self._watch()
             except etcd.EtcdKeyNotFound:
+                # No job submitted yet
+                gevent.sleep(5)
+            except etcd.EtcdWatchTimedOut:
                 continue
+            except etcd.EtcdEventIndexCleared:
+                # Missed events, rescan the queue
+                self._etcd_index = None
+            except (etcd.EtcdConnectionFailed, etcd.EtcdException):
+                sys.stderr.write("Job consumer lost connection to central "
+                                 "store, resyncing...\n")
+                # The calls were retried and the client reconnected
+                # already (see connection.call)
+                self._etcd_index = None
+                gevent.sleep(1)
+
+    def _sync_due(self):
+        return "tendrl/monitor" in NS.node_context.tags and \
+            time.time() >= self._synced_at + JOB_WATCH_TIMEOUT
+
+    def _purge_due(self):
+        return "tendrl/monitor" in NS.node_context.tags and \
+            time.time() >= self._purged_at + NS.config.data.get(
+                "job_retention_interval", JOB_RETENTION_INTERVAL)
+
+    def _purge(self):
+        try:
+            _archived = retention.purge_jobs(
+                NS.config.data.get("job_retention_age", JOB_RETENTION_AGE),
+                NS.config.data.get("job_retention_max", JOB_RETENTION_MAX),
+                NS.config.data.get("job_archive_ttl", JOB_ARCHIVE_TTL)
+            )
+        except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
+            Event(
+                ExceptionMessage(
+                    priority="error",
+                    publisher=NS.publisher_id,
+                    payload={"message": "Failed to archive old jobs",
+                             "exception": ex
+                             }
+                )
+            )
+        else:
+            Event(
+                Message(
+                    priority="debug",
+                    publisher=NS.publisher_id,
+                    payload={"message": "Archived %s old jobs" % _archived}
+                )
+            )
 
-            for job in jobs.leaves:
-                gevent.spawn(process_job, job)
+    def _sync(self):
+        """Dispatches the candidate jobs and watches from there on.
+
+        The first sync scans the whole queue, later ones (monitor rescans,
+        recovery from missed events) only list the job index: every "new"
+        job for the tendrl/monitor node, else the "new" jobs routed to
+        the tags of this node.
+        """
+        # Routing tags change rarely, a stale read only delays a job to
+        # the next sync
+        NS.node_context = NS.node_context.load(
+            consistency=etcd_utils.SERIALIZABLE)
+        _job_ids = None
+        if self._synced_at:
+            _tags = NS.node_context.tags
+            if "tendrl/monitor" in _tags:
+                _tags = None
+            try:
+                self._etcd_index, _job_ids = job_index.indexed_job_ids(
+                    tags=_tags)
+            except etcd.EtcdKeyNotFound:
+                pass
+        if _job_ids is None:
+            jobs = etcd_utils.read("/queue")
+            self._etcd_index = jobs.etcd_index
+            _job_ids = [job.key.split('/')[-1] for job in jobs.leaves]
+        self._synced_at = time.time()
+        for jid in _job_ids:
+            self._executor.submit(jid)
+
+    def _watch(self):
+        """Dispatches the next new job, or job changed back to "new"
+
+        """
+        change = etcd_utils.watch("/queue", self._etcd_index,
+                                  timeout=JOB_WATCH_TIMEOUT)
+        self._etcd_index = change.modifiedIndex
+        jid = _dispatchable_job_id(change)
+        if jid:
+            self._executor.submit(jid)
+
+    def stats(self):
+        if self._executor is None:
+            return {}
+        return self._executor.stats()
 
     def stop(self):
         self._complete.set()
 
 
-def process_job(job):
-    jid = job.key.split('/')[-1]
+def _dispatchable_job_id(change):
+    # Job.save() writes the job attrs in parallel, either of payload and
+    # status may land last and make the job processable
+    if change.action in ["delete", "expire"]:
+        return None
+    _parts = change.key.strip("/").split("/")
+    if len(_parts) != 3:
+        return None
+    if _parts[2] == "payload" or \
+            (_parts[2] == "status" and change.value == "new"):
+        return _parts[1]
+    return None
+
+
+def process_job(jid):
+    """Runs the job if it is "new" and routed to this node
+
+    :param jid: Id of the job
+    """
     job_status_key = "/queue/%s/status" % jid
     job_lock_key = "/queue/%s/locked_by" % jid
-    NS.node_context = NS.node_context.load()
     # Check job not already locked by some agent
     try:
-        _locked_by = NS._int.client.read(job_lock_key).value
+        _locked_by = etcd_utils.read(job_lock_key).value
         if _locked_by:
             return
     except etcd.EtcdKeyNotFound:
@@ -65,12 +301,17 @@ def process_job(job):
 
     # Check job not already "finished", or "processing"
     try:
-        _status = NS._int.client.read(job_status_key).value
+        _status = etcd_utils.read(job_status_key).value
         if _status in ["finished", "processing"]:
             return
     except etcd.EtcdKeyNotFound:
         pass
 
+    # Match the job against the current tags of this node, NodeContext
+    # is served from NS._int.cache while its watch is up
+    NS.node_context = NS.node_context.load(
+        consistency=etcd_utils.SERIALIZABLE)
+
     # tendrl-node-agent tagged as tendrl/monitor will ensure
     # >10 min old "new" jobs are timed out and marked as
     # "failed" (the parent job of these jobs will also be
@@ -79,8 +320,7 @@ def process_job(job):
         _job_valid_until_key = "/queue/%s/valid_until" % jid
         _valid_until = None
         try:
-            _valid_until = NS._int.client.read(
-                _job_valid_until_key).value
+            _valid_until = etcd_utils.read(_job_valid_until_key).value
         except etcd.EtcdKeyNotFound:
             pass
 
@@ -94,13 +334,15 @@ def process_job(job):
                 # mark status as "failed" and Job.error =
                 # "Timed out"
                 try:
-                    NS._int.wclient.write(job_status_key,
-                                          "failed",
-                                          prevValue="new")
+                    etcd_utils.write(job_status_key, "failed",
+                                     prev_value="new")
                 except etcd.EtcdCompareFailed:
                     pass
                 else:
                     job = Job(job_id=jid).load()
+                    job_index.move_job_index(
+                        jid, "new", "failed",
+                        (job.payload or {}).get("tags", []))
                     _msg = str("Timed-out (>10min as 'new')")
                     job.errors = _msg
                     job.save()
@@ -112,8 +354,14 @@ def process_job(job):
             # noinspection PyTypeChecker
             _now_plus_10_epoch = (_now_plus_10 -
                                   _epoch_start).total_seconds()
-            NS._int.wclient.write(_job_valid_until_key,
-                                  int(_now_plus_10_epoch))
+            etcd_utils.write(_job_valid_until_key, int(_now_plus_10_epoch))
+
+            # First sight of the job, index it in case it was submitted
+            # from outside (eg: tendrl-api) without going through Job.save()
+            _job = Job(job_id=jid).load()
+            if _job.status == "new" and _job.payload:
+                job_index.index_job(jid, "new",
+                                    _job.payload.get("tags", []))
 
     job = Job(job_id=jid).load()
     if job.payload["type"] == NS.type and \
@@ -143,129 +391,135 @@ def process_job(job):
             )
             return
 
-        job_status_key = "/queue/%s/status" % job.job_id
-        job_lock_key = "/queue/%s/locked_by" % job.job_id
-        try:
-            lock_info = dict(node_id=NS.node_context.node_id,
-                             fqdn=NS.node_context.fqdn,
-                             tags=NS.node_context.tags,
-                             type=NS.type)
-            NS._int.wclient.write(job_lock_key,
-                                  json.dumps(lock_info))
-            NS._int.wclient.write(job_status_key, "processing",
-                                  prevValue="new")
-        except etcd.EtcdCompareFailed:
-            # job is already being processed by some tendrl
-            # agent
-            return
+        _run_job(job)
 
-        the_flow = None
-        try:
-            current_ns, flow_name, obj_name = \
-                _extract_fqdn(job.payload['run'])
 
-            if obj_name:
-                runnable_flow = current_ns.ns.get_obj_flow(
-                    obj_name, flow_name)
-            else:
-                runnable_flow = current_ns.ns.get_flow(flow_name)
+def _run_job(job):
+    job_status_key = "/queue/%s/status" % job.job_id
+    job_lock_key = "/queue/%s/locked_by" % job.job_id
+    try:
+        lock_info = dict(node_id=NS.node_context.node_id,
+                         fqdn=NS.node_context.fqdn,
+                         tags=NS.node_context.tags,
+                         type=NS.type)
+        etcd_utils.write(job_lock_key, json.dumps(lock_info))
+        etcd_utils.write(job_status_key, "processing", prev_value="new")
+    except etcd.EtcdCompareFailed:
+        # job is already being processed by some tendrl
+        # agent
+        return
+    job_index.move_job_index(job.job_id, "new", "processing",
+                             job.payload.get("tags", []))
 
-            the_flow = runnable_flow(parameters=job.payload[
-                'parameters'], job_id=job.job_id)
-            Event(
-                Message(
-                    job_id=job.job_id,
-                    flow_id=the_flow.parameters['flow_id'],
-                    priority="info",
-                    publisher=NS.publisher_id,
-                    payload={"message": "Processing Job %s" %
-                                        job.job_id
-                             }
-                )
+    the_flow = None
+    try:
+        current_ns, flow_name, obj_name = \
+            _extract_fqdn(job.payload['run'])
+
+        if obj_name:
+            runnable_flow = current_ns.ns.get_obj_flow(
+                obj_name, flow_name)
+        else:
+            runnable_flow = current_ns.ns.get_flow(flow_name)
+
+        the_flow = runnable_flow(parameters=job.payload[
+            'parameters'], job_id=job.job_id)
+        Event(
+            Message(
+                job_id=job.job_id,
+                flow_id=the_flow.parameters['flow_id'],
+                priority="info",
+                publisher=NS.publisher_id,
+                payload={"message": "Processing Job %s" %
+                                    job.job_id
+                         }
             )
+        )
 
-            Event(
-                Message(
-                    job_id=job.job_id,
-                    flow_id=the_flow.parameters['flow_id'],
-                    priority="info",
-                    publisher=NS.publisher_id,
-                    payload={"message": "Running Flow %s" %
-                                        job.payload['run']
-                             }
-                )
+        Event(
+            Message(
+                job_id=job.job_id,
+                flow_id=the_flow.parameters['flow_id'],
+                priority="info",
+                publisher=NS.publisher_id,
+                payload={"message": "Running Flow %s" %
+                                    job.payload['run']
+                         }
             )
-            the_flow.run()
-            try:
-                NS._int.wclient.write(job_status_key,
-                                      "finished",
-                                      prevValue="processing")
-            except etcd.EtcdCompareFailed:
-                # This should not happen!
-                _msg = "Cannot mark job as 'finished', " \
-                       "current job status invalid"
-                raise FlowExecutionFailedError(_msg)
+        )
+        the_flow.run()
+        try:
+            etcd_utils.write(job_status_key, "finished",
+                             prev_value="processing")
+        except etcd.EtcdCompareFailed:
+            # This should not happen!
+            _msg = "Cannot mark job as 'finished', " \
+                   "current job status invalid"
+            raise FlowExecutionFailedError(_msg)
+        job_index.move_job_index(job.job_id, "processing", "finished",
+                                 job.payload.get("tags", []))
 
+        Event(
+            Message(
+                job_id=job.job_id,
+                flow_id=the_flow.parameters['flow_id'],
+                priority="info",
+                publisher=NS.publisher_id,
+                payload={"message": "Job (%s):  Finished "
+                                    "Flow %s" % (
+                                        job.job_id,
+                                        job.payload['run'])
+                         }
+            )
+        )
+    except (FlowExecutionFailedError,
+            AtomExecutionFailedError,
+            Exception) as e:
+        _trace = str(traceback.format_exc(e))
+        _msg = "Failure in Job %s Flow %s with error:" % \
+               (job.job_id, job.payload['run'])
+        Event(
+            ExceptionMessage(
+                priority="error",
+                publisher=NS.publisher_id,
+                payload={"message": _msg + _trace,
+                         "exception": e
+                         }
+            )
+        )
+        if the_flow:
             Event(
                 Message(
                     job_id=job.job_id,
                     flow_id=the_flow.parameters['flow_id'],
-                    priority="info",
+                    priority="error",
                     publisher=NS.publisher_id,
-                    payload={"message": "Job (%s):  Finished "
-                                        "Flow %s" % (
-                                            job.job_id,
-                                            job.payload['run'])
-                             }
+                    payload={"message": _msg + "\n" + _trace}
                 )
             )
-        except (FlowExecutionFailedError,
-                AtomExecutionFailedError,
-                Exception) as e:
-            _trace = str(traceback.format_exc(e))
-            _msg = "Failure in Job %s Flow %s with error:" % \
-                   (job.job_id, job.payload['run'])
+        else:
             Event(
-                ExceptionMessage(
+                Message(
                     priority="error",
                     publisher=NS.publisher_id,
-                    payload={"message": _msg + _trace,
-                             "exception": e
-                             }
+                    payload={"message": _msg + "\n" + _trace}
                 )
             )
-            if the_flow:
-                Event(
-                    Message(
-                        job_id=job.job_id,
-                        flow_id=the_flow.parameters['flow_id'],
-                        priority="error",
-                        publisher=NS.publisher_id,
-                        payload={"message": _msg + "\n" + _trace}
-                    )
-                )
-            else:
-                Event(
-                    Message(
-                        priority="error",
-                        publisher=NS.publisher_id,
-                        payload={"message": _msg + "\n" + _trace}
-                    )
-                )
 
-            try:
-                NS._int.wclient.write(job_status_key,
-                                      "failed",
-                                      prevValue="processing")
-            except etcd.EtcdCompareFailed:
-                # This should not happen!
-                _msg = "Cannot mark job as 'failed', current" \
-                       "job status invalid"
-                raise FlowExecutionFailedError(_msg)
-            else:
-                job = job.load()
-                job.errors = _trace
-                job.save()
+        try:
+            etcd_utils.write(job_status_key, "failed",
+                             prev_value="processing")
+        except etcd.EtcdCompareFailed:
+            # This should not happen!
+            _msg = "Cannot mark job as 'failed', current" \
+                   "job status invalid"
+            raise FlowExecutionFailedError(_msg)
+        else:
+            job_index.move_job_index(job.job_id, "processing", "failed",
+                                     job.payload.get("tags", []))
+            job = job.load()
+            job.errors = _trace
+            job.save()
 
 
 def _extract_fqdn(flow_fqdn):
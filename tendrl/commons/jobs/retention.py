@@ -0,0 +1,161 @@
+import calendar
+import json
+import time
+
+from dateutil import parser
+import etcd
+
+from tendrl.commons.event import Event
+from tendrl.commons.message import Message
+from tendrl.commons.objects.job import JOB_INDEX
+from tendrl.commons.objects.job import JOB_STATUSES
+from tendrl.commons.objects.job import unindex_job
+from tendrl.commons.utils import etcd_utils
+
+# Terminal jobs are moved out of /queue into /archive/queue/<job_id>, one
+# json value per job, which etcd expires after the archive TTL
+ARCHIVE = "/archive/queue"
+TERMINAL_STATUSES = ["finished", "failed"]
+
+
+def purge_jobs(max_age, max_jobs, archive_ttl):
+    """Archives the terminal jobs older than max_age seconds, and the
+
+    oldest ones beyond max_jobs, so the size of /queue stays bounded by
+    the jobs of the last max_age seconds. Finished children of a job
+    still running are kept, their parent waits on their status.
+
+    :returns: Number of archived jobs
+    :rtype: int
+    """
+    _jobs, _indexed = _indexed_jobs()
+    _jobs += _unindexed_jobs(_indexed)
+
+    # Oldest first
+    _jobs.sort()
+    _expire_before = time.time() - max_age
+    _overflow = len(_jobs) - max_jobs
+    _archived = 0
+    _parent_statuses = {}
+    for idx, (_since, jid, status) in enumerate(_jobs):
+        if _since > _expire_before and idx >= _overflow:
+            break
+        if _has_running_parent(jid, _parent_statuses):
+            continue
+        archive_job(jid, status, archive_ttl)
+        _archived += 1
+    return _archived
+
+
+def _indexed_jobs():
+    """Terminal jobs of the status index, with the epoch they entered
+
+    their status, and the ids of all indexed jobs
+    """
+    _jobs = []
+    _indexed = set()
+    for status in JOB_STATUSES:
+        try:
+            _listing = etcd_utils.read("%s/status/%s" % (JOB_INDEX, status))
+        except etcd.EtcdKeyNotFound:
+            continue
+        for _leaf in _listing.leaves:
+            if _leaf.dir:
+                continue
+            jid = _leaf.key.split("/")[-1]
+            _indexed.add(jid)
+            if status not in TERMINAL_STATUSES:
+                continue
+            try:
+                _since = int(_leaf.value)
+            except (TypeError, ValueError):
+                _since = int(time.time())
+            _jobs.append((_since, jid, status))
+    return _jobs, _indexed
+
+
+def _unindexed_jobs(indexed):
+    """Terminal jobs of /queue missing from the status index (eg: jobs
+
+    which ended before the index existed), aged by their updated_at
+    """
+    try:
+        _listing = etcd_utils.read("/queue")
+    except etcd.EtcdKeyNotFound:
+        return []
+    _jobs = []
+    for _leaf in _listing.leaves:
+        jid = _leaf.key[len("/queue/"):]
+        if not _leaf.dir or not jid or jid in indexed:
+            continue
+        try:
+            status = etcd_utils.read("/queue/%s/status" % jid).value
+        except etcd.EtcdKeyNotFound:
+            continue
+        if status not in TERMINAL_STATUSES:
+            continue
+        try:
+            _updated_at = parser.parse(
+                etcd_utils.read("/queue/%s/updated_at" % jid).value)
+            _since = calendar.timegm(_updated_at.utctimetuple())
+        except (etcd.EtcdKeyNotFound, TypeError, ValueError):
+            _since = int(time.time())
+        _jobs.append((_since, jid, status))
+    return _jobs
+
+
+def _has_running_parent(jid, parent_statuses):
+    """The job is a child of a job which did not end yet
+
+    :param parent_statuses: Statuses of the parents read so far, by id
+    :type parent_statuses: dict
+    """
+    try:
+        _payload = json.loads(
+            etcd_utils.read("/queue/%s/payload" % jid).value)
+    except (etcd.EtcdKeyNotFound, TypeError, ValueError):
+        return False
+    _parent = (_payload or {}).get("parent")
+    if not _parent:
+        return False
+    if _parent not in parent_statuses:
+        try:
+            parent_statuses[_parent] = etcd_utils.read(
+                "/queue/%s/status" % _parent).value
+        except etcd.EtcdKeyNotFound:
+            # Archived already
+            parent_statuses[_parent] = None
+    return parent_statuses[_parent] not in TERMINAL_STATUSES + [None]
+
+
+def archive_job(jid, status, archive_ttl):
+    """Moves the job from /queue/<jid> to a single archive key
+
+    """
+    _job_key = "/queue/%s" % jid
+    try:
+        _leaves = etcd_utils.read(_job_key, recursive=True).leaves
+    except etcd.EtcdKeyNotFound:
+        _leaves = []
+
+    _job = {}
+    for _leaf in _leaves:
+        if _leaf.dir:
+            continue
+        _job[_leaf.key[len(_job_key) + 1:]] = _leaf.value
+
+    if _job:
+        etcd_utils.write("%s/%s" % (ARCHIVE, jid), json.dumps(_job),
+                         ttl=archive_ttl)
+        try:
+            etcd_utils.delete(_job_key, recursive=True)
+        except etcd.EtcdKeyNotFound:
+            pass
+    unindex_job(jid, status)
+    Event(
+        Message(
+            priority="debug",
+            publisher=NS.publisher_id,
+            payload={"message": "Archived job %s (%s)" % (jid, status)}
+        )
+    )
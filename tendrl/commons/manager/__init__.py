@@ -32,6 +32,11 @@ class Manager(object):
         self._job_consumer_thread.stop()
         if self._sds_sync_thread is not None:
             self._sds_sync_thread.stop()
+        # Stopping the event queue emits the pending Events and stopping
+        # the write-behind queue writes out the pending saves, while the
+        # central store connection is still checked
+        for service in reversed(_services()):
+            service.stop()
 
     def start(self):
         Event(
@@ -41,6 +46,8 @@ class Manager(object):
                 payload={"message": "%s starting" % self.__class__.__name__}
             )
         )
+        for service in _services():
+            service.start()
         if self._message_handler_thread is not None:
             self._message_handler_thread.start()
         if self._sds_sync_thread is not None:
@@ -60,3 +67,13 @@ class Manager(object):
         self._job_consumer_thread.join()
         if self._sds_sync_thread is not None:
             self._sds_sync_thread.join()
+
+
+def _services():
+    # Central store connection health check, object cache watcher,
+    # write-behind flusher and event emitter, in start order
+    if "_int" not in NS:
+        return []
+    return [NS._int[name] for name in ["connection", "cache", "write_behind",
+                                       "event_queue"]
+            if NS._int.get(name) is not None]
@@ -1,7 +1,5 @@
 import datetime
 from dateutil import parser
-from inspect import getframeinfo
-from inspect import stack
 import json
 import sys
 is_collectd_imported = False
@@ -19,7 +17,64 @@ if is_collectd_imported:
 from tendrl.commons.utils.time_utils import now  # flake8:noqa
 
 import traceback
-from ruamel import yaml
+
+# Message priorities, lowest first
+PRIORITIES = ["debug", "info", "notice", "warning", "error", "critical"]
+_PRIORITY_LEVELS = dict((priority, level)
+                        for level, priority in enumerate(PRIORITIES))
+# Messages below this priority level are not emitted
+_min_priority_level = 0
+
+
+def set_min_priority(priority):
+    """Messages of a lower priority are not emitted from now on
+
+    (eg: "info" drops the debug messages of the process)
+    """
+    global _min_priority_level
+    if priority not in _PRIORITY_LEVELS:
+        raise ValueError("Unknown message priority %s" % priority)
+    _min_priority_level = _PRIORITY_LEVELS[priority]
+
+
+def priority_enabled(priority):
+    """Messages of this priority are emitted
+
+    Check it before building a message (and formatting its payload), a
+    message which is not emitted costs nothing then. Invalid priorities
+    are left to Message.validate().
+    """
+    return _PRIORITY_LEVELS.get(priority, len(PRIORITIES)) >= \
+        _min_priority_level
+
+
+# Messages of these priorities record their caller
+_caller_priorities = set(PRIORITIES)
+NO_CALLER = {"filename": None, "line_no": None, "function": None}
+
+
+def set_caller_priorities(priorities):
+    """Only the messages of these priorities record their caller from now
+
+    on, the others get NO_CALLER
+    """
+    global _caller_priorities
+    _caller_priorities = set(priorities)
+
+
+def get_caller(priority, depth=1):
+    """Caller (filename, line_no, function) of the function calling
+
+    get_caller(), or depth - 1 frames further up. Only the frame is read,
+    not the whole stack and its source lines as with inspect.stack().
+    """
+    if priority not in _caller_priorities:
+        return dict(NO_CALLER)
+    frame = sys._getframe(depth + 1)
+    return {"filename": frame.f_code.co_filename,
+            "line_no": frame.f_lineno,
+            "function": frame.f_code.co_name}
+
 
 class Message(object):
     """At the time of message object intialization
@@ -43,10 +98,7 @@ class Message(object):
             self.timestamp = timestamp
         if caller is None:
             # From which function, line and file error raised
-            caller = getframeinfo(stack()[1][0])
-            self.caller = {"filename": caller.filename,
-                           "line_no": caller.lineno,
-                           "function": caller.function}
+            self.caller = get_caller(priority)
         else:
             self.caller = caller
         self.priority = priority
@@ -66,6 +118,20 @@ class Message(object):
         timestamp = parser.parse(message_json["timestamp"])
         message_json["timestamp"] = timestamp
         message = Message(**message_json)
+        return Message.validated(message)
+
+    @staticmethod
+    def validated(message):
+        """The message as from_json(to_json(message)) returns it, without
+
+        the JSON round-trip: the exception of the payload is serialized
+        and an invalid message is wrapped in a debug message
+        """
+        if isinstance(message.payload, dict) and \
+                isinstance(message.payload.get("exception"), Exception):
+            message.payload = dict(
+                message.payload,
+                exception=serialize_message(message.payload["exception"]))
         if not message.validate():
             # Invalid message logged as debug
             message_new = Message("debug",
@@ -77,11 +143,9 @@ class Message(object):
 
     @staticmethod
     def to_json(message):
-        return json.dumps(message.__dict__, default=serialize_message)
+        return _encoder.encode(message.__dict__)
 
     def validate(self):
-        priorities = ["debug", "info", "notice",
-                      "warning", "error", "critical"]
         """Validation for the object
 
         check all the mandatory fields are present,
@@ -98,7 +162,7 @@ class Message(object):
             return False
         
         # Check mandatory fields
-        if (self.priority not in priorities or
+        if (self.priority not in PRIORITIES or
             self.node_id is None or
                 "message" not in self.payload):
             return False
@@ -122,10 +186,7 @@ class ExceptionMessage(Message):
         _, _ , exc_traceback = sys.exc_info()
         # This will give traceback inside try block
         recent_call = traceback.extract_tb(exc_traceback)
-        caller = getframeinfo(stack()[1][0])
-        caller = {"filename": caller.filename,
-                  "line_no": caller.lineno,
-                  "function": caller.function}
+        caller = get_caller(priority)
         if "exception" in payload:
             if isinstance(payload["exception"], Exception):
                 exception_traceback = self.format_exception(
@@ -165,7 +226,13 @@ def serialize_message(obj):
         serial = obj.isoformat()
         return serial
     elif isinstance(obj, Exception):
-        return yaml.dump(obj)
+        # Its type and traceback are in the payload already
+        return "%s: %s" % (type(obj).__name__, obj)
     else:
         raise TypeError(
             "Message object is not serializable")
+
+
+# Shared by the to_json() calls, json.dumps() creates an encoder per call
+# when given a default
+_encoder = json.JSONEncoder(default=serialize_message)
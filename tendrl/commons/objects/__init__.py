@@ -1,20 +1,29 @@
 import etcd
 
 import abc
+import collections
 import copy
 import hashlib
 import json
 import six
 import sys
-import types
 
 from tendrl.commons.event import Event
 from tendrl.commons.message import ExceptionMessage
 from tendrl.commons.message import Message
+from tendrl.commons.message import priority_enabled
 from tendrl.commons.utils.central_store import utils as cs_utils
 from tendrl.commons.utils import etcd_utils
 from tendrl.commons.utils import time_utils
 
+# Attrs which are not part of the object digest
+HASH_EXCLUDED_ATTRS = ['hash', 'updated_at', 'value', 'list']
+
+# Objects defined with "storage: compact" are stored as one json value at
+# /{value}/data instead of one key per attr
+COMPACT_STORAGE = "compact"
+COMPACT_DATA_KEY = "data"
+
 
 @six.add_metaclass(abc.ABCMeta)
 class BaseObject(object):
@@ -28,24 +37,9 @@ class BaseObject(object):
                                 "definition via '_defs' attr")
 
     def load_definition(self):
+        _cls = self.__class__
         try:
-            Event(
-                Message(
-                    priority="debug",
-                    publisher=NS.publisher_id,
-                    payload={"message": "Load definitions (.yml) for "
-                                        "namespace.%s.objects.%s" %
-                                        (self._ns.ns_name,
-                                         self.__class__.__name__)
-                             }
-                )
-            )
-        except KeyError:
-            sys.stdout.write("Load definitions (.yml) for namespace.%s.objects"
-                             ".%s" % (self._ns.ns_name,
-                                      self.__class__.__name__))
-        try:
-            return self._ns.get_obj_definition(self.__class__.__name__)
+            _defs = self._ns.get_obj_definition(_cls.__name__)
         except KeyError as ex:
             msg = "Could not find definitions (.yml) for " \
                   "namespace.%s.objects.%s" %\
@@ -73,48 +67,107 @@ class BaseObject(object):
                 sys.stdout.write(msg)
             raise Exception(msg)
 
+        # The definitions are shared by all instances of the object type,
+        # only log when they are (re)loaded for the class. Read from the
+        # class __dict__ only, so that subclasses keep their own
+        if _defs is _cls.__dict__.get("_shared_defs"):
+            return _defs
+        _cls._shared_defs = _defs
+        try:
+            Event(
+                Message(
+                    priority="debug",
+                    publisher=NS.publisher_id,
+                    payload={"message": "Load definitions (.yml) for "
+                                        "namespace.%s.objects.%s" %
+                                        (self._ns.ns_name,
+                                         self.__class__.__name__)
+                             }
+                )
+            )
+        except KeyError:
+            sys.stdout.write("Load definitions (.yml) for namespace.%s.objects"
+                             ".%s" % (self._ns.ns_name,
+                                      self.__class__.__name__))
+        return _defs
+
     def save(self, update=True, ttl=None):
-        self.render()
-        if "Message" not in self.__class__.__name__:
-            try:
-                # Generate current in memory object hash
-                self.hash = self._hash()
-                _hash_key = "/{0}/hash".format(self.value)
-                _stored_hash = None
-                try:
-                    _stored_hash = NS._int.client.read(_hash_key).value
-                except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-                    if type(ex) != etcd.EtcdKeyNotFound:
-                        NS._int.reconnect()
-                        _stored_hash = NS._int.client.read(_hash_key).value
-                if self.hash == _stored_hash:
-                    # No changes in stored object and current object,
-                    # dont save current object to central store
-                    if ttl:
-                        etcd_utils.refresh(self.value, ttl)
-                    return
-            except TypeError:
-                # no hash for this object, save the current hash as is
-                pass
-
-        if update:
-            current_obj = self.load()
-            for attr, val in vars(self).iteritems():
-                if isinstance(val, (types.FunctionType,
-                                    types.BuiltinFunctionType,
-                                    types.MethodType, types.BuiltinMethodType,
-                                    types.UnboundMethodType)) or \
-                        attr.startswith("_") or attr in ['value', 'list']:
-                    continue
+        _items, _hash_cas = self._items_to_save(update)
+        if _items is None:
+            # No changes in stored object and current object,
+            # dont save current object to central store
+            self._mark_clean()
+            if ttl:
+                etcd_utils.refresh(self.value, ttl)
+            return
+
+        _queue = _write_behind_queue() \
+            if self._defs.get("write_behind") else None
+        if _queue:
+            # Written out later by the write-behind flusher
+            _queue.put("/{0}".format(self.value.strip("/")), _items, ttl,
+                       hash_cas=_hash_cas)
+            self._mark_clean()
+            return
+
+        # All changed attrs of the object go out as one batch
+        etcd_utils.write_many(_items)
+        if _hash_cas:
+            etcd_utils.write_hash(*_hash_cas)
+        self._mark_clean()
+        self._invalidate_cache()
+        if ttl:
+            etcd_utils.refresh(self.value, ttl)
+
+    def _items_to_save(self, update=True):
+        """Renders the instance into the (key, value) items to be written
+
+        to central store by save(). With update, only the attrs changed
+        since the object was loaded or saved are written, and None attrs
+        are skipped so that their stored values are kept.
 
-                if val is None and hasattr(current_obj, attr):
-                    # if self.attr is None, use attr value from central
-                    # store (i.e. current_obj.attr)
-                    if getattr(current_obj, attr):
-                        setattr(self, attr, getattr(current_obj, attr))
+        The hash of a partially written object is not part of the items,
+        it is written after them by etcd_utils.write_hash() with the
+        returned (key, digest, prev_hash).
 
+        :returns: (None, None) if the stored object is same as current
+                  object
+        :rtype: tuple(list((key, value)), tuple)
+        """
+        _rendered = self.render()
+        if self._unchanged() and not self._save_pending():
+            return None, None
+
+        _changed = self._changed_attrs() if update else None
         self.updated_at = str(time_utils.now())
-        for item in self.render():
+        if self._defs.get("storage") == COMPACT_STORAGE:
+            return [self._compact_item(update and _changed is None)], None
+
+        # hash and updated_at were set after the object got rendered,
+        # render just these again
+        _rendered = [item for item in _rendered
+                     if item['name'] not in ['hash', 'updated_at']]
+        _rendered += self._render_attrs(['hash', 'updated_at'])
+        _skipped = set()
+        if _changed is not None:
+            _skipped = set(item['name'] for item in _rendered) - _changed - \
+                set(['hash', 'updated_at'])
+        _items = []
+        _hash_cas = None
+        for item in _rendered:
+            if update:
+                if item['name'] in _skipped:
+                    continue
+                if getattr(self, item['name'], None) is None:
+                    continue
+            if item['name'] == 'hash' and _skipped:
+                # The stored values of the unchanged attrs may have been
+                # changed by another writer since, the digest is written
+                # only if the stored hash is still the one read
+                _hash_cas = (item['key'], item['value'],
+                             self.__dict__.get('_read_hash'))
+                continue
+
             '''
                 Note: Log messages in this file have try-except
                 blocks to run
@@ -122,179 +175,381 @@ class BaseObject(object):
                 started and
                 name spaces are being created.
             '''
-            try:
-                Event(
-                    Message(
-                        priority="debug",
-                        publisher=NS.publisher_id,
-                        payload={"message": "Writing %s to %s" %
-                                            (item['key'], item['value'])
-                                 }
+            # Formatted only if debug messages are emitted
+            if priority_enabled("debug"):
+                try:
+                    Event(
+                        Message(
+                            priority="debug",
+                            publisher=NS.publisher_id,
+                            payload={"message": "Writing %s to %s" %
+                                                (item['key'], item['value'])
+                                     }
+                        )
                     )
-                )
-            except KeyError:
-                sys.stdout.write("Writing %s to %s" % (item['key'],
-                                                       item['value']))
+                except KeyError:
+                    sys.stdout.write("Writing %s to %s" % (item['key'],
+                                                           item['value']))
             # convert list, dict (json) to python based on definitions
-            _type = self._defs.get("attrs", {}).get(item['name'],
-                                                    {}).get("type")
+            _type = self._attr_type(item['name'])
             if _type:
-                if _type.lower() in ['json', 'list']:
+                if _type in ['json', 'list']:
                     if item['value']:
                         try:
                             item['value'] = json.dumps(item['value'])
                         except ValueError as ex:
                             _msg = "Error save() attr %s for object %s" % \
                                    (item['name'], self.__name__)
-                            Event(
-                                ExceptionMessage(
-                                    priority="debug",
-                                    publisher=NS.publisher_id,
-                                    payload={"message": _msg,
-                                             "exception": ex
-                                             }
+                            if priority_enabled("debug"):
+                                Event(
+                                    ExceptionMessage(
+                                        priority="debug",
+                                        publisher=NS.publisher_id,
+                                        payload={"message": _msg,
+                                                 "exception": ex
+                                                 }
+                                    )
                                 )
-                            )
+            _items.append((item['key'], item['value']))
+        return _items, _hash_cas
+
+    def _compact_item(self, merge_stored=False):
+        """Renders the whole instance into a single json value, stored at
+
+        /{value}/data for objects defined with "storage: compact"
+
+        :param merge_stored: Use the stored values for None attrs
+        :type merge_stored: bool
+        :returns: (key, value) item to be written to central store
+        """
+        _data = {}
+        for attr, value in vars(self).iteritems():
+            if attr.startswith("_") or attr in ['value', 'list'] or \
+                    callable(value):
+                continue
+            _data[attr] = value
+
+        if merge_stored and None in _data.values():
+            for attr, value in self._stored_data().iteritems():
+                if _data.get(attr, "") is None:
+                    _data[attr] = value
+
+        _key = '/{0}/{1}'.format(self.value, COMPACT_DATA_KEY)
+        if priority_enabled("debug"):
             try:
-                NS._int.wclient.write(item['key'], item['value'], quorum=True)
-            except (etcd.EtcdConnectionFailed, etcd.EtcdException):
-                NS._int.wreconnect()
-                NS._int.wclient.write(item['key'], item['value'], quorum=True)
-        if ttl:
-            etcd_utils.refresh(self.value, ttl)
+                Event(
+                    Message(
+                        priority="debug",
+                        publisher=NS.publisher_id,
+                        payload={"message": "Writing %s" % _key}
+                    )
+                )
+            except KeyError:
+                sys.stdout.write("Writing %s" % _key)
+        return _key, json.dumps(_data, default=str)
+
+    def _stored_data(self, consistency=None):
+        """Reads the stored data of a compact object
+
+        :rtype: dict
+        """
+        _obj_key = "/{0}".format(self.value.strip("/"))
+        _leaves = self._read_dir(_obj_key,
+                                 cache_ttl=self._defs.get("cache_ttl"),
+                                 consistency=consistency)
+        for leaf in _leaves or []:
+            if leaf.key == "{0}/{1}".format(_obj_key, COMPACT_DATA_KEY):
+                try:
+                    return json.loads(leaf.value)
+                except (TypeError, ValueError):
+                    return {}
+        return {}
+
+    def load_all(self, consistency=None):
+        """Loads all the objects of the collection this object belongs to
+
+        The whole collection is fetched with a single recursive read and
+        every instance is built from that response in memory.
+
+        :param consistency: etcd_utils.QUORUM or etcd_utils.SERIALIZABLE,
+                            defaults to the one of the object type
+        :returns: None if the collection does not exist
+        :rtype: list(BaseObject)
+        """
+        _dir_key = self._collection_key()
+        _leaves = self._read_dir(_dir_key, consistency=consistency)
+        if _leaves is None:
+            return None
+
+        # Group the leaves per object directory of the collection
+        _grouped = collections.OrderedDict()
+        for leaf in _leaves:
+            if not leaf.key.startswith(_dir_key + "/"):
+                continue
+            _name = leaf.key[len(_dir_key) + 1:].split("/")[0]
+            _grouped.setdefault(_name, []).append(leaf)
 
-    def load_all(self):
-        value = '/'.join(self.value.split('/')[:-1])
-        try:
-            etcd_resp = NS._int.client.read(value)
-        except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-                    if type(ex) != etcd.EtcdKeyNotFound:
-                        NS._int.reconnect()
-                        etcd_resp = NS._int.client.read(value)
-                    else:
-                        return None
         ins = []
-        for item in etcd_resp.leaves:
-            self.value = item.key
-            ins.append(self.load())
+        for _name, _obj_leaves in _grouped.iteritems():
+            ins.append(self._instance_from_leaves(
+                "{0}/{1}".format(_dir_key, _name), _obj_leaves))
         return ins
 
-    def load(self):
-        if "Message" not in self.__class__.__name__:
-            try:
-                # Generate current in memory object hash
-                self.hash = self._hash()
-                _hash_key = "/{0}/hash".format(self.value)
-                _stored_hash = None
-                try:
-                    _stored_hash = NS._int.client.read(_hash_key).value
-                except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-                    if type(ex) != etcd.EtcdKeyNotFound:
-                        NS._int.reconnect()
-                        _stored_hash = NS._int.client.read(_hash_key).value
-                if self.hash == _stored_hash:
-                    # No changes in stored object and current object,
-                    # dont save current object to central store
-                    return self
-            except TypeError:
-                # no hash for this object, save the current hash as is
-                pass
+    def iter_all(self, consistency=None):
+        """Generator variant of load_all() for very large collections
+
+        (eg: /queue, /nodes). The collection is listed once and its objects
+        are then read and yielded one at a time, so only a single object is
+        held in memory.
+        """
+        _dir_key = self._collection_key()
+        try:
+            etcd_resp = etcd_utils.read(
+                _dir_key, consistency=self._consistency(consistency))
+        except etcd.EtcdKeyNotFound:
+            return
 
+        for item in etcd_resp.leaves:
+            _leaves = self._read_dir(item.key, consistency=consistency)
+            if _leaves is None:
+                # Object removed since the collection was listed
+                continue
+            yield self._instance_from_leaves(item.key, _leaves)
+
+    def _collection_key(self):
+        return "/{0}".format('/'.join(self.value.split('/')[:-1]).strip("/"))
+
+    def _instance_from_leaves(self, obj_key, leaves):
         _copy = self._copy_vars()
+        _copy.value = obj_key.strip("/")
+        _copy._map_leaves(obj_key, leaves)
+        _copy._mark_clean()
+        return _copy
 
-        for item in _copy.render():
+    def _read_dir(self, key, cache_ttl=None, consistency=None):
+        """Reads the directory at key recursively
+
+        :param cache_ttl: Serve and keep the result in the object cache
+                          for these many seconds, unless it is a quorum
+                          read
+        :type cache_ttl: int
+        :param consistency: Read consistency, see _consistency()
+        :type consistency: str
+        :returns: None if the key is not found
+        :rtype: iterable(etcd.EtcdResult)
+        """
+        _cache = _object_cache() \
+            if cache_ttl and self._cache_readable(consistency) else None
+        if _cache:
+            _leaves = _cache.get(key)
+            if _leaves is not None:
+                return _leaves
+
+        if priority_enabled("debug"):
             try:
                 Event(
                     Message(
                         priority="debug",
                         publisher=NS.publisher_id,
-                        payload={"message": "Reading %s" % item['key']}
+                        payload={"message": "Reading %s" % key}
                     )
                 )
             except KeyError:
-                sys.stdout.write("Reading %s" % item['key'])
+                sys.stdout.write("Reading %s" % key)
 
-            try:
-                etcd_resp = NS._int.client.read(item['key'], quorum=True)
-            except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-                if type(ex) == etcd.EtcdKeyNotFound:
-                    continue
-                else:
-                    NS._int.reconnect()
-                    etcd_resp = NS._int.client.read(item['key'], quorum=True)
-
-            value = etcd_resp.value
-            if item['dir']:
-                key = item['key'].split('/')[-1]
-                dct = dict(key=value)
-                if hasattr(_copy, item['name']):
-                    dct = getattr(_copy, item['name'])
-                    if type(dct) == dict:
-                        dct[key] = value
-                    else:
-                        setattr(_copy, item['name'], dct)
-                else:
-                    setattr(_copy, item['name'], dct)
+        try:
+            etcd_resp = etcd_utils.read(
+                key, recursive=True,
+                consistency=self._consistency(consistency))
+        except etcd.EtcdKeyNotFound:
+            return None
+        if _cache:
+            _leaves = list(etcd_resp.leaves)
+            _cache.put(key, _leaves, cache_ttl, etcd_resp.etcd_index)
+            return _leaves
+        return etcd_resp.leaves
+
+    def _consistency(self, consistency=None):
+        # Consistency of the call site, else the one defined for the object
+        # type, else quorum
+        return consistency or self._defs.get("consistency") or \
+            etcd_utils.QUORUM
+
+    def _cache_readable(self, consistency=None):
+        # Quorum reads always go to the central store
+        return self._consistency(consistency) != etcd_utils.QUORUM
+
+    def _invalidate_cache(self):
+        _cache = _object_cache()
+        if _cache:
+            _cache.invalidate("/{0}".format(self.value.strip("/")))
+
+    def load(self, consistency=None):
+        """Loads the stored attrs of the object
+
+        :param consistency: etcd_utils.QUORUM or etcd_utils.SERIALIZABLE,
+                            defaults to the one of the object type
+        """
+        # The stored hash of a compact object costs as much as the object
+        if self._defs.get("storage") != COMPACT_STORAGE and \
+                not self._save_pending() and self._unchanged(consistency):
+            # No changes in stored object and current object
+            self._mark_clean()
+            return self
+
+        _copy = self._copy_vars()
+        # Render the copy to resolve its key (i.e. _copy.value)
+        _copy.render()
+        _obj_key = "/{0}".format(_copy.value.strip("/"))
+        _queue = _write_behind_queue() \
+            if self._defs.get("write_behind") else None
+        if _queue:
+            # Read back what was saved, even if not written out yet
+            _queue.flush(_obj_key)
+
+        # Single recursive read of the object directory, instead of
+        # one read per attr
+        _leaves = self._read_dir(_obj_key,
+                                 cache_ttl=self._defs.get("cache_ttl"),
+                                 consistency=consistency)
+        if _leaves is not None:
+            _copy._map_leaves(_obj_key, _leaves)
+            _copy._mark_clean()
+        return _copy
+
+    def _map_leaves(self, obj_key, leaves):
+        """Maps the leaves of a recursive central store read of this object
+
+        (at obj_key) back on to the attrs of this instance
+
+        :param obj_key: Central store key of the object directory
+        :type obj_key: str
+        :param leaves: Leaf nodes of the recursive read
+        :type leaves: iterable(etcd.EtcdResult)
+        """
+        _attrs = [attr for attr in vars(self) if not attr.startswith("_") and
+                  attr not in ['value', 'list']]
+        _compact = self._defs.get("storage") == COMPACT_STORAGE
+        _data = None
+        for leaf in leaves:
+            if leaf.dir or not leaf.key.startswith(obj_key + "/"):
+                # Empty directory or the object directory itself
+                continue
+            name, _, sub_key = leaf.key[len(obj_key) + 1:].partition("/")
+            if _compact and name == COMPACT_DATA_KEY and not sub_key:
+                _data = leaf.value
+                continue
+            if name == 'hash' and not sub_key:
+                # The next partial write compares with the stored hash
+                self.hash = leaf.value
+                continue
+            if name not in _attrs:
+                continue
+
+            value = leaf.value
+            if sub_key:
+                # dict attr, its items are stored as /{value}/{attr}/{key}
+                dct = getattr(self, name)
+                if type(dct) != dict:
+                    dct = dict()
+                dct[sub_key] = value
+                setattr(self, name, dct)
                 continue
 
             # convert list, dict (json) to python based on definitions
-            _type = self._defs.get("attrs", {}).get(item['name'],
-                                                    {}).get("type")
+            _type = self._attr_type(name)
             if _type:
-                if _type.lower() in ['json', 'list']:
+                if _type in ['json', 'list']:
                     if value:
                         try:
                             value = json.loads(value.decode('utf-8'))
                         except ValueError as ex:
                             _msg = "Error load() attr %s for object %s" % \
-                                   (item['name'], self.__name__)
-                            Event(
-                                ExceptionMessage(
-                                    priority="debug",
-                                    publisher=NS.publisher_id,
-                                    payload={"message": _msg,
-                                             "exception": ex
-                                             }
+                                   (name, self.__class__.__name__)
+                            if priority_enabled("debug"):
+                                Event(
+                                    ExceptionMessage(
+                                        priority="debug",
+                                        publisher=NS.publisher_id,
+                                        payload={"message": _msg,
+                                                 "exception": ex
+                                                 }
+                                    )
                                 )
-                            )
                     else:
-                        if _type.lower() == "list":
+                        if _type == "list":
                             value = list()
-                        if _type.lower() == "json":
+                        if _type == "json":
                             value = dict()
 
-            setattr(_copy, item['name'], value)
-        return _copy
+            setattr(self, name, value)
+
+        if _data is not None:
+            # The compact data takes precedence over leftover attr keys
+            self._map_compact_data(_data)
+
+    def _map_compact_data(self, data):
+        try:
+            data = json.loads(data)
+        except (TypeError, ValueError) as ex:
+            _msg = "Error load() compact data for object %s" % \
+                   self.__class__.__name__
+            Event(
+                ExceptionMessage(
+                    priority="debug",
+                    publisher=NS.publisher_id,
+                    payload={"message": _msg,
+                             "exception": ex
+                             }
+                )
+            )
+            return
+        _attrs = vars(self)
+        for name, value in data.iteritems():
+            if name in _attrs and not name.startswith("_") and \
+                    name not in ['value', 'list']:
+                setattr(self, name, value)
 
     def exists(self):
         self.render()
-        _exists = False
+        if self._defs.get("cache_ttl") and self._cache_readable():
+            _cache = _object_cache()
+            if _cache and _cache.get("/{0}".format(
+                    self.value.strip("/"))) is not None:
+                return True
+
         try:
-            NS._int.client.read("/{0}".format(self.value))
-            _exists = True
-        except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-            if type(ex) != etcd.EtcdKeyNotFound:
-                NS._int.reconnect()
-                NS._int.client.read("/{0}".format(self.value))
-                _exists = True
-        return _exists
+            etcd_utils.read("/{0}".format(self.value),
+                            consistency=self._consistency())
+        except etcd.EtcdKeyNotFound:
+            return False
+        return True
 
     def _map_vars_to_tendrl_fields(self):
         _fields = {}
         for attr, value in vars(self).iteritems():
-            _type = self._defs.get("attrs", {}).get(attr,
-                                                    {}).get("type")
-            if _type:
-                _type = _type.lower()
-
-            if value is None:
-                value = ""
             if attr.startswith("_") or attr in ['value', 'list']:
                 continue
-            _fields[attr] = cs_utils.to_tendrl_field(attr, value, _type)
+            if value is None:
+                value = ""
+            _fields[attr] = cs_utils.to_tendrl_field(attr, value,
+                                                     self._attr_type(attr))
 
         return _fields
 
+    def _attr_type(self, attr):
+        """Type (lower case) of attr as per the object definitions
+
+        """
+        _attr_types = self._defs.get("attr_types")
+        if _attr_types is not None:
+            # Precomputed once per object type by get_obj_definition()
+            return _attr_types.get(attr)
+        _type = (self._defs.get("attrs", {}).get(attr) or {}).get("type")
+        if _type:
+            return _type.lower()
+        return None
+
     def render(self):
         """Renders the instance into a structure for central store based on
 
@@ -304,16 +559,32 @@ class BaseObject(object):
         :rtype: list(dict{key=str,value=any})
         """
 
+        return self._render_attrs([attr for attr in vars(self)
+                                   if not attr.startswith("_") and
+                                   attr not in ['value', 'list']])
+
+    def _render_attrs(self, attrs):
+        """Renders the given attrs of the instance, straight from the attr
+
+        types of the definitions (see cs_utils.render_field)
+
+        :rtype: list(dict{key=str,value=any})
+        """
         rendered = []
-        _fields = self._map_vars_to_tendrl_fields()
-        if _fields:
-            for name, field in _fields.iteritems():
-                items = field.render()
-                if type(items) != list:
-                    items = [items]
-                for i in items:
-                    i['key'] = '/{0}/{1}'.format(self.value, i['key'])
-                    rendered.append(i)
+        _prefix = '/{0}/'.format(self.value)
+        _vars = vars(self)
+        for attr in attrs:
+            if attr not in _vars:
+                continue
+            value = _vars[attr]
+            if value is None:
+                value = ""
+            for key, value, _dir in cs_utils.render_field(
+                    attr, value, self._attr_type(attr)):
+                rendered.append({'name': attr,
+                                 'key': _prefix + key,
+                                 'value': value,
+                                 'dir': _dir})
         return rendered
 
     @property
@@ -332,13 +603,130 @@ class BaseObject(object):
 
         return json.dumps(data)
 
+    def __setattr__(self, name, value):
+        if not name.startswith("_"):
+            # Any change of a hashed attr invalidates the cached digest
+            if name not in HASH_EXCLUDED_ATTRS:
+                self.__dict__['_digest'] = None
+            _dirty = self.__dict__.get('_dirty')
+            if _dirty is not None:
+                # Setting the loaded (or saved) value back is no change
+                if name in self._snapshot and \
+                        self._snapshot[name] == _snapshot_value(value):
+                    _dirty.discard(name)
+                else:
+                    _dirty.add(name)
+        super(BaseObject, self).__setattr__(name, value)
+
+    def _mark_clean(self):
+        """Records the object as in sync with the central store
+
+        """
+        self._dirty = set()
+        # Values of the attrs as loaded or saved, dict, list attrs can
+        # change in place: keep a snapshot of them
+        self._snapshot = {}
+        for attr, value in vars(self).iteritems():
+            if not attr.startswith("_"):
+                self._snapshot[attr] = _snapshot_value(value)
+        # Stored hash the next partial write compares with
+        self._read_hash = self.__dict__.get('hash')
+
+    def _changed_attrs(self):
+        """Attrs changed since the object was loaded or saved
+
+        :returns: None if the object was never in sync (all attrs changed)
+        :rtype: set(str)
+        """
+        _dirty = self.__dict__.get('_dirty')
+        if _dirty is None:
+            return None
+        _changed = set(_dirty)
+        for attr, value in vars(self).iteritems():
+            if not attr.startswith("_") and \
+                    isinstance(value, (dict, list)) and \
+                    self._snapshot.get(attr) != _snapshot_value(value):
+                _changed.add(attr)
+        return _changed
+
     def _hash(self):
-        self.hash = None
-        self.updated_at = None
+        """Digest of the public attrs of the object (except hash,
 
-        # Above items cant be part of hash
-        _obj_str = "".join(sorted(self.json))
-        return hashlib.md5(_obj_str).hexdigest()
+        updated_at), computed in one pass over vars(self) as canonical
+        (sorted) json. The digest is cached until an attr is set, unless
+        the object has dict or list attrs, which could change in place.
+        """
+        _digest = self.__dict__.get('_digest')
+        if _digest is not None:
+            return _digest
+
+        _attrs = []
+        _mutable = False
+        for attr, value in sorted(vars(self).iteritems()):
+            if attr.startswith("_") or attr in HASH_EXCLUDED_ATTRS or \
+                    callable(value):
+                continue
+            if value is None:
+                value = ""
+            elif isinstance(value, (dict, list)):
+                _mutable = True
+            _attrs.append((attr, value))
+        _digest = hashlib.sha256(
+            json.dumps(_attrs, sort_keys=True, default=str)
+        ).hexdigest()
+        if not _mutable:
+            self._digest = _digest
+        return _digest
+
+    def _unchanged(self, consistency=None):
+        """Compares the digest of the object with the stored one
+
+        :returns: True if the stored object is same as current object
+        """
+        if "Message" in self.__class__.__name__:
+            return False
+        try:
+            # Generate current in memory object hash
+            self.hash = self._hash()
+        except (TypeError, ValueError):
+            # no hash for this object, save the current hash as is
+            return False
+        return self.hash is not None and \
+            self.hash == self._stored_hash(consistency)
+
+    def _save_pending(self):
+        """A save of the object is queued for write-behind
+
+        The stored hash is older than the queued save, it is not compared
+        with the object meanwhile.
+        """
+        _queue = _write_behind_queue() \
+            if self._defs.get("write_behind") else None
+        return _queue is not None and \
+            _queue.pending("/{0}".format(self.value.strip("/")))
+
+    def _stored_hash(self, consistency=None):
+        if self._defs.get("storage") == COMPACT_STORAGE:
+            return self._stored_data(consistency).get("hash")
+
+        _obj_key = "/{0}".format(self.value.strip("/"))
+        _cache_ttl = self._defs.get("cache_ttl")
+        if _cache_ttl and _object_cache() and \
+                self._cache_readable(consistency):
+            # Served from the object cache, which is coherent with the
+            # central store, while the object is unchanged
+            for leaf in self._read_dir(_obj_key, cache_ttl=_cache_ttl,
+                                       consistency=consistency) or []:
+                if leaf.key == _obj_key + "/hash":
+                    return leaf.value
+            return None
+
+        _hash_key = "{0}/hash".format(_obj_key)
+        try:
+            return etcd_utils.read(
+                _hash_key, consistency=self._consistency(consistency)).value
+        except etcd.EtcdKeyNotFound:
+            return None
 
     def _copy_vars(self):
         # Creates a copy intance of $obj using it public vars
@@ -353,6 +741,70 @@ class BaseObject(object):
         return self.__class__(**_public_vars)
 
 
+def _snapshot_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+def _object_cache():
+    # The object cache is only used while its watcher keeps it coherent
+    _cache = NS._int.get("cache")
+    if _cache is not None and _cache.enabled:
+        return _cache
+    return None
+
+
+def _write_behind_queue():
+    # Saves are only queued while the flusher writes them out
+    _queue = NS._int.get("write_behind")
+    if _queue is not None and _queue.enabled:
+        return _queue
+    return None
+
+
+def save_all(objs, update=True, ttl=None):
+    """Saves many objects to central store in a single batched write
+
+    The saves of write-behind objects are queued, as by save().
+
+    Note: objects overriding save() (eg: Job) should be saved one by one
+
+    :param objs: The objects to save
+    :type objs: list(BaseObject)
+    """
+    _items = []
+    _hash_cas = []
+    _written = []
+    for obj in objs:
+        _obj_items, _obj_hash_cas = obj._items_to_save(update)
+        if _obj_items is None:
+            obj._mark_clean()
+            if ttl:
+                etcd_utils.refresh(obj.value, ttl)
+            continue
+        _queue = _write_behind_queue() \
+            if obj._defs.get("write_behind") else None
+        if _queue:
+            _queue.put("/{0}".format(obj.value.strip("/")), _obj_items,
+                       ttl, hash_cas=_obj_hash_cas)
+            obj._mark_clean()
+            continue
+        _items.extend(_obj_items)
+        if _obj_hash_cas:
+            _hash_cas.append(_obj_hash_cas)
+        _written.append(obj)
+
+    etcd_utils.write_many(_items)
+    for _cas in _hash_cas:
+        etcd_utils.write_hash(*_cas)
+    for obj in _written:
+        obj._mark_clean()
+        obj._invalidate_cache()
+        if ttl:
+            etcd_utils.refresh(obj.value, ttl)
+
+
 @six.add_metaclass(abc.ABCMeta)
 class BaseAtom(object):
     def __init__(self, parameters=None):
@@ -367,6 +819,16 @@ class BaseAtom(object):
                                 "definition via '_defs' attr")
 
     def load_definition(self):
+        _cls = self.__class__
+        try:
+            _defs = self._ns.get_atom_definition(self.obj.__name__,
+                                                 _cls.__name__)
+        except KeyError:
+            _defs = None
+        if _defs is not None and _defs is _cls.__dict__.get("_shared_defs"):
+            # Definitions of this atom are already loaded
+            return _defs
+
         try:
             Event(
                 Message(
@@ -386,8 +848,8 @@ class BaseAtom(object):
                              "atoms.%s" % (self._ns.ns_name, self.obj.__name__,
                                            self.__class__.__name__))
         try:
-            return self._ns.get_atom_definition(self.obj.__name__,
-                                                self.__class__.__name__)
+            _defs = self._ns.get_atom_definition(self.obj.__name__,
+                                                 self.__class__.__name__)
         except KeyError as ex:
             msg = "Could not find definitions (.yml) for" \
                   "namespace.%s.objects.%s.atoms.%s" % (self._ns.ns_src,
@@ -415,6 +877,8 @@ class BaseAtom(object):
             except KeyError:
                 sys.stderr.write(msg)
             raise Exception(msg)
+        _cls._shared_defs = _defs
+        return _defs
 
     @abc.abstractmethod
     def run(self):
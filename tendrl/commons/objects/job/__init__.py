@@ -1,4 +1,16 @@
+import time
+
+import etcd
+
 from tendrl.commons import objects
+from tendrl.commons.utils import etcd_utils
+
+# Jobs are filed under /indexes/jobs/status/<status>/<job_id> and, while
+# "new", under /indexes/jobs/tags/<tag>/<job_id> so that consumers can list
+# the candidate jobs without scanning the whole /queue. Index entries hold
+# the epoch at which the job entered the status.
+JOB_INDEX = "/indexes/jobs"
+JOB_STATUSES = ["new", "processing", "finished", "failed"]
 
 
 class Job(objects.BaseObject):
@@ -40,8 +52,92 @@ class Job(objects.BaseObject):
                 _parent.status = "failed"
                 _parent.save()
 
+        # The index follows the status only when it is submitted or set
+        # by the caller, the status of a loaded job may be stale (status
+        # transitions are compare-and-swapped on the status key and move
+        # the index themselves)
+        _changed = self._changed_attrs()
         super(Job, self).save()
 
+        if self.status in JOB_STATUSES and \
+                (_changed is None or "status" in _changed):
+            _tags = self.payload.get("tags", [])
+            index_job(self.job_id, self.status, _tags)
+            if self.status != "new":
+                # The previous status is not known here, drop the job
+                # from every other status
+                for status in JOB_STATUSES:
+                    if status != self.status:
+                        unindex_job(self.job_id, status, _tags)
+
     def render(self):
         self.value = self.value.format(self.job_id)
         return super(Job, self).render()
+
+
+def index_job(job_id, status, tags=None):
+    """Files the job under its status, and under its routing tags if "new"
+
+    """
+    _now = int(time.time())
+    _items = [("%s/status/%s/%s" % (JOB_INDEX, status, job_id), _now)]
+    if status == "new":
+        _items += [("%s/tags/%s/%s" % (JOB_INDEX, tag, job_id), _now)
+                   for tag in tags or []]
+    etcd_utils.write_many(_items)
+
+
+def unindex_job(job_id, status, tags=None):
+    """Removes the job from the index of status (and of tags if "new")
+
+    """
+    _keys = ["%s/status/%s/%s" % (JOB_INDEX, status, job_id)]
+    if status == "new":
+        _keys += ["%s/tags/%s/%s" % (JOB_INDEX, tag, job_id)
+                  for tag in tags or []]
+    for key in _keys:
+        try:
+            etcd_utils.delete(key)
+        except etcd.EtcdKeyNotFound:
+            pass
+
+
+def move_job_index(job_id, from_status, to_status, tags=None):
+    """Updates the index after a status transition of the job
+
+    """
+    index_job(job_id, to_status, tags)
+    unindex_job(job_id, from_status, tags)
+
+
+def indexed_job_ids(tags=None, status="new"):
+    """Lists the ids of the jobs in status, or of the "new" jobs routed to
+
+    any of tags when given.
+
+    :returns: (etcd index of the listing, set of job ids)
+    :raises etcd.EtcdKeyNotFound: when no job was ever indexed
+    """
+    if tags is None:
+        _dirs = ["%s/status/%s" % (JOB_INDEX, status)]
+    else:
+        _dirs = ["%s/tags/%s" % (JOB_INDEX, tag) for tag in tags]
+
+    _etcd_index = None
+    _job_ids = set()
+    for _dir in _dirs:
+        try:
+            _listing = etcd_utils.read(_dir)
+        except etcd.EtcdKeyNotFound:
+            continue
+        # Watching from the oldest listing may replay some changes but
+        # misses none
+        if _etcd_index is None or _listing.etcd_index < _etcd_index:
+            _etcd_index = _listing.etcd_index
+        for _leaf in _listing.leaves:
+            if not _leaf.dir:
+                _job_ids.add(_leaf.key.split("/")[-1])
+
+    if _etcd_index is None:
+        raise etcd.EtcdKeyNotFound
+    return _etcd_index, _job_ids
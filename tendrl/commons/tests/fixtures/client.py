@@ -9,6 +9,9 @@ class Client():
     def write(self,*args,**kwargs):
         pass
 
+    def delete(self,*args,**kwargs):
+        pass
+
     def save(self):
         pass
 
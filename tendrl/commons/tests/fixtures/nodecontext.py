@@ -3,5 +3,5 @@ class NodeContext():
     def __init__(self, *args):
         self.tags = ""
 
-    def load(self):
+    def load(self, consistency=None):
         return self
@@ -5,6 +5,7 @@ import __builtin__
 import importlib
 from mock import patch
 import pytest
+import etcd
 import gevent
 from tendrl.commons.tests.fixtures.plugin import Plugin
 from tendrl.commons.utils import ansible_module_runner
@@ -135,3 +136,75 @@ def test_gluster_create_ssh_setup_jobs():
         with pytest.raises(FlowExecutionFailedError):
             mock_setup.return_value = "ssh_key",""
             utils.gluster_create_ssh_setup_jobs(param)
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_node_lock():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS.publisher_id = "node_agent"
+    parameters = {"job_id": "job_1", "flow_id": "flow_1",
+                  "Node[]": ["1", "2"]}
+    job = maps.NamedDict(payload={"parent": "job_0"})
+    with patch.object(utils.Job, "load", return_value=job):
+        with patch.object(utils.lock.Lock, "acquire") as mock_acquire:
+            mock_acquire.side_effect = utils.lock.LockHeldError(
+                "/nodes/2/locked_by", "job_9")
+            with pytest.raises(FlowExecutionFailedError):
+                utils.acquire_node_lock(parameters)
+            assert "job_1" not in utils._node_locks
+            mock_acquire.side_effect = None
+            utils.acquire_node_lock(parameters)
+    node_lock = utils._node_locks["job_1"]
+    assert node_lock.keys == ["/nodes/1/locked_by", "/nodes/2/locked_by"]
+    assert node_lock.shared_with == ["job_0"]
+    with patch.object(utils.lock.Lock, "release",
+                      return_value=["/nodes/1/locked_by"]) as mock_release:
+        utils.release_node_lock(parameters)
+        assert "job_1" not in utils._node_locks
+        # Locks left over by a previous run of the job are released too
+        utils.release_node_lock(parameters)
+        assert mock_release.call_count == 2
+
+
+def test_wait_for_jobs():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    status = {"1": "finished", "2": "processing", "3": "new"}
+    changes = [maps.NamedDict(key="/queue/4/status", value="finished",
+                              modifiedIndex=11),
+               maps.NamedDict(key="/queue/2/status", value="finished",
+                              modifiedIndex=12),
+               maps.NamedDict(key="/queue/3/locked_by", value="node",
+                              modifiedIndex=13),
+               maps.NamedDict(key="/queue/3/status", value="finished",
+                              modifiedIndex=14)]
+
+    def read(key, **kwargs):
+        if kwargs.get("wait"):
+            assert kwargs["waitIndex"] == changes[0].modifiedIndex
+            return changes.pop(0)
+        return maps.NamedDict(value=status[key.split("/")[2]],
+                              etcd_index=10)
+    NS._int = maps.NamedDict(client=maps.NamedDict(read=read))
+    assert utils.wait_for_jobs(["1", "2", "3"]) == {}
+    assert changes == []
+    assert utils.wait_for_jobs([]) == {}
+
+    # Returns as soon as any job fails
+    status["3"] = "failed"
+    assert utils.wait_for_jobs(["1", "2", "3"]) == {"3": "failed"}
+    status["3"] = "new"
+    changes.append(maps.NamedDict(key="/queue/2/status", value="failed",
+                                  modifiedIndex=11))
+    assert utils.wait_for_jobs(["2", "3"]) == {"2": "failed"}
+
+    # Times out
+    def watch_timeout(key, **kwargs):
+        if kwargs.get("wait"):
+            raise etcd.EtcdWatchTimedOut
+        return read(key)
+    NS._int.client.read = watch_timeout
+    with pytest.raises(FlowExecutionFailedError):
+        utils.wait_for_jobs(["2"], timeout=0.01)
@@ -1,4 +1,6 @@
+from tendrl.commons import jobs
 from tendrl.commons.jobs import JobConsumerThread
+from tendrl.commons.jobs import JobExecutor
 import sys
 import etcd
 import __builtin__
@@ -19,14 +21,20 @@ from pytz import utc
 
 test_job = JobConsumerThread()
 
+def result(value):
+    return maps.NamedDict(key = "/queue", action = "get", etcd_index = 1,
+                          modifiedIndex = 1,
+                          leaves = [maps.NamedDict(key = "test/job")],
+                          value = value)
+
 def read_value(*args,**kwargs):
     test_job._complete._flag = True
-    return maps.NamedDict(leaves = [maps.NamedDict(key = "test/job")],value = "Test Value")
+    return result("Test Value")
 
 
 def read_none(*args,**kwargs):
     test_job._complete._flag = True
-    return maps.NamedDict(leaves = [maps.NamedDict(key = "test/job")],value = False)
+    return result(False)
 
 def read(*args,**kwargs):
     test_job._complete._flag = True
@@ -41,19 +49,19 @@ def _read(*args,**kwargs):
     global status_valid
     if args[1] == "/queue/job/status" and status_flag == 0:
         status_flag = 1
-        return maps.NamedDict(leaves = [maps.NamedDict(key = "test/job")],value = "finished")
+        return result("finished")
     elif args[1] == "/queue/job/status" and status_flag == 1:
         status_flag = 2
-        return maps.NamedDict(leaves = [maps.NamedDict(key = "test/job")],value = "unfinished")
+        return result("unfinished")
     elif args[1] == "/queue/job/status" and status_flag == 2:
         raise etcd.EtcdKeyNotFound
     elif args[1] == "/queue" or args[1] == "/queue/job/locked_by":
-        return maps.NamedDict(leaves = [maps.NamedDict(key = "test/job")],value = False)
+        return result(False)
     elif args[1] == "/queue/job/valid_until" and status_valid == 0:
         status_valid = 1
-        return maps.NamedDict(leaves = [maps.NamedDict(key = "test/job")],value = False)
+        return result(False)
     elif args[1] == "/queue/job/valid_until" and status_valid == 1:
-        return maps.NamedDict(leaves = [maps.NamedDict(key = "test/job")],value = (time_utils.now() - datetime.datetime(1970,1,1).replace(tzinfo=utc)).total_seconds())
+        return result((time_utils.now() - datetime.datetime(1970,1,1).replace(tzinfo=utc)).total_seconds())
 
 def load(*args):
     obj = importlib.import_module("tendrl.commons.tests.fixtures.client")
@@ -212,6 +220,150 @@ def test_run():
     test_job._complete._flag = True
     test_job._run()
 
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_run_watch():
+    init()
+    NS.node_context.tags = ""
+    test_job = JobConsumerThread()
+    changes = [maps.NamedDict(key = "/queue/1/status", action = "set",
+                              value = "new", modifiedIndex = 6),
+               maps.NamedDict(key = "/queue/2/status", action = "set",
+                              value = "finished", modifiedIndex = 7),
+               maps.NamedDict(key = "/queue/3/payload", action = "set",
+                              value = "{}", modifiedIndex = 8)]
+
+    def watch(*args, **kwargs):
+        assert kwargs["wait"] and kwargs["recursive"]
+        if not changes:
+            test_job._complete._flag = True
+            raise etcd.EtcdWatchTimedOut
+        assert kwargs["waitIndex"] == changes[0].modifiedIndex
+        return changes.pop(0)
+    test_job._etcd_index = 5
+    with patch.object(Client, 'read', watch):
+        with patch.object(JobExecutor, 'submit') as mock_submit:
+            test_job._run()
+    assert [c[0][0] for c in mock_submit.call_args_list] == ["1", "3"]
+    assert test_job._etcd_index == 8
+
+    # Missed events are recovered by rescanning the queue
+    def index_cleared(*args, **kwargs):
+        test_job._complete._flag = True
+        raise etcd.EtcdEventIndexCleared
+    test_job._complete._flag = False
+    with patch.object(Client, 'read', index_cleared):
+        test_job._run()
+    assert test_job._etcd_index is None
+
+
+def test_process_job():
+    init()
+    reads = []
+
+    def read_job(*args, **kwargs):
+        reads.append(args[1])
+        if args[1] == "/queue/abc/locked_by":
+            raise etcd.EtcdKeyNotFound
+        return result("finished")
+    with patch.object(Client, 'read', read_job):
+        with patch.object(Job, 'load') as mock_load:
+            jobs.process_job("abc")
+    # Already finished jobs are not loaded
+    assert reads == ["/queue/abc/locked_by", "/queue/abc/status"]
+    assert not mock_load.called
+
+    # Jobs locked by an agent are left alone
+    with patch.object(Client, 'read', return_value=result("agent")):
+        with patch.object(Job, 'load') as mock_load:
+            jobs.process_job("abc")
+    assert not mock_load.called
+
+    # Jobs are routed with the current tags of the node
+    def read_new(*args, **kwargs):
+        if args[1] == "/queue/abc/status":
+            return result("new")
+        raise etcd.EtcdKeyNotFound
+    NS.type = "Test_type"
+    NS.node_context.tags = ""
+    node_context = NS.node_context.__class__()
+    node_context.tags = ["Test_tag"]
+    job = mock.MagicMock(status="new", payload=maps.NamedDict(
+        type="Test_type", tags=["Test_tag"]))
+    with patch.object(Client, 'read', read_new), \
+            patch.object(NS.node_context, 'load',
+                         return_value=node_context) as mock_nc_load, \
+            patch.object(jobs, 'Job') as mock_job, \
+            patch.object(jobs, '_run_job') as mock_run_job:
+        mock_job.return_value.load.return_value = job
+        jobs.process_job("abc")
+    mock_nc_load.assert_called_once_with(
+        consistency=jobs.etcd_utils.SERIALIZABLE)
+    mock_run_job.assert_called_once_with(job)
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.ExceptionMessage.__init__',
+            mock.Mock(return_value=None))
+def test_run_job_failed():
+    init()
+    NS.node_context.fqdn = "Test"
+    NS.node_context.node_id = "1"
+    NS.type = "Test_type"
+    job = mock.MagicMock(job_id="1", payload=maps.NamedDict(
+        run="tendrl.commons.flows.test_flow", tags=["Test_tag"]))
+    with patch.object(jobs, "_extract_fqdn", side_effect=Exception), \
+            patch.object(Client, "write"), \
+            patch.object(jobs.job_index, "move_job_index") as mock_move:
+        jobs._run_job(job)
+    assert mock_move.call_args_list == [
+        mock.call("1", "new", "processing", ["Test_tag"]),
+        mock.call("1", "processing", "failed", ["Test_tag"])]
+    assert job.load.return_value.save.called
+
+
+def test_executor():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict(client=mock.MagicMock())
+    NS._int.client.read.return_value = maps.NamedDict(
+        value='{"run": "tendrl.flows.ImportCluster"}')
+    executor = JobExecutor(size=2,
+                           flow_concurrency={"tendrl.flows.ImportCluster": 1})
+    done = gevent.event.Event()
+    processed = []
+
+    def process_job(jid):
+        processed.append(jid)
+        done.wait()
+    with patch.object(jobs, 'process_job', process_job):
+        executor.submit("1")
+        assert executor.submit("1") is None
+        # The only slot of the flow is taken, job 2 is left unclaimed
+        assert executor.submit("2") is None
+        gevent.sleep(0)
+        assert processed == ["1"]
+        assert executor.stats() == dict(
+            in_flight=1, running=1, size=2, skipped=1, deferred=1,
+            flows={"tendrl.flows.ImportCluster": 1})
+        assert executor.flow_slot("tendrl.flows.ExpandCluster") is None
+        # and submitted again once job 1 is done
+        done.set()
+        executor._pool.join()
+        gevent.sleep(0)
+        gevent.sleep(0)
+        assert processed == ["1", "2"]
+        executor._pool.join()
+    NS._int.client.read.assert_called_with("/queue/2/payload",
+                                           recursive=False, quorum=False)
+    assert executor.stats()["in_flight"] == 0
+    assert executor.stats()["flows"] == {"tendrl.flows.ImportCluster": 0}
+
+
 def test_stop():
     test_job = JobConsumerThread()
     test_job.stop()
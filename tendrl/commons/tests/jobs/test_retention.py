@@ -0,0 +1,122 @@
+import __builtin__
+import etcd
+import json
+import maps
+import mock
+from mock import patch
+import time
+
+from tendrl.commons.jobs import retention
+from tendrl.commons.utils import etcd_utils
+
+
+def leaf(key, value, dir=False):
+    return maps.NamedDict(key=key, value=value, dir=dir)
+
+
+def init():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS.publisher_id = "node_agent"
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_purge_jobs():
+    init()
+    now = int(time.time())
+
+    def read(key, recursive=False):
+        if key == "/indexes/jobs/status/finished":
+            return maps.NamedDict(leaves=[
+                leaf(key + "/old", now - 100),
+                leaf(key + "/recent_1", now - 10),
+                leaf(key + "/recent_2", now - 5)])
+        raise etcd.EtcdKeyNotFound
+    with patch.object(etcd_utils, "read", read):
+        with patch.object(retention, "archive_job") as mock_archive:
+            assert retention.purge_jobs(50, 10, 3600) == 1
+            mock_archive.assert_called_once_with("old", "finished", 3600)
+            # The size policy archives the oldest jobs too
+            mock_archive.reset_mock()
+            assert retention.purge_jobs(50, 1, 3600) == 2
+            assert [c[0][0] for c in mock_archive.call_args_list] == \
+                ["old", "recent_1"]
+
+
+def test_purge_unindexed_jobs():
+    init()
+    now = int(time.time())
+
+    def read(key, recursive=False):
+        if key == "/indexes/jobs/status/finished":
+            return maps.NamedDict(leaves=[leaf(key + "/indexed", now)])
+        if key == "/queue":
+            return maps.NamedDict(leaves=[
+                leaf("/queue/indexed", None, dir=True),
+                leaf("/queue/old", None, dir=True),
+                leaf("/queue/running", None, dir=True)])
+        values = {
+            "/queue/old/status": "failed",
+            "/queue/old/updated_at": "2017-01-01 10:00:00.000000+00:00",
+            "/queue/running/status": "processing"}
+        if key in values:
+            return maps.NamedDict(value=values[key])
+        raise etcd.EtcdKeyNotFound
+    with patch.object(etcd_utils, "read", read):
+        with patch.object(retention, "archive_job") as mock_archive:
+            assert retention.purge_jobs(50, 10, 3600) == 1
+    mock_archive.assert_called_once_with("old", "failed", 3600)
+
+
+def test_purge_keeps_children_of_running_jobs():
+    init()
+    now = int(time.time())
+
+    def read(key, recursive=False):
+        if key == "/indexes/jobs/status/finished":
+            return maps.NamedDict(leaves=[
+                leaf(key + "/child_1", now - 100),
+                leaf(key + "/child_2", now - 100),
+                leaf(key + "/parent_2", now - 100)])
+        values = {
+            "/queue/child_1/payload": json.dumps({"parent": "parent_1"}),
+            "/queue/parent_1/status": "processing",
+            "/queue/child_2/payload": json.dumps({"parent": "parent_2"}),
+            "/queue/parent_2/status": "finished"}
+        if key in values:
+            return maps.NamedDict(value=values[key])
+        raise etcd.EtcdKeyNotFound
+    with patch.object(etcd_utils, "read", read):
+        with patch.object(retention, "archive_job") as mock_archive:
+            # The size policy skips them too
+            assert retention.purge_jobs(50, 0, 3600) == 2
+    assert sorted(c[0][0] for c in mock_archive.call_args_list) == \
+        ["child_2", "parent_2"]
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_archive_job():
+    init()
+
+    def read(key, recursive=False):
+        assert recursive
+        return maps.NamedDict(leaves=[
+            leaf("/queue/1/status", "finished"),
+            leaf("/queue/1/output", None, dir=True),
+            leaf("/queue/1/output/result", "ok")])
+    with patch.object(etcd_utils, "read", read), \
+            patch.object(etcd_utils, "write") as mock_write, \
+            patch.object(etcd_utils, "delete") as mock_delete:
+        retention.archive_job("1", "finished", 3600)
+    key, value = mock_write.call_args[0]
+    assert key == "/archive/queue/1"
+    assert json.loads(value) == {"status": "finished",
+                                 "output/result": "ok"}
+    assert mock_write.call_args[1] == {"ttl": 3600}
+    mock_delete.assert_any_call("/queue/1", recursive=True)
+    mock_delete.assert_any_call("/indexes/jobs/status/finished/1")
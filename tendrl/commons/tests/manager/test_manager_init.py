@@ -86,6 +86,30 @@ def test_start():
         manager.start()
 
 
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_start_stop_central_store():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS.publisher_id = "node_agent"
+    services = mock.MagicMock()
+    NS._int = maps.NamedDict(connection=services.connection,
+                             cache=services.cache,
+                             write_behind=services.write_behind)
+    manager = Manager(None)
+    manager.start()
+    assert services.mock_calls[:3] == [mock.call.connection.start(),
+                                       mock.call.cache.start(),
+                                       mock.call.write_behind.start()]
+    services.reset_mock()
+    manager.stop()
+    # Pending saves are written out before the connection is let go
+    assert services.mock_calls[:3] == [mock.call.write_behind.stop(),
+                                       mock.call.cache.stop(),
+                                       mock.call.connection.stop()]
+
+
 # Testing join
 @patch.object(gevent.greenlet.Greenlet, 'join')
 @mock.patch('tendrl.commons.event.Event.__init__',
@@ -1,6 +1,7 @@
 import pytest
 import maps
 from mock import patch
+from tendrl.commons.objects import job as job_module
 from tendrl.commons.objects.job import Job
 from tendrl.commons import objects
 from etcd import Client
@@ -31,8 +32,10 @@ def test_constructor():
 
 
 # Testing save
+@patch.object(job_module, "unindex_job")
+@patch.object(job_module, "index_job")
 @patch.object(objects.BaseObject,"save",return_value = None)
-def test_save(mock_save):
+def test_save(mock_save, mock_index, mock_unindex):
     job = Job()
     payload = maps.NamedDict()
     payload['parent'] = "Test Parent Job Id"
@@ -51,6 +54,57 @@ def test_save(mock_save):
          job.save()    
     
 
+def test_save_index():
+    job = Job(job_id="1", status="new",
+              payload=maps.NamedDict(tags=["tendrl/monitor"]))
+    with patch.object(objects.BaseObject, "save"), \
+            patch.object(job_module.time, "time", return_value=100.5):
+        with patch.object(job_module.etcd_utils, "write_many") as mock_write:
+            with patch.object(job_module.etcd_utils, "delete") as mock_del:
+                job.save()
+                mock_write.assert_called_once_with(
+                    [("/indexes/jobs/status/new/1", 100),
+                     ("/indexes/jobs/tags/tendrl/monitor/1", 100)])
+                assert not mock_del.called
+                # Leaving "new" drops the job from the other statuses
+                # and from the tags index
+                mock_del.side_effect = etcd.EtcdKeyNotFound
+                job.status = "finished"
+                job.save()
+                mock_write.assert_called_with(
+                    [("/indexes/jobs/status/finished/1", 100)])
+                deleted = [c[0][0] for c in mock_del.call_args_list]
+                assert "/indexes/jobs/status/new/1" in deleted
+                assert "/indexes/jobs/tags/tendrl/monitor/1" in deleted
+                assert "/indexes/jobs/status/finished/1" not in deleted
+                # The status of a loaded job may be stale, the index is
+                # left alone unless the status is set
+                mock_write.reset_mock()
+                mock_del.reset_mock()
+                job._mark_clean()
+                job.errors = "Failed"
+                job.save()
+                assert not mock_write.called
+                assert not mock_del.called
+
+
+def test_indexed_job_ids():
+    def read(key):
+        if key == "/indexes/jobs/tags/tendrl/node_1":
+            raise etcd.EtcdKeyNotFound
+        index = 10 if key.endswith("monitor") else 8
+        return maps.NamedDict(etcd_index=index, leaves=[
+            maps.NamedDict(key=key + "/1", dir=False),
+            maps.NamedDict(key=key + "/2", dir=False)])
+    with patch.object(job_module.etcd_utils, "read", read):
+        assert job_module.indexed_job_ids() == (8, set(["1", "2"]))
+        assert job_module.indexed_job_ids(
+            tags=["tendrl/monitor", "tendrl/node_1"]) == \
+            (10, set(["1", "2"]))
+        with pytest.raises(etcd.EtcdKeyNotFound):
+            job_module.indexed_job_ids(tags=["tendrl/node_1"])
+
+
 # Testing render
 def test_render():
     job = Job()
@@ -13,6 +13,8 @@ import importlib
 from tendrl.commons.tests.fixtures.client import Client as dummy_client
 import tendrl.commons.objects.node_context as node
 from tendrl.commons.utils.central_store import utils as cs_utils
+from tendrl.commons.utils.central_store import write_behind
+from tendrl.commons.utils import etcd_utils
 
 ''' Child Classes'''
 
@@ -136,6 +138,27 @@ def test_load_definition():
         with pytest.raises(Exception):
             obj.load_definition()
 
+
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_load_definition_shared():
+    tendrlNS = init()
+    NS.publisher_id = "node_agent"
+    defs = maps.NamedDict(attr_types={"test": "json"})
+    with patch.object(__builtin__, 'hasattr', has_attr):
+        obj = BaseObject_Child()
+    obj._ns = tendrlNS
+    with patch.object(TendrlNS, 'get_obj_definition', return_value=defs):
+        with patch('tendrl.commons.event.Event.__init__',
+                   return_value=None) as mock_event:
+            assert obj.load_definition() is defs
+            assert obj.load_definition() is defs
+            # Only the first load for the object type is logged
+            assert mock_event.call_count == 1
+    obj._defs = defs
+    assert obj._attr_type("test") == "json"
+    assert obj._attr_type("value") is None
+
 @mock.patch('tendrl.commons.event.Event.__init__',
             mock.Mock(return_value=None))
 @mock.patch('tendrl.commons.message.Message.__init__',
@@ -211,58 +234,315 @@ def test_save():
                     obj.save()
 
 
+def leaf(key, value, dir=False):
+    return maps.NamedDict(key=key, value=value, dir=dir)
+
+
+def recursive_read(*args, **kwargs):
+    if args[-1] == "/nodes/Test_object/hash":
+        raise etcd.EtcdKeyNotFound
+    assert kwargs["recursive"]
+    return maps.NamedDict(leaves=[
+        leaf("/nodes/Test_object", None, dir=True),
+        leaf("/nodes/Test_object/test", '["a", "b"]'),
+        leaf("/nodes/Test_object/hash", "hash_value"),
+        leaf("/nodes/Test_object/unknown", "unknown_value")])
+
+
+def recursive_read_dict(*args, **kwargs):
+    if args[-1] == "/nodes/Test_object/hash":
+        raise etcd.EtcdKeyNotFound
+    return maps.NamedDict(leaves=[
+        leaf("/nodes/Test_object/test/key1", "value1"),
+        leaf("/nodes/Test_object/test/key2", "value2")])
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
 def test_load():
-    tendrlNS = init()
-    with patch.object(__builtin__,'hasattr',has_attr) as mock_hasattr:    
-        obj = BaseObject_Child()
-        obj._ns = tendrlNS
-        with patch.object(TendrlNS,'get_obj_definition',obj_definition) as mock_obj_definition:
-            obj._defs = obj.load_definition()
-            obj.value = 'Test'
-            with patch.object(Client,"write",return_value = True) as mock_write:
-                with patch.object(Client,"read",return_value = maps.NamedDict(value="Test")) as mock_read:
-                    with patch.object(objects.BaseObject,'render',return_value = [{'value': '9fb712695c0f42dbf2edf13e6c03a828', 'dir': False, 'name': 'hash', 'key': '/1/hash'}]) as mock_render:
-                        obj._defs = maps.NamedDict(attrs=maps.NamedDict(hash=maps.NamedDict(type="json")))
-                        with pytest.raises(TypeError):
-                            obj.load()
-                NS._int.client = etcd.Client()
-                NS._int.reconnect = type("Dummy",(object,),{})
-                with patch.object(Client,"read",read) as mock_read:
-                    with patch.object(objects.BaseObject,'render',return_value = [{'value': '9fb712695c0f42dbf2edf13e6c03a828', 'dir': False, 'name': 'hash', 'key': '/1/hash'}]) as mock_render:
-                        obj._defs = maps.NamedDict(attrs=maps.NamedDict(hash=maps.NamedDict(type="json")))
-                        with pytest.raises(etcd.EtcdConnectionFailed):
-                            obj.load()
-                        obj._defs = maps.NamedDict(attrs=maps.NamedDict(hash=maps.NamedDict(type='')))
-                        with pytest.raises(etcd.EtcdConnectionFailed):
-                            obj.load()
-                with patch.object(Client,"read",return_value = maps.NamedDict(value = "test_value")) as mock_read:
-                    with patch.object(objects.BaseObject,'render',return_value = [{'value': '9fb712695c0f42dbf2edf13e6c03a828', 'dir': False, 'name': 'hash', 'key': '/1/hash'}]) as mock_render:
-                        obj._defs = maps.NamedDict(attrs=maps.NamedDict(hash=maps.NamedDict(type='')))
-                        obj.load()
-                with patch.object(Client,"read",return_value = maps.NamedDict(value = "test_value")) as mock_read:
-                    with patch.object(objects.BaseObject,'render',return_value = [{'value': '9fb712695c0f42dbf2edf13e6c03a828', 'dir': False, 'name': 'hash', 'key': '/1/hash'}]) as mock_render:
-                        obj._defs = maps.NamedDict(attrs=maps.NamedDict(hash=maps.NamedDict(type='')))
-                        obj.load()
-                with patch.object(Client,"read",return_value = True) as mock_read:
-                    with patch.object(objects.BaseObject,'render',return_value = [{'value': 'test_val', 'dir': True, 'name': 'test', 'key': '/1/hash'}]) as mock_render:
-                        with pytest.raises(AttributeError):
-                            obj._defs = maps.NamedDict(attrs=maps.NamedDict(hash=maps.NamedDict(type="json")))
-                            obj.test = {"test":"test_variable"}
-                            obj.load()
-    with patch.object(objects.BaseObject,'load_definition',return_value = maps.NamedDict()) as mock_load_defination:
-        obj = BaseObject_Child()
-        with patch.object(objects.BaseObject,'render',return_value = [{'value': '9', 'dir': True, 'name': 'hash', 'key': '/1/hash'}]) as mock_render:
-            with patch.object(Client,"read",return_value = maps.NamedDict(value="Test")) as mock_read:
+    init()
+    NS._int.client = etcd.Client()
+    NS._int.reconnect = type("Dummy", (object,), {})
+    _defs = maps.NamedDict(attrs=maps.NamedDict(
+        test=maps.NamedDict(type="list")))
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=_defs):
+        obj = BaseObject_Child(test="test_value")
+        with patch.object(Client, "read", read_fn):
+            ret = obj.load()
+            assert ret.test == "test_value"
+        with patch.object(Client, "read",
+                          side_effect=recursive_read) as mock_read:
+            ret = obj.load()
+            # One read for the stored hash, one for the whole object
+            assert mock_read.call_count == 2
+            assert ret.test == ["a", "b"]
+            assert not hasattr(ret, "unknown")
+        with patch.object(Client, "read", recursive_read_dict):
+            ret = obj.load()
+            assert ret.test == {"key1": "value1", "key2": "value2"}
+        with patch.object(Client, "read", read):
+            with pytest.raises(etcd.EtcdConnectionFailed):
                 obj.load()
-    with patch.object(objects.BaseObject,'load_definition',return_value = maps.NamedDict()) as mock_load_defination:
-        obj = BaseObject_Child()
-        with patch.object(objects.BaseObject,'render',return_value = [{'value': '9', 'dir': True, 'name': 'test', 'key': '/1/hash'}]) as mock_render:
-            with patch.object(Client,"read",return_value = maps.NamedDict(value="Test")) as mock_read:
-                with patch.object(__builtin__,"hasattr",return_value = True) as mock_hasattr:
-                    obj.test = "test_variable"
-                    obj.load()
-                    obj.test = {"test":"test_var"}
-                    obj.load()
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_load_consistency():
+    init()
+    NS._int.client = etcd.Client()
+    _defs = maps.NamedDict(attrs=maps.NamedDict())
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=_defs):
+        obj = BaseObject_Child(test="test_value")
+        with patch.object(Client, "read",
+                          side_effect=recursive_read) as mock_read:
+            obj.load()
+            assert [c[1]["quorum"] for c in mock_read.call_args_list] == \
+                [True, True]
+            # Default of the object type
+            _defs.consistency = etcd_utils.SERIALIZABLE
+            mock_read.reset_mock()
+            obj.load()
+            assert [c[1]["quorum"] for c in mock_read.call_args_list] == \
+                [False, False]
+            # Overridden by the call site
+            mock_read.reset_mock()
+            obj.load(consistency=etcd_utils.QUORUM)
+            assert [c[1]["quorum"] for c in mock_read.call_args_list] == \
+                [True, True]
+            with pytest.raises(ValueError):
+                obj.load(consistency="stale")
+
+
+def test_hash():
+    init()
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=maps.NamedDict()):
+        obj = BaseObject_Child(test="test_value")
+        digest = obj._hash()
+        # hash and updated_at are neither part of the digest nor reset
+        obj.hash = "stale"
+        obj.updated_at = "now"
+        assert obj._hash() == digest
+        assert obj.updated_at == "now"
+        # Cached until an attr is set
+        with patch.object(json, "dumps") as mock_dumps:
+            assert obj._hash() == digest
+            assert not mock_dumps.called
+        obj.test = "other_value"
+        assert obj._hash() != digest
+        obj.test = "test_value"
+        assert obj._hash() == digest
+        # Digests of objects with mutable attrs are not cached
+        obj.test = ["a"]
+        digest = obj._hash()
+        obj.test.append("b")
+        assert obj._hash() != digest
+        # No collision between values which are permutations of each other
+        other = BaseObject_Child(test=["b", "a"])
+        assert obj._hash() != other._hash()
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_stored_hash_from_cache():
+    init()
+    NS._int.client = etcd.Client()
+    NS._int.cache = mock.MagicMock(enabled=True)
+    _defs = maps.NamedDict(cache_ttl=300, consistency="serializable")
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=_defs):
+        obj = BaseObject_Child(test="test_value")
+        NS._int.cache.get.return_value = [
+            leaf("/nodes/Test_object/test", "test_value"),
+            leaf("/nodes/Test_object/hash", obj._hash())]
+        with patch.object(Client, "read") as mock_read:
+            assert obj._unchanged()
+            obj.save()
+            assert not mock_read.called
+        # Quorum reads skip the cache
+        with patch.object(Client, "read",
+                          return_value=maps.NamedDict(value="")) as \
+                mock_read:
+            assert not obj._unchanged(etcd_utils.QUORUM)
+            assert mock_read.call_args[1]["quorum"]
+        NS._int.cache.get.return_value = []
+        with patch.object(Client, "read") as mock_read:
+            assert not obj._unchanged()
+            assert not mock_read.called
+    del NS._int["cache"]
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_save_changed_attrs():
+    init()
+    NS._int.client = etcd.Client()
+    _defs = maps.NamedDict(attrs=maps.NamedDict(
+        test=maps.NamedDict(type="list")))
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=_defs):
+        obj = BaseObject_Child(test=None)
+        obj.status = "new"
+        with patch.object(Client, "read", side_effect=recursive_read):
+            with patch.object(etcd_utils, "write_many") as mock_write:
+                # Never loaded, all attrs but the None ones are written
+                obj.save()
+                keys = [k for k, v in mock_write.call_args[0][0]]
+                assert sorted(keys) == ["/nodes/Test_object/hash",
+                                        "/nodes/Test_object/status",
+                                        "/nodes/Test_object/updated_at"]
+            obj = obj.load()
+            assert obj.test == ["a", "b"]
+            # Setting the loaded value back is no change
+            obj.test = ["a", "b"]
+            assert obj._changed_attrs() == set()
+            with patch.object(etcd_utils, "write_many") as mock_write, \
+                    patch.object(etcd_utils, "write_hash") as mock_hash:
+                obj.status = "finished"
+                obj.save()
+                keys = [k for k, v in mock_write.call_args[0][0]]
+                assert sorted(keys) == ["/nodes/Test_object/status",
+                                        "/nodes/Test_object/updated_at"]
+                # The digest replaces the hash the object was read with
+                mock_hash.assert_called_once_with(
+                    "/nodes/Test_object/hash", obj._hash(), "hash_value")
+                # In place changes of list, dict attrs are detected
+                obj.test.append("c")
+                obj.save()
+                items = dict(mock_write.call_args[0][0])
+                assert "/nodes/Test_object/status" not in items
+                assert sorted(json.loads(
+                    items["/nodes/Test_object/test"])) == ["a", "b", "c"]
+                # compared with the hash written by the previous save
+                assert mock_hash.call_args[0][2] != "hash_value"
+                assert "/nodes/Test_object/hash" not in items
+                # update=False rewrites the whole object
+                obj.test = ["a"]
+                obj.save(update=False)
+                items = dict(mock_write.call_args[0][0])
+                assert "/nodes/Test_object/status" in items
+                assert items["/nodes/Test_object/hash"] == obj._hash()
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_save_write_behind():
+    init()
+    NS._int.client = etcd.Client()
+    NS._int.write_behind = mock.MagicMock()
+    _defs = maps.NamedDict(attrs=maps.NamedDict(), write_behind=True)
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=_defs):
+        obj = BaseObject_Child(test="test_value")
+        with patch.object(Client, "read", side_effect=recursive_read):
+            with patch.object(etcd_utils, "write_many") as mock_write:
+                obj.save(ttl=10)
+                assert not mock_write.called
+                obj_key, items, ttl = \
+                    NS._int.write_behind.put.call_args[0]
+                assert obj_key == "/nodes/Test_object"
+                assert ("/nodes/Test_object/test", "test_value") in items
+                assert ttl == 10
+                # Pending saves are written out before the object is read
+                obj.load()
+                NS._int.write_behind.flush.assert_called_once_with(
+                    "/nodes/Test_object")
+                # Saved right away while the queue is not flushing
+                NS._int.write_behind.enabled = False
+                obj.test = "new_value"
+                obj.save()
+                assert mock_write.called
+    del NS._int["write_behind"]
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_save_write_behind_last_wins():
+    init()
+    store = {}
+
+    def read(key, **kwargs):
+        if key not in store:
+            raise etcd.EtcdKeyNotFound
+        return maps.NamedDict(value=store[key])
+    NS._int.client = mock.MagicMock(read=read)
+    NS._int.write_behind = write_behind.WriteBehindQueue(flush_interval=60)
+    NS._int.write_behind.start()
+    _defs = maps.NamedDict(attrs=maps.NamedDict(), write_behind=True)
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=_defs):
+        with patch.object(etcd_utils, "write_many",
+                          side_effect=lambda items: store.update(items)):
+            BaseObject_Child(test="UP").save()
+            NS._int.write_behind.flush()
+            BaseObject_Child(test="DOWN").save()
+            # Same as the stored object, but not as the queued one
+            BaseObject_Child(test="UP").save()
+            NS._int.write_behind.stop()
+    assert store["/nodes/Test_object/test"] == "UP"
+    del NS._int["write_behind"]
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_compact_storage():
+    init()
+    NS._int.client = etcd.Client()
+    _defs = maps.NamedDict(storage="compact", attrs=maps.NamedDict(
+        test=maps.NamedDict(type="list")))
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=_defs):
+        obj = BaseObject_Child(test=["a", "b"])
+        obj.status = None
+        stored = {"status": "new", "test": ["c"], "hash": "old"}
+
+        def read(*args, **kwargs):
+            return maps.NamedDict(leaves=[
+                leaf("/nodes/Test_object/data", json.dumps(stored)),
+                leaf("/nodes/Test_object/test", '["stale"]')])
+        with patch.object(Client, "read", side_effect=read) as mock_read:
+            with patch.object(etcd_utils, "write_many") as mock_write:
+                obj.save()
+            [(key, value)] = mock_write.call_args[0][0]
+            assert key == "/nodes/Test_object/data"
+            data = json.loads(value)
+            assert data["test"] == ["a", "b"]
+            # None attrs keep their stored value
+            assert data["status"] == "new"
+            assert data["hash"] == obj._hash()
+
+            stored = data
+            # A single read of the object, the stored data wins over
+            # leftover keys of the per attr format
+            mock_read.reset_mock()
+            ret = BaseObject_Child(test=None).load()
+            assert mock_read.call_count == 1
+            assert ret.test == ["a", "b"]
+            # Unchanged object, nothing to write
+            ret.status = "finished"
+            with patch.object(etcd_utils, "write_many") as mock_write:
+                ret.save()
+                stored = json.loads(mock_write.call_args[0][0][0][1])
+                mock_write.reset_mock()
+                ret.save()
+                assert not mock_write.called
+
 
 def test_exists():
     tendrlNS = init()
@@ -290,11 +570,20 @@ def test_load_all():
         obj = BaseObject_Child()
         obj._ns = tendrlNS
         with patch.object(dummy_client,"read",return_value = maps.NamedDict(leaves = {})) as mock_read:
-            obj.load_all()
-        with patch.object(dummy_client,"read",return_value = maps.NamedDict(leaves = [maps.NamedDict(key = 'test_value')])) as mock_read:
-            with patch.object(BaseObject_Child,'load',return_value = "tst"):
-                ret = obj.load_all()
-                assert isinstance(ret,list)
+            assert obj.load_all() == []
+        obj = BaseObject_Child(test="test_value")
+        obj._ns = tendrlNS
+        resp = maps.NamedDict(leaves=[leaf("/nodes/one/test", "1"),
+                                      leaf("/nodes/two/test", "2"),
+                                      leaf("/nodes/three", None, dir=True)])
+        with patch.object(dummy_client, "read",
+                          return_value=resp) as mock_read:
+            ret = obj.load_all()
+            assert mock_read.call_count == 1
+            assert [o.value for o in ret] == ["nodes/one", "nodes/two",
+                                              "nodes/three"]
+            assert [o.test for o in ret] == ["1", "2", "test_value"]
+            assert obj.value == "nodes/Test_object"
         with patch.object(dummy_client,"read",read) as mock_read:
             with pytest.raises(etcd.EtcdConnectionFailed):
                 obj.load_all()
@@ -302,6 +591,35 @@ def test_load_all():
                 ret = obj.load_all()
                 assert ret is None
 
+def listing_read(*args, **kwargs):
+    if kwargs.get("recursive"):
+        if args[-1] == "/nodes/two":
+            raise etcd.EtcdKeyNotFound
+        return maps.NamedDict(leaves=[leaf(args[-1] + "/test", args[-1])])
+    return maps.NamedDict(leaves=[leaf("/nodes/one", None, dir=True),
+                                  leaf("/nodes/two", None, dir=True),
+                                  leaf("/nodes/three", None, dir=True)])
+
+
+def test_iter_all():
+    init()
+    NS._int.reconnect = type("Dummy", (object,), {})
+    NS._int.client = importlib.import_module(
+        "tendrl.commons.tests.fixtures.client").Client()
+    with patch.object(__builtin__, 'hasattr', has_attr):
+        obj = BaseObject_Child(test="test_value")
+        with patch.object(dummy_client, "read", listing_read):
+            ret = obj.iter_all()
+            assert not isinstance(ret, list)
+            ret = list(ret)
+            assert [o.test for o in ret] == ["/nodes/one", "/nodes/three"]
+        with patch.object(dummy_client, "read", read_fn):
+            assert list(obj.iter_all()) == []
+        with patch.object(dummy_client, "read", read):
+            with pytest.raises(etcd.EtcdConnectionFailed):
+                list(obj.iter_all())
+
+
 def test_constructor_BaseAtom():
     tendrlNS = init()
     with patch.object(TendrlNS,'get_atom_definition',return_value = True) as mock_atm_def:
@@ -329,6 +647,25 @@ def test_load_definition_BaseAtom():
             obj._defs = obj.load_definition()
 
 
+def test_load_definition_BaseAtom_shared():
+    tendrlNS = init()
+    NS.publisher_id = "node_agent"
+    defs = maps.NamedDict(help="Write")
+    with patch.object(__builtin__, 'hasattr', has_attr):
+        obj = BaseAtom_Child(1)
+    obj._ns = tendrlNS
+    obj.obj = BaseObject_Child
+    with patch.object(TendrlNS, 'get_atom_definition',
+                      return_value=defs) as mock_atom_def:
+        with patch('tendrl.commons.event.Event.__init__',
+                   return_value=None) as mock_event:
+            assert obj.load_definition() is defs
+            assert obj.load_definition() is defs
+            # Only the first load for the atom is logged
+            assert mock_event.call_count == 1
+    mock_atom_def.assert_called_with("BaseObject_Child", "write")
+
+
 def test_run():
     with patch.object(__builtin__,'hasattr',has_attr) as mock_hasattr:    
         obj = BaseAtom_Child(1)
@@ -344,3 +681,46 @@ def test_constructor_AtomNotImplementedError():
 def test_constructor_AtomExecutionFailedError():
     obj = objects.AtomExecutionFailedError("Test Error")
     assert obj.message == "Atom Execution failed. Error: Test Error"
+
+
+@mock.patch('tendrl.commons.event.Event.__init__',
+            mock.Mock(return_value=None))
+@mock.patch('tendrl.commons.message.Message.__init__',
+            mock.Mock(return_value=None))
+def test_save_all():
+    tendrlNS = init()
+    NS._int.client = etcd.Client()
+    NS._int.wclient = etcd.Client()
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=maps.NamedDict()):
+        obj1 = BaseObject_Child(test="one")
+        obj2 = BaseObject_Child(test="two")
+    with patch.object(Client, "read", read_fn):
+        with patch.object(etcd_utils, "write_many") as mock_write_many:
+            objects.save_all([obj1, obj2], update=False)
+            assert mock_write_many.call_count == 1
+            items = mock_write_many.call_args[0][0]
+            keys = [key for key, value in items]
+            assert "/nodes/Test_object/test" in keys
+            assert len(keys) == 2 * len(obj1.render())
+            # The saved objects are in sync with the central store
+            assert obj1._changed_attrs() == set()
+            assert obj2._changed_attrs() == set()
+
+    # Write-behind objects are queued
+    NS._int.write_behind = mock.MagicMock()
+    with patch.object(objects.BaseObject, 'load_definition',
+                      return_value=maps.NamedDict(write_behind=True)):
+        obj3 = BaseObject_Child(test="three")
+    with patch.object(Client, "read", read_fn):
+        with patch.object(etcd_utils, "write_many") as mock_write_many, \
+                patch.object(etcd_utils, "refresh") as mock_refresh:
+            objects.save_all([obj1, obj3], update=False, ttl=10)
+            keys = [key for key, value in mock_write_many.call_args[0][0]]
+            assert len(keys) == len(obj1.render())
+            mock_refresh.assert_called_once_with(obj1.value, 10)
+    obj_key, items, ttl = NS._int.write_behind.put.call_args[0]
+    assert ("/nodes/Test_object/test", "three") in items
+    assert ttl == 10
+    assert obj3._changed_attrs() == set()
+    del NS._int["write_behind"]
@@ -0,0 +1,227 @@
+import __builtin__
+import os
+import shutil
+import struct
+import tempfile
+
+import gevent
+from gevent import socket
+import maps
+from mock import patch
+import pytest
+
+from tendrl.commons import event
+from tendrl.commons import message as message_module
+from tendrl.commons.message import Message
+
+
+def listen():
+    path = os.path.join(tempfile.mkdtemp(), "message.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(5)
+    return server, path
+
+
+def read_frames(conn, count):
+    frames = []
+    for _ in range(count):
+        size = struct.unpack("=I", conn.recv(4, socket.MSG_WAITALL))[0]
+        frames.append(conn.recv(size, socket.MSG_WAITALL))
+    return frames
+
+
+def message(text):
+    return Message(priority="info", publisher="integration",
+                   payload={"message": text}, node_id="1")
+
+
+def init(persistent=False):
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict()
+    NS.config = maps.NamedDict(
+        data={"logging_socket_persistent": persistent})
+
+
+def test_transport():
+    init()
+    server, path = listen()
+    try:
+        event.transport(path).send('{"a": 1}', '{"b": 2}')
+        # One frame per connection
+        for expected in ['{"a": 1}', '{"b": 2}']:
+            conn, _ = server.accept()
+            assert read_frames(conn, 1) == [expected]
+            assert conn.recv(1) == ""
+            conn.close()
+        assert event.transport(path).stats() == dict(connects=2,
+                                                     failures=0, sent=2)
+    finally:
+        server.close()
+        shutil.rmtree(os.path.dirname(path))
+
+
+def test_persistent_transport():
+    init(persistent=True)
+    server, path = listen()
+    try:
+        event.Event(message("first"), socket_path=path)
+        event.Event(message("second"), socket_path=path)
+        event.transport(path).send('{"a": 1}', '{"b": 2}')
+        conn, _ = server.accept()
+        frames = read_frames(conn, 4)
+        assert [Message.from_json(frame).payload["message"]
+                for frame in frames[:2]] == ["first", "second"]
+        assert frames[2:] == ['{"a": 1}', '{"b": 2}']
+        # One connection for all the messages
+        assert event.transport(path).stats() == dict(connects=1,
+                                                     failures=0, sent=4)
+
+        # Reconnects once the other end closed the connection
+        conn.close()
+        event.transport(path).send('{"c": 3}')
+        conn, _ = server.accept()
+        assert read_frames(conn, 1) == ['{"c": 3}']
+        assert event.transport(path).stats()["connects"] == 2
+        conn.close()
+    finally:
+        event.transport(path).close()
+        server.close()
+        shutil.rmtree(os.path.dirname(path))
+
+
+def test_transport_down():
+    transport = event.SocketTransport("/nonexistent/message.sock")
+    with pytest.raises(socket.error):
+        transport.send('{"a": 1}')
+    assert transport.stats()["connects"] == 0
+
+
+def test_event_queue():
+    init(persistent=True)
+    server, path = listen()
+    NS._int.event_queue = event.EventQueue(batch_size=2)
+    try:
+        NS._int.event_queue.start()
+        for idx in range(5):
+            event.Event(message(str(idx)), socket_path=path)
+        # Queued, the caller does not wait for the socket
+        assert NS._int.event_queue.stats()["size"] == 5
+        gevent.sleep(0.05)
+        conn, _ = server.accept()
+        assert [Message.from_json(frame).payload["message"]
+                for frame in read_frames(conn, 5)] == \
+            ["0", "1", "2", "3", "4"]
+        # in batches, over a single connection
+        assert event.transport(path).stats() == dict(connects=1,
+                                                     failures=0, sent=5)
+        assert NS._int.event_queue.stats() == dict(
+            queued=5, dropped=0, blocked=0, emitted=5, failures=0, size=0)
+
+        # Stopping emits the queued Events
+        event.Event(message("5"), socket_path=path)
+        NS._int.event_queue.stop()
+        assert [Message.from_json(frame).payload["message"]
+                for frame in read_frames(conn, 1)] == ["5"]
+        conn.close()
+    finally:
+        event.transport(path).close()
+        server.close()
+        shutil.rmtree(os.path.dirname(path))
+
+
+def test_event_queue_full():
+    init()
+
+    def queued(queue):
+        return [item[0].payload["message"] for item in queue._events]
+    with patch.object(event, "emit") as mock_emit:
+        queue = event.EventQueue(max_size=2, policy="drop_oldest")
+        for idx in range(3):
+            queue.put(message(str(idx)))
+        assert queued(queue) == ["1", "2"]
+        assert queue.stats()["dropped"] == 1
+
+        queue = event.EventQueue(max_size=2, policy="drop_newest")
+        for idx in range(3):
+            queue.put(message(str(idx)))
+        assert queued(queue) == ["0", "1"]
+        assert queue.stats()["dropped"] == 1
+
+        # The caller emits a batch itself
+        queue = event.EventQueue(max_size=2, batch_size=1, policy="block")
+        msgs = [message(str(idx)) for idx in range(3)]
+        for msg in msgs:
+            queue.put(msg)
+        mock_emit.assert_called_once_with([(msgs[0], None)])
+        assert queued(queue) == ["1", "2"]
+        assert queue.stats()["dropped"] == 0
+        assert queue.stats()["blocked"] == 1
+    with pytest.raises(ValueError):
+        event.EventQueue(policy="drop_all")
+
+
+def test_event_queue_protected():
+    init()
+    error = Message(priority="error", publisher="integration",
+                    payload={"message": "error"}, node_id="1")
+    job = Message(priority="info", publisher="integration",
+                  payload={"message": "job"}, node_id="1", job_id="1",
+                  flow_id="1")
+    with patch.object(event, "emit") as mock_emit:
+        # Errors and job messages are not dropped, the oldest other one is
+        queue = event.EventQueue(max_size=3, policy="drop_oldest")
+        for msg in [error, job, message("0"), message("1")]:
+            queue.put(msg)
+        assert [item[0] for item in queue._events][:2] == [error, job]
+        assert queue._events[2][0].payload["message"] == "1"
+        assert queue.stats()["dropped"] == 1
+        # nor when they are the new message
+        queue = event.EventQueue(max_size=1, policy="drop_newest")
+        queue.put(message("0"))
+        queue.put(error)
+        assert queue.stats()["dropped"] == 0
+        assert [item[0] for item in queue._events] == [error]
+        # When none may be dropped the caller emits a batch itself
+        queue = event.EventQueue(max_size=2, batch_size=1,
+                                 policy="drop_oldest")
+        for msg in [error, job, message("0")]:
+            queue.put(msg)
+        assert mock_emit.call_args_list[-1][0][0] == [(error, None)]
+        assert queue.stats()["dropped"] == 0
+        assert queue.stats()["blocked"] == 1
+
+
+def test_min_priority():
+    init()
+    with patch.object(event, "emit") as mock_emit:
+        message_module.set_min_priority("warning")
+        try:
+            event.Event(message("info"), socket_path="/message.sock")
+            assert not mock_emit.called
+        finally:
+            message_module.set_min_priority("debug")
+        event.Event(message("info"), socket_path="/message.sock")
+        assert mock_emit.called
+
+
+def test_node_agent_event():
+    init()
+    NS.node_context = maps.NamedDict(node_id="1")
+    msg = Message(priority="info", publisher="node_agent",
+                  payload={"message": "failed",
+                           "exception": ValueError("bad")})
+    with patch.object(event, "Logger") as mock_logger, \
+            patch.object(Message, "from_json") as mock_from_json:
+        event.Event(msg)
+    # Logged as is, without a JSON round-trip
+    assert mock_logger.call_args[0][0] is msg
+    assert not mock_from_json.called
+    assert msg.payload["exception"] == "ValueError: bad"
+
+    # Invalid messages are logged as debug
+    msg = Message(priority="info", publisher="node_agent", payload={})
+    with patch.object(event, "Logger") as mock_logger:
+        event.Event(msg)
+    assert mock_logger.call_args[0][0].priority == "debug"
+    assert mock_logger.call_args[0][0].payload["message"] is msg
@@ -197,11 +197,15 @@ def test_get_obj_definition():
     assert ret is not None
     assert isinstance(ret, maps.NamedDict) is True
     assert hasattr(ret, "attrs") is True
+    # Built once and shared until the definitions change
+    assert tendrlNS.get_obj_definition("Service") is ret
     NS["compiled_definitions"] = tendrlNS.current_ns.definitions
     ret = tendrlNS.get_obj_definition("Service")
     assert ret is not None
     assert isinstance(ret, maps.NamedDict) is True
     assert hasattr(ret, "attrs") is True
+    assert ret.attr_types["service"] == "string"
+    assert ret.consistency == "serializable"
 
 
 # Testing get_obj_flow_definition
@@ -227,6 +231,8 @@ def test_get_atom_definition():
     assert ret is not None
     assert isinstance(ret, maps.NamedDict) is True
     assert hasattr(ret, "inputs") is True
+    assert tendrlNS.get_atom_definition("Service",
+                                        "CheckServiceStatus") is ret
 
 
 # Testing add_atom
@@ -416,7 +422,8 @@ def test_setup_common_objects(monkeypatch):
         tendrlNS.setup_common_objects()
         assert NS._int.client is not None
         assert NS._int.wclient is not None
-        etcd.Client.assert_called_with(allow_reconnect=True, host=1, port=1)
+        etcd.Client.assert_called_with(allow_reconnect=True, host=1, port=1,
+                                       per_host_pool_size=10)
         tendrlNS.current_ns.objects.pop("TendrlContext")
         tendrlNS.setup_common_objects()
 
@@ -425,3 +432,19 @@ def test_setup_common_objects(monkeypatch):
     monkeypatch.setattr(etcd, 'Client', client)
     with pytest.raises(Exception):
         tendrlNS.setup_common_objects()
+
+
+def test_setup_common_objects_etcd3():
+    tendrlNS = init()
+    obj = importlib.import_module("tendrl.commons.tests.fixtures.config")
+
+    class Config(obj.Config):
+        def __init__(self):
+            obj.Config.__init__(self)
+            self.data['central_store_backend'] = "etcd3"
+    tendrlNS.current_ns.objects["Config"] = Config
+    # Refused until all the central store users go through etcd_utils
+    with patch.object(etcd, "Client", return_value=etcd.Client()):
+        with pytest.raises(Exception) as ex:
+            tendrlNS.setup_common_objects()
+    assert "etcd3" in str(ex.value)
@@ -105,3 +105,36 @@ def test_serialize_message():
     assert type(ret) is str
     with pytest.raises(TypeError):
         ret = message.serialize_message("")
+
+
+def test_min_priority():
+    assert message.priority_enabled("debug")
+    message.set_min_priority("warning")
+    try:
+        assert not message.priority_enabled("info")
+        assert message.priority_enabled("warning")
+        assert message.priority_enabled("critical")
+        # Left to validate()
+        assert message.priority_enabled("None")
+        with pytest.raises(ValueError):
+            message.set_min_priority("verbose")
+    finally:
+        message.set_min_priority("debug")
+    assert message.priority_enabled("debug")
+
+
+def test_caller():
+    init()
+    line_no = sys._getframe().f_lineno + 1
+    msg = Message("info", "node_context", payload={"message": "Test"})
+    assert msg.caller == {"filename": __file__.replace(".pyc", ".py"),
+                          "line_no": line_no,
+                          "function": "test_caller"}
+    message.set_caller_priorities(["error"])
+    try:
+        msg = Message("info", "node_context", payload={"message": "Test"})
+        assert msg.caller == message.NO_CALLER
+        msg = Message("error", "node_context", payload={"message": "Test"})
+        assert msg.caller["function"] == "test_caller"
+    finally:
+        message.set_caller_priorities(message.PRIORITIES)
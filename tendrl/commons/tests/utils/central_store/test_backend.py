@@ -0,0 +1,197 @@
+import __builtin__
+import base64
+import etcd
+import maps
+from mock import MagicMock
+from mock import patch
+import pytest
+
+from tendrl.commons.utils.central_store import backend
+
+
+def b64(value):
+    return base64.b64encode(value)
+
+
+class Gateway(object):
+    """etcd v3 JSON gateway over a dict"""
+
+    def __init__(self, **keys):
+        self.keys = keys
+        self.revision = 10
+        self.requests = []
+
+    def post(self, path, body, timeout=None, stream=False):
+        self.requests.append((path, body))
+        return getattr(self, path.replace("/", "_"))(body)
+
+    def _kv_range(self, body):
+        key = base64.b64decode(body["key"])
+        end = base64.b64decode(body["range_end"]) \
+            if "range_end" in body else None
+        kvs = [{"key": b64(k), "value": b64(v), "mod_revision": "3"}
+               for k, v in sorted(self.keys.items())
+               if k == key or (end and key <= k < end)]
+        if body.get("keys_only"):
+            for kv in kvs:
+                del kv["value"]
+        resp = {"header": {"revision": str(self.revision)}}
+        if kvs:
+            resp["kvs"] = kvs
+        return resp
+
+    def _kv_put(self, body):
+        self.keys[base64.b64decode(body["key"])] = \
+            base64.b64decode(body["value"])
+        return {}
+
+    def _kv_txn(self, body):
+        for compare in body["compare"]:
+            key = base64.b64decode(compare["key"])
+            if compare["target"] == "CREATE":
+                ok = key not in self.keys
+            else:
+                ok = self.keys.get(key) == \
+                    base64.b64decode(compare["value"])
+            if not ok:
+                return {"succeeded": False, "responses": [
+                    {"response_range": self._kv_range(op["request_range"])}
+                    for op in body["failure"]]}
+        responses = []
+        for op in body["success"]:
+            if "request_put" in op:
+                self._kv_put(op["request_put"])
+                responses.append({"response_put": {}})
+            elif "request_range" in op:
+                responses.append(
+                    {"response_range": self._kv_range(op["request_range"])})
+            else:
+                kvs = self._kv_range(op["request_delete_range"]).get(
+                    "kvs", [])
+                for kv in kvs:
+                    del self.keys[base64.b64decode(kv["key"])]
+                responses.append(
+                    {"response_delete_range": {"deleted": str(len(kvs))}})
+        return {"succeeded": True, "responses": responses}
+
+    def _lease_grant(self, body):
+        return {"ID": "7", "TTL": str(body["TTL"])}
+
+    def _lease_keepalive(self, body):
+        return {"result": {"ID": body["ID"], "TTL": "10"}}
+
+
+def etcd3(**keys):
+    store = backend.Etcd3Backend((("etcd", 2379),))
+    gateway = Gateway(**keys)
+    store._post = gateway.post
+    return store, gateway
+
+
+def test_etcd2_backend():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict(client=MagicMock(), wclient=MagicMock())
+    store = backend.Etcd2Backend()
+    store.read("/nodes/1", consistency=backend.SERIALIZABLE)
+    NS._int.client.read.assert_called_with("/nodes/1", recursive=False,
+                                           quorum=False)
+    with pytest.raises(ValueError):
+        store.read("/nodes/1", consistency="linearizable")
+    store.write("/lock", "me", ttl=10, prev_exist=False)
+    NS._int.wclient.write.assert_called_with("/lock", "me", ttl=10,
+                                             prevExist=False)
+    store.delete("/lock", prev_value="me")
+    NS._int.wclient.delete.assert_called_with("/lock", recursive=False,
+                                              prevValue="me")
+    store.watch("/nodes", 5)
+    NS._int.client.read.assert_called_with("/nodes", recursive=True,
+                                           wait=True, waitIndex=6)
+
+
+def test_etcd3_read():
+    store, gateway = etcd3(**{"/nodes/1/Cpu/model": "a",
+                              "/nodes/1/Cpu/hash": "h",
+                              "/nodes/1/Os/os": "centos",
+                              "/nodes/1/fqdn": "n1"})
+    resp = store.read("/nodes/1/fqdn")
+    assert (resp.value, resp.etcd_index, resp.modifiedIndex) == \
+        ("n1", 10, 3)
+    # Directories list their keys and subdirectories
+    resp = store.read("/nodes/1")
+    assert resp.dir
+    assert sorted((leaf.key, leaf.value, leaf.dir)
+                  for leaf in resp.leaves) == [
+        ("/nodes/1/Cpu", None, True), ("/nodes/1/Os", None, True),
+        ("/nodes/1/fqdn", "n1", False)]
+    resp = store.read("/nodes/1", recursive=True,
+                      consistency=backend.SERIALIZABLE)
+    assert sorted((leaf.key, leaf.value) for leaf in resp.leaves) == [
+        ("/nodes/1/Cpu/hash", "h"), ("/nodes/1/Cpu/model", "a"),
+        ("/nodes/1/Os/os", "centos"), ("/nodes/1/fqdn", "n1")]
+    assert gateway.requests[-1][1]["serializable"]
+    with pytest.raises(etcd.EtcdKeyNotFound):
+        store.read("/nodes/2")
+
+
+def test_etcd3_write():
+    store, gateway = etcd3(**{"/lock": "other"})
+    store.write("/key", "value")
+    assert gateway.keys["/key"] == "value"
+    with pytest.raises(etcd.EtcdAlreadyExist):
+        store.write("/lock", "me", ttl=10, prev_exist=False)
+    with pytest.raises(etcd.EtcdCompareFailed):
+        store.write("/lock", "me", prev_value="me")
+    with pytest.raises(etcd.EtcdKeyNotFound):
+        store.delete("/other", prev_value="me")
+    store.delete("/lock", prev_value="other")
+    store.write("/lock", "me", ttl=10, prev_exist=False)
+    # Keys expire with a lease
+    assert gateway.requests[-2] == ("/lease/grant", {"TTL": 10})
+
+    # Small batches are one transaction, large ones write hashes last
+    store.write_many([("/obj/hash", "h"), ("/obj/a", "1")])
+    assert gateway.keys["/obj/hash"] == "h"
+    del gateway.requests[:]
+    store.MAX_TXN_OPS = 2
+    store.write_many([("/obj/hash", "h"), ("/obj/a", "1"),
+                      ("/obj/b", "2"), ("/obj/c", "3")])
+    assert [len(body["success"]) for path, body in gateway.requests] == \
+        [2, 1, 1]
+    assert gateway.requests[-1][1]["success"][0]["request_put"]["key"] == \
+        b64("/obj/hash")
+
+
+def test_etcd3_refresh():
+    store, gateway = etcd3(**{"/nodes/1/NodeContext/fqdn": "n1",
+                              "/nodes/1/Os/os": "centos"})
+    store.refresh("/nodes/1", 10)
+    assert gateway.requests[2] == ("/lease/grant", {"TTL": 10})
+    # The keys and the later writes below the directory join its lease
+    assert all(op["request_put"]["lease"] == "7"
+               for op in gateway.requests[3][1]["success"])
+    store.write("/nodes/1/Os/os", "rhel")
+    assert gateway.requests[-1][1]["lease"] == "7"
+    # which later refreshes keep alive
+    del gateway.requests[:]
+    store.refresh("/nodes/1", 10)
+    assert gateway.requests == [("/lease/keepalive", {"ID": "7"})]
+    store.delete("/nodes/1", recursive=True)
+    assert not gateway.keys
+    with pytest.raises(etcd.EtcdKeyNotFound):
+        store.refresh("/nodes/1", 10)
+
+
+def test_etcd3_failover():
+    store = backend.Etcd3Backend((("etcd-1", 2379), ("etcd-2", 2379)))
+    response = MagicMock(status=200, data='{"header": {"revision": "4"}}')
+    with patch.object(store._http, "request",
+                      side_effect=[backend.urllib3.exceptions.HTTPError,
+                                   response]) as request:
+        assert store.index() == 4
+    assert request.call_args[0][1] == "http://etcd-2:2379/v3/kv/range"
+    # The failing member is tried last from then on
+    assert store._endpoints[0] == "http://etcd-2:2379/v3"
+    with patch.object(store._http, "request",
+                      side_effect=backend.urllib3.exceptions.HTTPError):
+        with pytest.raises(etcd.EtcdConnectionFailed):
+            store.index()
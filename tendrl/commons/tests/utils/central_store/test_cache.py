@@ -0,0 +1,142 @@
+import __builtin__
+import etcd
+import gevent
+import maps
+from mock import MagicMock
+from mock import patch
+import time
+
+from tendrl.commons.utils.central_store import cache
+
+PREFIXES = ["/nodes", "/clusters"]
+
+
+def test_get_put():
+    obj_cache = cache.ObjectCache(max_size=2, prefixes=PREFIXES)
+    assert obj_cache.get("/nodes/1/Cpu") is None
+    obj_cache.put("/nodes/1/Cpu", ["leaf"], 10, 1)
+    assert obj_cache.get("/nodes/1/Cpu") == ["leaf"]
+    assert obj_cache.stats() == dict(hits=1, misses=1, evictions=0,
+                                     refused=0, size=1)
+    # Expired entries are dropped on access
+    with patch.object(time, "time", return_value=time.time() + 20):
+        assert obj_cache.get("/nodes/1/Cpu") is None
+    assert obj_cache.stats()["size"] == 0
+
+
+def test_put_evicts_lru():
+    obj_cache = cache.ObjectCache(max_size=2, prefixes=PREFIXES)
+    obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 1)
+    obj_cache.put("/nodes/1/Os", ["os"], 10, 1)
+    obj_cache.get("/nodes/1/Cpu")
+    obj_cache.put("/nodes/1/Memory", ["memory"], 10, 1)
+    assert obj_cache.get("/nodes/1/Os") is None
+    assert obj_cache.get("/nodes/1/Cpu") == ["cpu"]
+    assert obj_cache.get("/nodes/1/Memory") == ["memory"]
+    assert obj_cache.evictions == 1
+
+
+def test_invalidate():
+    obj_cache = cache.ObjectCache(prefixes=PREFIXES)
+    obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 1)
+    obj_cache.put("/nodes/1/Os", ["os"], 10, 1)
+    obj_cache.put("/nodes/2/Os", ["os"], 10, 1)
+    # A changed leaf drops its object
+    obj_cache.invalidate("/nodes/1/Cpu/model")
+    assert obj_cache.get("/nodes/1/Cpu") is None
+    assert obj_cache.get("/nodes/1/Os") == ["os"]
+    # A changed directory drops every object below it
+    obj_cache.invalidate("/nodes/1")
+    assert obj_cache.get("/nodes/1/Os") is None
+    assert obj_cache.get("/nodes/2/Os") == ["os"]
+
+
+def test_put_refuses_stale_reads():
+    obj_cache = cache.ObjectCache(prefixes=PREFIXES)
+    # Changed after the read
+    obj_cache.invalidate("/nodes/1/Cpu/model", 8)
+    assert not obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 7)
+    assert obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 8)
+    assert obj_cache.put("/nodes/1/Os", ["os"], 10, 7)
+    # Not below a watched prefix
+    assert not obj_cache.put("/queue/1", ["job"], 10, 9)
+    # Older than the resync of the watcher
+    obj_cache._synced_index["/clusters"] = 9
+    assert not obj_cache.put("/clusters/1/TendrlContext", ["tc"], 10, 8)
+    assert obj_cache.stats()["refused"] == 3
+
+
+def test_forgotten_changes_refuse_puts():
+    obj_cache = cache.ObjectCache(max_size=1, prefixes=PREFIXES)
+    obj_cache.invalidate("/nodes/1/Cpu/model", 8)
+    obj_cache.invalidate("/nodes/1/Os/os", 9)
+    assert not obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 7)
+    assert obj_cache._synced_index["/nodes"] == 8
+
+
+def test_watch():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict()
+    obj_cache = cache.ObjectCache(prefixes=PREFIXES)
+    obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 1)
+    obj_cache._etcd_index["/nodes"] = 5
+    change = MagicMock(key="/nodes/1/Cpu/model", modifiedIndex=6)
+
+    def read(*args, **kwargs):
+        # Only the cached prefixes are watched
+        assert args == ("/nodes",)
+        if kwargs["waitIndex"] == 7:
+            obj_cache._complete.set()
+            raise etcd.EtcdWatchTimedOut
+        return change
+    NS._int.client = MagicMock(read=MagicMock(side_effect=read))
+    obj_cache._watch("/nodes")
+    assert obj_cache.get("/nodes/1/Cpu") is None
+    assert obj_cache._etcd_index["/nodes"] == 6
+    # A read of the object before the change is not cached
+    assert not obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 5)
+
+    # A cleared event index resyncs the cache from the current index
+    obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 6)
+    obj_cache.put("/clusters/1/TendrlContext", ["tc"], 10, 6)
+    obj_cache._complete.clear()
+
+    def read(*args, **kwargs):
+        if not kwargs:
+            return MagicMock(etcd_index=10)
+        obj_cache._complete.set()
+        if obj_cache._etcd_index["/nodes"] == 6:
+            raise etcd.EtcdEventIndexCleared
+        raise etcd.EtcdWatchTimedOut
+    NS._int.client.read.side_effect = read
+    obj_cache._watch("/nodes")
+    assert obj_cache._etcd_index["/nodes"] is None
+    obj_cache._complete.clear()
+    obj_cache._watch("/nodes")
+    assert obj_cache._etcd_index["/nodes"] == 10
+    assert obj_cache.get("/nodes/1/Cpu") is None
+    assert obj_cache.get("/clusters/1/TendrlContext") == ["tc"]
+    assert not obj_cache.put("/nodes/1/Cpu", ["cpu"], 10, 9)
+
+
+def test_start_stop():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict(client=MagicMock())
+    NS._int.client.read.side_effect = lambda *args, **kwargs: \
+        gevent.sleep(10)
+    NS.node_context = maps.NamedDict(node_id="1")
+    obj_cache = cache.ObjectCache()
+    obj_cache.start()
+    gevent.sleep(0)
+    assert obj_cache.enabled
+    # Only the keys of the node of the agent are watched
+    assert obj_cache._watchers.keys() == ["/nodes/1"]
+    assert not obj_cache.put("/nodes/2/Cpu", ["cpu"], 10, 1)
+    obj_cache.stop()
+    assert not obj_cache.enabled
+
+    # and of its cluster, once known
+    NS.tendrl_context = maps.NamedDict(integration_id="c1")
+    obj_cache.start()
+    assert sorted(obj_cache._watchers) == ["/clusters/c1", "/nodes/1"]
+    obj_cache.stop()
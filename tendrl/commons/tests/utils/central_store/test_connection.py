@@ -0,0 +1,97 @@
+import __builtin__
+import etcd
+import gevent
+import maps
+from mock import MagicMock
+from mock import patch
+
+from tendrl.commons.utils.central_store import connection
+
+
+def init():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict(client=MagicMock(), wclient=MagicMock())
+
+
+def test_backoff():
+    for attempt in range(10):
+        assert 0 <= connection.backoff(attempt, base=1, cap=30) <= \
+            min(30, 2 ** attempt)
+
+
+def test_shared_reconnect():
+    init()
+
+    def slow_client(**kwargs):
+        gevent.sleep(0.01)
+        return "new_client"
+    manager = connection.ConnectionManager({"host": "etcd", "port": 1})
+    assert manager.etcd_kwargs["per_host_pool_size"] == 10
+    with patch.object(etcd, "Client", side_effect=slow_client) as client:
+        gevent.joinall([gevent.spawn(manager.reconnect, "client")
+                        for i in range(5)])
+    # Greenlets failing together reconnect once
+    assert client.call_count == 1
+    assert NS._int.client == "new_client"
+    assert manager.stats()["reconnects"] == 1
+    assert manager.stats()["shared_reconnects"] == 4
+
+
+def test_health_check():
+    init()
+    type(NS._int.wclient).stats = property(
+        MagicMock(side_effect=etcd.EtcdConnectionFailed))
+    manager = connection.ConnectionManager({}, health_interval=0.01)
+    with patch.object(etcd, "Client", return_value="new_client"):
+        manager.start()
+        gevent.sleep(0.015)
+        manager.stop()
+    assert NS._int.wclient == "new_client"
+    assert NS._int.client != "new_client"
+    assert manager.stats()["health_failures"] == 1
+
+
+class FakeClient(object):
+    """etcd.Client connected to the first of its hosts"""
+
+    leader_host = None
+    stats = {}
+
+    def __init__(self, host, **kwargs):
+        self.host, self.port = host[0]
+
+    @property
+    def leader(self):
+        return {"clientURLs": ["http://%s:%s" % self.leader_host]}
+
+
+def test_etcd_hosts():
+    assert connection.etcd_hosts(["etcd-1:4001", "etcd-2"], 2379) == (
+        ("etcd-1", 4001), ("etcd-2", 2379))
+
+
+def test_multi_endpoint():
+    init()
+    FakeClient.leader_host = ("etcd-2", 2379)
+    hosts = connection.etcd_hosts(["etcd-1", "etcd-2", "etcd-3"])
+    manager = connection.ConnectionManager({"host": hosts,
+                                            "allow_reconnect": True})
+    with patch.object(etcd, "Client", FakeClient):
+        # Reads go to a random member
+        with patch.object(connection.random, "randrange", return_value=2):
+            client = manager.connect("client")
+        assert (client.host, client.port) == ("etcd-3", 2379)
+        # Writes go to the leader
+        client = manager.connect("wclient")
+        assert (client.host, client.port) == ("etcd-2", 2379)
+        assert manager.stats()["leader_changes"] == 1
+        NS._int.wclient = client
+
+        # and follow it once it changes
+        FakeClient.leader_host = ("etcd-3", 2379)
+        manager.health_interval = 0.01
+        manager.start()
+        gevent.sleep(0.015)
+        manager.stop()
+    assert (NS._int.wclient.host, NS._int.wclient.port) == ("etcd-3", 2379)
+    assert manager.stats()["leader_changes"] == 2
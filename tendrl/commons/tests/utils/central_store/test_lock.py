@@ -0,0 +1,130 @@
+import __builtin__
+import etcd
+import gevent
+import maps
+import pytest
+
+from tendrl.commons.utils.central_store import lock
+
+
+class Store(object):
+    """In-memory stand-in of the etcd client for the keys of a lock"""
+
+    def __init__(self, **keys):
+        self.keys = dict(keys)
+        self.ttls = {}
+
+    def read(self, key, recursive=False, quorum=False):
+        # Lock owners are read from the leader
+        assert quorum
+        if key not in self.keys:
+            raise etcd.EtcdKeyNotFound
+        return maps.NamedDict(value=self.keys[key])
+
+    def write(self, key, value, ttl=None, prevExist=None, prevValue=None):
+        if prevExist is False and key in self.keys:
+            raise etcd.EtcdAlreadyExist
+        if prevValue is not None:
+            if key not in self.keys:
+                raise etcd.EtcdKeyNotFound
+            if self.keys[key] != prevValue:
+                raise etcd.EtcdCompareFailed
+        self.keys[key] = value
+        self.ttls[key] = self.ttls.get(key, 0) + 1
+
+    def delete(self, key, recursive=False, prevValue=None):
+        if key not in self.keys:
+            raise etcd.EtcdKeyNotFound
+        if self.keys[key] != prevValue:
+            raise etcd.EtcdCompareFailed
+        del self.keys[key]
+
+
+def init(store):
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict(client=store, wclient=store)
+
+
+def test_acquire_release():
+    store = Store()
+    init(store)
+    node_lock = lock.Lock(["/nodes/1/locked_by", "/nodes/2/locked_by"],
+                          "job_1", ttl=0.03)
+    node_lock.acquire()
+    assert store.keys == {"/nodes/1/locked_by": "job_1",
+                          "/nodes/2/locked_by": "job_1"}
+    # The heartbeat keeps renewing the leases
+    gevent.sleep(0.05)
+    assert store.ttls["/nodes/1/locked_by"] > 1
+    assert sorted(node_lock.release()) == ["/nodes/1/locked_by",
+                                           "/nodes/2/locked_by"]
+    assert store.keys == {}
+    assert node_lock.release() == []
+
+
+def test_acquire_held():
+    store = Store(**{"/nodes/2/locked_by": "job_0"})
+    init(store)
+    node_lock = lock.Lock(["/nodes/1/locked_by", "/nodes/2/locked_by"],
+                          "job_1")
+    with pytest.raises(lock.LockHeldError) as ex:
+        node_lock.acquire()
+    assert ex.value.key == "/nodes/2/locked_by"
+    assert ex.value.owner == "job_0"
+    # Keys obtained before the conflict are rolled back
+    assert store.keys == {"/nodes/2/locked_by": "job_0"}
+
+    # Locks of the parent job are entered, not taken over
+    node_lock = lock.Lock(["/nodes/1/locked_by", "/nodes/2/locked_by"],
+                          "job_1", shared_with=["job_0"])
+    node_lock.acquire()
+    assert node_lock.owned == ["/nodes/1/locked_by"]
+    node_lock.release()
+    assert store.keys == {"/nodes/2/locked_by": "job_0"}
+
+
+def test_acquire_retried():
+    store = Store()
+    init(store)
+    _write = store.write
+
+    def write(key, value, **kwargs):
+        # The first attempt went through, its response got lost
+        _write(key, value, **kwargs)
+        raise etcd.EtcdAlreadyExist
+    store.write = write
+    node_lock = lock.Lock(["/nodes/1/locked_by"], "job_1")
+    node_lock._refresh = lambda: None
+    node_lock.acquire()
+    assert node_lock.owned == ["/nodes/1/locked_by"]
+
+
+def test_acquire_expired():
+    store = Store(**{"/nodes/1/locked_by": "job_0"})
+    init(store)
+    _read = store.read
+
+    def read(key, **kwargs):
+        # The lease expired between the create and the read
+        del store.keys[key]
+        store.read = _read
+        raise etcd.EtcdKeyNotFound
+    store.read = read
+    node_lock = lock.Lock(["/nodes/1/locked_by"], "job_1")
+    node_lock._refresh = lambda: None
+    node_lock.acquire()
+    assert node_lock.owned == ["/nodes/1/locked_by"]
+    assert store.keys == {"/nodes/1/locked_by": "job_1"}
+
+
+def test_lost_lock():
+    store = Store()
+    init(store)
+    node_lock = lock.Lock(["/nodes/1/locked_by"], "job_1", ttl=0.03)
+    node_lock.acquire()
+    # Lease expired and the node got locked by another job
+    store.keys["/nodes/1/locked_by"] = "job_2"
+    gevent.sleep(0.05)
+    assert node_lock.owned == []
+    assert node_lock.release() == []
+    assert store.keys == {"/nodes/1/locked_by": "job_2"}
@@ -1,25 +1,33 @@
+import datetime
 import maps
 import etcd
+import gevent
 import pytest
 import __builtin__
+from tendrl.commons.utils.central_store.utils import render_field
 from tendrl.commons.utils.central_store.utils import to_tendrl_field
 from tendrl.commons.utils.central_store.utils import wreconnect
 from tendrl.commons.utils.central_store.utils import reconnect
 from mock import patch
-import time
-
-def client(**args):
-    raise etcd.EtcdException
-
-def sleep(*args):
-    NS._int.wclient = "Temp_obj"
-    NS._int.client = "Temp_obj"
 
 def test_to_tendrl_field():
      ret = to_tendrl_field("test_name",{"message":"test"})
      assert ret is not None
      ret = to_tendrl_field("test_name",{"message":"test"},'json')
 
+
+def test_render_field():
+    # Same items as the rendered Field, without building it
+    for value, _type in [("test", None), (1, None), ([1, 1], None),
+                         ({"a": "1", "b": "2"}, None),
+                         ({"a": "1"}, "json"),
+                         (datetime.datetime.now(), None)]:
+        items = to_tendrl_field("test_name", value, _type).render()
+        if type(items) != list:
+            items = [items]
+        assert render_field("test_name", value, _type) == \
+            [(i['key'], i['value'], i['dir']) for i in items]
+
 @patch.object(etcd, "Client")
 def test_wreconnect(patch_client):
     setattr(__builtin__, "NS", maps.NamedDict())
@@ -30,9 +38,13 @@ def test_wreconnect(patch_client):
         'host': 2,
         'allow_reconnect': True}
     wreconnect()
-    with patch.object(etcd,'Client',client) as mock_client:
-        with patch.object(time,'sleep',sleep) as mock_sleep:
-            wreconnect()
+    assert NS._int.wclient is not None
+    patch_client.side_effect = [etcd.EtcdException, "Temp_obj"]
+    with patch.object(gevent, 'sleep') as mock_sleep:
+        wreconnect()
+    assert NS._int.wclient == "Temp_obj"
+    assert mock_sleep.call_count == 1
+    assert NS._int.connection.stats()["connect_failures"] == 1
 
 
 @patch.object(etcd, "Client")
@@ -45,6 +57,9 @@ def test_reconnect(patch_client):
         'host': 2,
         'allow_reconnect': True}
     reconnect()
-    with patch.object(etcd,'Client',client) as mock_client:
-        with patch.object(time,'sleep',sleep) as mock_sleep:
-            reconnect()
+    assert NS._int.client is not None
+    patch_client.side_effect = [etcd.EtcdException, "Temp_obj"]
+    with patch.object(gevent, 'sleep') as mock_sleep:
+        reconnect()
+    assert NS._int.client == "Temp_obj"
+    assert NS._int.connection.stats()["reconnects"] == 2
@@ -0,0 +1,128 @@
+import __builtin__
+import etcd
+import gevent
+import maps
+from mock import MagicMock
+from mock import patch
+import pytest
+
+from tendrl.commons.utils.central_store import write_behind
+from tendrl.commons.utils import etcd_utils
+
+
+def init():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    NS._int = maps.NamedDict(cache=MagicMock(), wreconnect=MagicMock())
+
+
+def test_put_coalesces():
+    init()
+    queue = write_behind.WriteBehindQueue()
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/model", "a"),
+                               ("/nodes/1/Cpu/hash", "1")])
+    queue.put("/nodes/1/Os", [("/nodes/1/Os/os", "centos")], ttl=10)
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/hash", "2")])
+    assert queue.stats() == dict(queued=3, coalesced=1, flushed=0,
+                                 failures=0, size=2)
+    with patch.object(etcd_utils, "write_many") as mock_write, \
+            patch.object(etcd_utils, "refresh") as mock_refresh:
+        assert queue.flush() == 2
+    # Last write wins, one batch for all the pending objects
+    assert sorted(mock_write.call_args[0][0]) == [
+        ("/nodes/1/Cpu/hash", "2"), ("/nodes/1/Cpu/model", "a"),
+        ("/nodes/1/Os/os", "centos")]
+    mock_refresh.assert_called_once_with("/nodes/1/Os", 10)
+    NS._int.cache.invalidate.assert_any_call("/nodes/1/Cpu")
+    assert queue.stats()["size"] == 0
+
+
+def test_flush_object():
+    init()
+    queue = write_behind.WriteBehindQueue()
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/model", "a")])
+    queue.put("/nodes/1/Os", [("/nodes/1/Os/os", "centos")])
+    with patch.object(etcd_utils, "write_many") as mock_write:
+        assert queue.flush("/nodes/1/Cpu") == 1
+        assert queue.flush("/nodes/1/Cpu") == 0
+    mock_write.assert_called_once_with([("/nodes/1/Cpu/model", "a")])
+    assert queue.pending("/nodes/1/Os")
+
+
+def test_bounded():
+    init()
+    queue = write_behind.WriteBehindQueue(max_size=2)
+    with patch.object(etcd_utils, "write_many") as mock_write:
+        queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/model", "a")])
+        assert not mock_write.called
+        # The caller flushes a full queue
+        queue.put("/nodes/1/Os", [("/nodes/1/Os/os", "centos")])
+        assert mock_write.call_count == 1
+    assert queue.stats()["size"] == 0
+
+
+def test_failed_flush_requeues():
+    init()
+    queue = write_behind.WriteBehindQueue()
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/model", "a"),
+                               ("/nodes/1/Cpu/hash", "1")])
+    with patch.object(etcd_utils, "write_many",
+                      side_effect=etcd.EtcdConnectionFailed):
+        with pytest.raises(etcd.EtcdConnectionFailed):
+            queue.flush()
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/hash", "2")])
+    with patch.object(etcd_utils, "write_many") as mock_write:
+        queue.flush()
+    assert sorted(mock_write.call_args[0][0]) == [
+        ("/nodes/1/Cpu/hash", "2"), ("/nodes/1/Cpu/model", "a")]
+
+
+def test_hash_cas():
+    init()
+    queue = write_behind.WriteBehindQueue()
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/model", "a")],
+              hash_cas=("/nodes/1/Cpu/hash", "2", "1"))
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/cores", "4")],
+              hash_cas=("/nodes/1/Cpu/hash", "3", "2"))
+    queue.put("/nodes/1/Os", [("/nodes/1/Os/os", "centos"),
+                              ("/nodes/1/Os/hash", "1")])
+    queue.put("/nodes/1/Os", [("/nodes/1/Os/os", "rhel")],
+              hash_cas=("/nodes/1/Os/hash", "2", "1"))
+    with patch.object(etcd_utils, "write_many") as mock_write, \
+            patch.object(etcd_utils, "write_hash") as mock_hash:
+        queue.flush()
+    # Compared with the hash stored before the first of the saves
+    mock_hash.assert_called_once_with("/nodes/1/Cpu/hash", "3", "1")
+    # A partial save over a queued full one is a full write
+    assert ("/nodes/1/Os/hash", "2") in mock_write.call_args[0][0]
+
+
+def test_start_stop():
+    init()
+    queue = write_behind.WriteBehindQueue(flush_interval=0.01)
+    queue.start()
+    assert queue.enabled
+    with patch.object(etcd_utils, "write_many") as mock_write:
+        queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/model", "a")])
+        gevent.sleep(0.05)
+        assert mock_write.call_count == 1
+        # Pending saves are written out on stop
+        queue.put("/nodes/1/Os", [("/nodes/1/Os/os", "centos")])
+        queue.stop()
+        assert mock_write.call_count == 2
+    assert not queue.enabled
+
+
+def test_failed_flush_retried():
+    init()
+    queue = write_behind.WriteBehindQueue(flush_interval=0.01)
+    queue.put("/nodes/1/Cpu", [("/nodes/1/Cpu/model", "a")])
+    with patch.object(etcd_utils, "write_many",
+                      side_effect=etcd.EtcdConnectionFailed):
+        queue.start()
+        gevent.sleep(0.05)
+        queue._complete.set()
+        gevent.sleep(0.02)
+    assert queue.failures >= 1
+    assert queue.pending("/nodes/1/Cpu")
+    # etcd_utils already retried on a reconnected client
+    assert not NS._int.wreconnect.called
@@ -6,6 +6,8 @@ import importlib
 from mock import patch
 from tendrl.commons.tests.fixtures.client import Client
 import etcd
+import gevent
+import mock
 
 
 '''Dummy Functions'''
@@ -44,6 +46,14 @@ def test_read():
             obj = etcd_utils.read("key")
 
 
+def test_read_options():
+    assert etcd_utils.read_options(etcd_utils.QUORUM) == {"quorum": True}
+    assert etcd_utils.read_options(etcd_utils.SERIALIZABLE) == \
+        {"quorum": False}
+    with pytest.raises(ValueError):
+        etcd_utils.read_options("linearizable")
+
+
 def test_write():
     setattr(__builtin__, "NS", maps.NamedDict())
     setattr(NS, "_int", maps.NamedDict())
@@ -83,3 +93,92 @@ def test_refresh():
             with pytest.raises(etcd.EtcdKeyNotFound):
                 etcd_utils.refresh("test_value", 1)
 
+
+
+def test_write_many():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    setattr(NS, "_int", maps.NamedDict())
+    NS._int.wclient = importlib.import_module("tendrl.commons"
+                                              ".tests.fixtures."
+                                              "client").Client()
+    NS._int.wreconnect = type("Dummy", (object,), {})
+    with patch.object(Client, "write") as mock_write:
+        etcd_utils.write_many([])
+        assert not mock_write.called
+        etcd_utils.write_many([("key", "test_value")])
+        assert mock_write.call_count == 1
+        items = [("key%s" % i, "test_value") for i in range(50)]
+        etcd_utils.write_many(items, False)
+        assert mock_write.call_count == 51
+    with patch.object(Client, "write",
+                      raise_etcdconnectionfailed) as mock_write:
+        with pytest.raises(etcd.EtcdConnectionFailed):
+            etcd_utils.write_many([("key1", "v1"), ("key2", "v2")])
+    # The hash goes last, and not at all if an attr failed
+    written = []
+
+    def write(key, value, *args, **kwargs):
+        if key == "/obj/fail":
+            raise etcd.EtcdKeyNotFound
+        written.append(key)
+    with patch.object(gevent, "sleep"):
+        with patch.object(Client, "write", side_effect=write):
+            etcd_utils.write_many([("/obj/hash", "h"), ("/obj/a", "1"),
+                                   ("/obj/b", "2")])
+            assert written[-1] == "/obj/hash"
+            del written[:]
+            with pytest.raises(etcd.EtcdKeyNotFound):
+                etcd_utils.write_many([("/obj/hash", "h"),
+                                       ("/obj/fail", "1")])
+            assert "/obj/hash" not in written
+
+
+def test_write_hash():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    setattr(NS, "_int", maps.NamedDict())
+    NS._int.wclient = importlib.import_module("tendrl.commons"
+                                              ".tests.fixtures."
+                                              "client").Client()
+    with patch.object(Client, "write") as mock_write:
+        assert etcd_utils.write_hash("/obj/hash", "h2", "h1")
+        mock_write.assert_called_once_with("/obj/hash", "h2", ttl=None,
+                                           prevValue="h1")
+        # No hash to compare with
+        assert not etcd_utils.write_hash("/obj/hash", "h2", None)
+        mock_write.assert_called_with("/obj/hash", "", ttl=None)
+    # The object was changed by another writer since
+    with patch.object(Client, "write",
+                      side_effect=[etcd.EtcdCompareFailed, None]) as \
+            mock_write:
+        assert not etcd_utils.write_hash("/obj/hash", "h2", "h1")
+        mock_write.assert_called_with("/obj/hash", "", ttl=None)
+
+
+def test_call():
+    setattr(__builtin__, "NS", maps.NamedDict())
+    setattr(NS, "_int", maps.NamedDict())
+    NS._int.client = importlib.import_module("tendrl.commons"
+                                             ".tests.fixtures."
+                                             "client").Client()
+    NS._int.reconnect = mock.MagicMock()
+    with patch.object(gevent, "sleep"):
+        with patch.object(Client, "read",
+                          side_effect=[etcd.EtcdConnectionFailed,
+                                       "test"]) as mock_read:
+            assert etcd_utils.call("client", "read", "key") == "test"
+            assert mock_read.call_count == 2
+        assert NS._int.reconnect.call_count == 1
+        # Attempts are bounded
+        NS._int.reconnect.reset_mock()
+        with patch.object(Client, "read",
+                          raise_etcdconnectionfailed):
+            with pytest.raises(etcd.EtcdConnectionFailed):
+                etcd_utils.call("client", "read", "key")
+        assert NS._int.reconnect.call_count == \
+            etcd_utils.RETRY_ATTEMPTS - 1
+        # Errors answered by the central store are not retried
+        NS._int.reconnect.reset_mock()
+        with patch.object(Client, "read", raise_etcdkeynotfound):
+            with pytest.raises(etcd.EtcdKeyNotFound):
+                etcd_utils.call("client", "read", "key")
+        assert not NS._int.reconnect.called
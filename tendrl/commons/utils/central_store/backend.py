@@ -0,0 +1,483 @@
+"""
+Central store backends.
+"""
+
+import abc
+import base64
+import collections
+import json
+import socket
+
+import etcd
+import gevent
+import gevent.pool
+import urllib3
+
+from tendrl.commons.utils.central_store import connection
+
+# Read consistency levels: quorum reads are linearizable and served
+# through the etcd leader, serializable reads are served by the member the
+# client is connected to and may miss the latest writes
+QUORUM = "quorum"
+SERIALIZABLE = "serializable"
+CONSISTENCY_LEVELS = [QUORUM, SERIALIZABLE]
+
+
+def check_consistency(consistency):
+    if consistency not in CONSISTENCY_LEVELS:
+        raise ValueError("Unknown read consistency %s" % consistency)
+    return consistency
+
+
+class Backend(object):
+    """Key-value operations of the central store layer (etcd_utils).
+
+    Keys are "/" separated paths, a key with keys below it reads as a
+    directory. Failures are raised as the python-etcd errors callers
+    already handle: etcd.EtcdKeyNotFound, etcd.EtcdAlreadyExist,
+    etcd.EtcdCompareFailed, etcd.EtcdWatchTimedOut,
+    etcd.EtcdEventIndexCleared and etcd.EtcdConnectionFailed.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def read(self, key, recursive=False, consistency=QUORUM):
+        """Reads a key, or a directory (and the keys below it if recursive)
+
+        :returns: The key with its value, modifiedIndex and etcd_index, or
+                  the directory whose leaves are the keys read
+        :rtype: etcd.EtcdResult or Result
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def write(self, key, value, ttl=None, prev_value=None, prev_exist=None):
+        """Writes a key, if it holds prev_value or, if prev_exist is
+
+        False, if it does not exist
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def write_many(self, items):
+        """Writes the (key, value) items, the object hashes (keys ending
+
+        with /hash) last
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete(self, key, recursive=False, prev_value=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def refresh(self, key, ttl):
+        """Expires the key, or the directory, in ttl seconds from now
+
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def index(self):
+        """Current etcd index (revision) of the central store
+
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def watch(self, prefix, index, timeout=None):
+        """Waits for the next change of a key at or below prefix, made
+
+        after index
+
+        :returns: The changed key, its action ("set", "delete"...) and
+                  modifiedIndex
+        """
+        raise NotImplementedError()
+
+
+def _split_hashes(items):
+    # Object hashes are written once the attrs they describe are
+    _hashes = [item for item in items if item[0].endswith("/hash")]
+    _attrs = [item for item in items if not item[0].endswith("/hash")]
+    return _attrs, _hashes
+
+
+class Etcd2Backend(Backend):
+    """etcd v2 API, through the python-etcd clients of the process
+
+    (NS._int.client and NS._int.wclient, see connection.call())
+    """
+
+    # etcd v2 has no multi-key transaction, the writes of a batch are
+    # issued concurrently so the batch costs about one round-trip
+    WRITE_BATCH_CONCURRENCY = 32
+
+    def read(self, key, recursive=False, consistency=QUORUM):
+        return connection.call(
+            "client", "read", key, recursive=recursive,
+            quorum=check_consistency(consistency) == QUORUM)
+
+    def write(self, key, value, ttl=None, prev_value=None, prev_exist=None):
+        _kwargs = {}
+        if prev_value is not None:
+            _kwargs["prevValue"] = prev_value
+        if prev_exist is not None:
+            _kwargs["prevExist"] = prev_exist
+        connection.call("wclient", "write", key, value, ttl=ttl, **_kwargs)
+
+    def write_many(self, items):
+        for _items in _split_hashes(items):
+            if len(_items) == 1:
+                self.write(*_items[0])
+            elif _items:
+                pool = gevent.pool.Pool(self.WRITE_BATCH_CONCURRENCY)
+                greenlets = [pool.spawn(self.write, key, value)
+                             for key, value in _items]
+                gevent.joinall(greenlets, raise_error=True)
+
+    def delete(self, key, recursive=False, prev_value=None):
+        _kwargs = {}
+        if prev_value is not None:
+            _kwargs["prevValue"] = prev_value
+        connection.call("wclient", "delete", key, recursive=recursive,
+                        **_kwargs)
+
+    def refresh(self, key, ttl):
+        connection.call("wclient", "refresh", key, ttl=ttl)
+
+    def index(self):
+        return connection.call("client", "read", "/").etcd_index
+
+    def watch(self, prefix, index, timeout=None):
+        _kwargs = {}
+        if timeout is not None:
+            _kwargs["timeout"] = timeout
+        return connection.call("client", "read", prefix, recursive=True,
+                               wait=True, waitIndex=index + 1, **_kwargs)
+
+
+class Result(object):
+    """A key, or a directory with the keys below it, read from a backend.
+
+    Has the attributes of etcd.EtcdResult the central store layer uses.
+    """
+
+    def __init__(self, key, value=None, dir=False, children=None,
+                 etcd_index=None, modifiedIndex=None, action="get"):
+        self.key = key
+        self.value = value
+        self.dir = dir
+        self.etcd_index = etcd_index
+        self.modifiedIndex = modifiedIndex
+        self.action = action
+        self._children = children or []
+
+    @property
+    def leaves(self):
+        """The keys below a directory, the key itself otherwise
+
+        """
+        if not self._children:
+            yield self
+            return
+        for child in self._children:
+            for leaf in child.leaves:
+                yield leaf
+
+
+def _b64(value):
+    return base64.b64encode(str(value))
+
+
+def _unb64(value):
+    return base64.b64decode(value) if value else ""
+
+
+def _prefix_end(prefix):
+    # First key after all the keys starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _dir_prefix(key):
+    return key.rstrip("/") + "/"
+
+
+class Etcd3Backend(Backend):
+    """etcd v3 API, through its JSON gRPC gateway (/v3/kv, /v3/lease,
+
+    /v3/watch) over a pool of HTTP connections per member.
+
+    v3 has no directories and no TTL per key:
+    - A directory is the range of the keys below it, listed with
+      keys_only when only its children are needed.
+    - Keys expire with a lease. A refreshed directory gets one lease for
+      all its keys, which the later writes below it join and the later
+      refreshes keep alive in a single request.
+    - Conditional writes and batches are transactions (Txn).
+    """
+
+    # Default max operations of an etcd transaction (--max-txn-ops)
+    MAX_TXN_OPS = 128
+
+    def __init__(self, hosts, protocol="http", pool_size=10,
+                 api_prefix="/v3"):
+        """Initializes a new Etcd3Backend instance.
+
+        :param hosts: (host, port) of the members of the cluster
+        :type hosts: tuple((str, int))
+        :param pool_size: Max HTTP connections kept open per member
+        :type pool_size: int
+        :param api_prefix: Path of the gateway API ("/v3beta" before
+                           etcd 3.4)
+        :type api_prefix: str
+        """
+        self._endpoints = collections.deque(
+            "%s://%s:%s%s" % (protocol, host, port, api_prefix)
+            for host, port in hosts)
+        self._http = urllib3.PoolManager(maxsize=pool_size)
+        # {directory key: (lease id, ttl)} of the refreshed directories
+        self._leases = {}
+
+    def read(self, key, recursive=False, consistency=QUORUM):
+        _serializable = check_consistency(consistency) == SERIALIZABLE
+        _resp = self._post("/kv/range", {"key": _b64(key),
+                                         "serializable": _serializable})
+        _index = int(_resp["header"]["revision"])
+        if _resp.get("kvs"):
+            return self._result(_resp["kvs"][0], _index)
+
+        _prefix = _dir_prefix(key)
+        _range = {"key": _b64(_prefix),
+                  "range_end": _b64(_prefix_end(_prefix)),
+                  "serializable": _serializable}
+        if not recursive:
+            _range["keys_only"] = True
+        _kvs = self._post("/kv/range", _range).get("kvs", [])
+        if not _kvs:
+            raise etcd.EtcdKeyNotFound("Key not found : %s" % key)
+        if not recursive:
+            _kvs = self._children(_prefix, _kvs, _serializable)
+
+        _root = Result(key, dir=True, etcd_index=_index)
+        _dirs = {key.rstrip("/"): _root}
+        for kv in _kvs:
+            _leaf = self._result(kv, _index)
+            _parent = self._parent_dir(_leaf.key, _dirs, _index)
+            _parent._children.append(_leaf)
+        return _root
+
+    def write(self, key, value, ttl=None, prev_value=None, prev_exist=None):
+        _put = self._put(key, value, ttl)
+        if prev_value is None and prev_exist is None:
+            self._post("/kv/put", _put)
+            return
+        if prev_exist is False:
+            _compare = {"key": _b64(key), "target": "CREATE",
+                        "result": "EQUAL", "create_revision": 0}
+        else:
+            _compare = {"key": _b64(key), "target": "VALUE",
+                        "result": "EQUAL", "value": _b64(prev_value)}
+        self._txn_or_raise(key, _compare, {"request_put": _put},
+                           prev_exist is False)
+
+    def write_many(self, items):
+        if len(items) <= self.MAX_TXN_OPS:
+            # A single transaction, the batch is atomic
+            self._txn([{"request_put": self._put(key, value)}
+                       for key, value in items])
+            return
+        for _items in _split_hashes(items):
+            for idx in range(0, len(_items), self.MAX_TXN_OPS):
+                self._txn([{"request_put": self._put(key, value)}
+                           for key, value in
+                           _items[idx:idx + self.MAX_TXN_OPS]])
+
+    def delete(self, key, recursive=False, prev_value=None):
+        if prev_value is not None:
+            _compare = {"key": _b64(key), "target": "VALUE",
+                        "result": "EQUAL", "value": _b64(prev_value)}
+            self._txn_or_raise(key, _compare,
+                               {"request_delete_range": {"key": _b64(key)}})
+            return
+        _deletes = [{"request_delete_range": {"key": _b64(key)}}]
+        if recursive:
+            _prefix = _dir_prefix(key)
+            _deletes.append({"request_delete_range": {
+                "key": _b64(_prefix),
+                "range_end": _b64(_prefix_end(_prefix))}})
+            self._leases.pop(key.rstrip("/"), None)
+        _deleted = sum(
+            int(_resp.get("response_delete_range", {}).get("deleted", 0))
+            for _resp in self._txn(_deletes).get("responses", []))
+        if not _deleted:
+            raise etcd.EtcdKeyNotFound("Key not found : %s" % key)
+
+    def refresh(self, key, ttl):
+        key = key.rstrip("/")
+        _lease = self._leases.get(key)
+        if _lease is not None and _lease[1] == ttl:
+            _resp = self._post("/lease/keepalive", {"ID": _lease[0]})
+            if int(_resp.get("result", {}).get("TTL", 0)) > 0:
+                return
+            # Expired meanwhile, its keys are gone
+
+        _prefix = _dir_prefix(key)
+        _kvs = []
+        for _range in [{"key": _b64(key)},
+                       {"key": _b64(_prefix),
+                        "range_end": _b64(_prefix_end(_prefix))}]:
+            _kvs += self._post("/kv/range", _range).get("kvs", [])
+        if not _kvs:
+            raise etcd.EtcdKeyNotFound("Key not found : %s" % key)
+        self._leases[key] = (self._grant(ttl), ttl)
+        # Keys join the lease of the directory
+        for idx in range(0, len(_kvs), self.MAX_TXN_OPS):
+            self._txn([{"request_put": self._put(_unb64(kv["key"]),
+                                                 _unb64(kv.get("value")))}
+                       for kv in _kvs[idx:idx + self.MAX_TXN_OPS]])
+
+    def index(self):
+        _resp = self._post("/kv/range", {"key": _b64("\0"), "limit": 1,
+                                         "keys_only": True})
+        return int(_resp["header"]["revision"])
+
+    def watch(self, prefix, index, timeout=None):
+        _prefix_range = _dir_prefix(prefix)
+        _request = {"create_request": {
+            "key": _b64(prefix.rstrip("/") or "/"),
+            "range_end": _b64(_prefix_end(_prefix_range)),
+            "start_revision": index + 1}}
+        _stream = self._post("/watch", _request, timeout=timeout,
+                             stream=True)
+        try:
+            for _line in _stream:
+                _result = json.loads(_line).get("result", {})
+                if int(_result.get("compact_revision", 0)):
+                    raise etcd.EtcdEventIndexCleared(
+                        "Revision %s compacted" % (index + 1))
+                for _event in _result.get("events", []):
+                    _change = self._result(
+                        _event["kv"], int(_result["header"]["revision"]))
+                    if _event.get("type") == "DELETE":
+                        _change.action = "delete"
+                    else:
+                        _change.action = "set"
+                    return _change
+        except urllib3.exceptions.ReadTimeoutError:
+            raise etcd.EtcdWatchTimedOut("Watch timed out", None)
+        finally:
+            _stream.release_conn()
+        raise etcd.EtcdWatchTimedOut("Watch closed", None)
+
+    def _put(self, key, value, ttl=None):
+        _put = {"key": _b64(key), "value": _b64(value)}
+        if ttl:
+            _put["lease"] = self._grant(ttl)
+        else:
+            _lease = self._dir_lease(key)
+            if _lease is not None:
+                _put["lease"] = _lease
+        return _put
+
+    def _dir_lease(self, key):
+        # Lease of the closest refreshed directory above key
+        _key = key.rstrip("/")
+        while _key:
+            if _key in self._leases:
+                return self._leases[_key][0]
+            _key = _key.rpartition("/")[0]
+        return None
+
+    def _grant(self, ttl):
+        return self._post("/lease/grant", {"TTL": int(ttl)})["ID"]
+
+    def _txn(self, operations, compare=None, failure=None):
+        return self._post("/kv/txn", {"compare": compare or [],
+                                      "success": operations,
+                                      "failure": failure or []})
+
+    def _txn_or_raise(self, key, compare, operation, create=False):
+        _resp = self._txn([operation], compare=[compare],
+                          failure=[{"request_range": {"key": _b64(key)}}])
+        if _resp.get("succeeded"):
+            return
+        if create:
+            raise etcd.EtcdAlreadyExist("Key already exists : %s" % key)
+        _kvs = _resp["responses"][0].get("response_range", {}).get("kvs")
+        if not _kvs:
+            raise etcd.EtcdKeyNotFound("Key not found : %s" % key)
+        raise etcd.EtcdCompareFailed("Compare failed : %s" % key)
+
+    def _children(self, prefix, kvs, serializable):
+        """The keys right below the directory (their values read in
+
+        batches), and the directories right below it
+        """
+        _keys = []
+        _dirs = collections.OrderedDict()
+        for kv in kvs:
+            _name = _unb64(kv["key"])[len(prefix):]
+            if "/" in _name:
+                _dirs[_name.split("/")[0]] = None
+            else:
+                _keys.append(kv["key"])
+        _children = []
+        for idx in range(0, len(_keys), self.MAX_TXN_OPS):
+            _resp = self._txn([{"request_range": {
+                "key": key, "serializable": serializable}}
+                for key in _keys[idx:idx + self.MAX_TXN_OPS]])
+            for _range in _resp.get("responses", []):
+                _children += _range.get("response_range", {}).get("kvs", [])
+        for _name in _dirs:
+            _children.append({"key": _b64(prefix + _name), "dir": True})
+        return _children
+
+    def _parent_dir(self, key, dirs, index):
+        _parent_key = key.rpartition("/")[0]
+        if _parent_key not in dirs:
+            _grand_parent = self._parent_dir(_parent_key, dirs, index)
+            dirs[_parent_key] = Result(_parent_key, dir=True,
+                                       etcd_index=index)
+            _grand_parent._children.append(dirs[_parent_key])
+        return dirs[_parent_key]
+
+    def _result(self, kv, index):
+        return Result(_unb64(kv["key"]),
+                      value=None if kv.get("dir") else _unb64(
+                          kv.get("value")),
+                      dir=kv.get("dir", False),
+                      etcd_index=index,
+                      modifiedIndex=int(kv.get("mod_revision", 0)))
+
+    def _post(self, path, body, timeout=None, stream=False):
+        """POSTs to the first member answering, members failing are
+
+        tried last from then on
+        """
+        for _ in range(len(self._endpoints)):
+            _endpoint = self._endpoints[0]
+            try:
+                _resp = self._http.request(
+                    "POST", _endpoint + path, body=json.dumps(body),
+                    headers={"Content-Type": "application/json"},
+                    timeout=urllib3.Timeout(connect=5, read=timeout),
+                    preload_content=not stream)
+            except urllib3.exceptions.ReadTimeoutError:
+                if stream:
+                    raise etcd.EtcdWatchTimedOut("Watch timed out", None)
+                self._endpoints.rotate(-1)
+                continue
+            except (urllib3.exceptions.HTTPError, socket.error):
+                self._endpoints.rotate(-1)
+                continue
+            if stream and _resp.status == 200:
+                return _resp
+            _data = json.loads(_resp.data or "{}")
+            if _resp.status != 200:
+                raise etcd.EtcdException(
+                    _data.get("error") or _data.get("message"), _data)
+            return _data
+        raise etcd.EtcdConnectionFailed(
+            "No member of the central store answered (%s)" %
+            ", ".join(self._endpoints))
@@ -0,0 +1,223 @@
+"""
+In-process read-through cache of central store objects.
+"""
+
+import collections
+import sys
+import time
+
+import etcd
+import gevent
+import gevent.event
+
+from tendrl.commons.utils import etcd_utils
+
+
+class ObjectCache(object):
+    """LRU cache of central store objects keyed by object path.
+
+    Each entry holds the leaves of the recursive read of an object
+    directory. Entries expire after the TTL of their object type and are
+    kept coherent by a watcher greenlet per cached prefix, which follows
+    the etcd index and drops the entries of every changed key.
+
+    A read may return before the watcher sees a change made right after
+    it, so entries are put along with the etcd index of their read: the
+    put is refused when the watcher has since seen a change of the object,
+    or resynced past that index.
+
+    Only the objects below the watched prefixes are cached, by default the
+    keys of the node of the agent and of its cluster (see
+    agent_prefixes()), not the whole /nodes and /clusters trees.
+    """
+
+    def __init__(self, max_size=1024, watch_timeout=60, prefixes=None):
+        """Initializes a new ObjectCache instance.
+
+        :param max_size: Max number of cached objects
+        :type max_size: int
+        :param watch_timeout: Seconds after which an idle watch is renewed
+        :type watch_timeout: int
+        :param prefixes: Keys below which objects are cached, None for
+                         agent_prefixes() once started
+        :type prefixes: list(str)
+        """
+        self.max_size = max_size
+        self.watch_timeout = watch_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refused = 0
+        self._entries = collections.OrderedDict()
+        self._agent_prefixes = prefixes is None
+        self._set_prefixes(prefixes or [])
+        # {key: etcd index} of the last changes seen by the watchers
+        self._changes = collections.OrderedDict()
+        self._watchers = {}
+        self._complete = gevent.event.Event()
+
+    @property
+    def enabled(self):
+        """Entries are served only while the watchers keep them coherent
+
+        """
+        return bool(self._watchers) and \
+            not any(_watcher.dead for _watcher in self._watchers.values())
+
+    def get(self, key):
+        """Returns the cached leaves of the object at key.
+
+        :returns: None on a cache miss
+        :rtype: list(etcd.EtcdResult)
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.time():
+            self.misses += 1
+            return None
+        # Most recently used entries live at the end
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, leaves, ttl, etcd_index):
+        """Caches the leaves of the object at key for ttl seconds.
+
+        :param key: Central store key of the object directory
+        :type key: str
+        :param leaves: Leaf nodes of the recursive read of the object
+        :type leaves: list(etcd.EtcdResult)
+        :param ttl: Seconds the entry stays valid
+        :type ttl: int
+        :param etcd_index: etcd index of the read of the leaves
+        :type etcd_index: int
+        :returns: False if the leaves may be stale already
+        :rtype: bool
+        """
+        _prefix = self._prefix(key)
+        if _prefix is None or etcd_index < self._synced_index[_prefix] or \
+                any(_index > etcd_index and _overlaps(key, _key)
+                    for _key, _index in self._changes.iteritems()):
+            self.refused += 1
+            return False
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + ttl, leaves)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def invalidate(self, key, etcd_index=None):
+        """Drops the entries of the objects affected by a change at key.
+
+        :param key: The changed key (a leaf, an object or a directory)
+        :type key: str
+        :param etcd_index: etcd index of the change, if seen by a watcher
+        :type etcd_index: int
+        """
+        key = key.rstrip("/")
+        for _key in self._entries.keys():
+            if _overlaps(key, _key):
+                del self._entries[_key]
+        if etcd_index is None:
+            return
+        self._changes.pop(key, None)
+        self._changes[key] = etcd_index
+        while len(self._changes) > self.max_size:
+            # A forgotten change still refuses the older reads
+            _key, _index = self._changes.popitem(last=False)
+            _prefix = self._prefix(_key)
+            if _prefix is not None:
+                self._synced_index[_prefix] = max(
+                    self._synced_index[_prefix], _index)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    refused=self.refused,
+                    size=len(self._entries))
+
+    def start(self):
+        if self.enabled:
+            return
+        self._complete.clear()
+        if self._agent_prefixes:
+            # The node (and cluster) of the agent are known by now
+            self._set_prefixes(agent_prefixes())
+        self._watchers = dict((prefix, gevent.spawn(self._watch, prefix))
+                              for prefix in self.prefixes)
+
+    def stop(self):
+        self._complete.set()
+        for _watcher in self._watchers.values():
+            _watcher.kill(block=False)
+        self._watchers = {}
+        self.clear()
+
+    def _set_prefixes(self, prefixes):
+        self.prefixes = list(prefixes)
+        # Index of the last change seen by the watcher of each prefix
+        self._etcd_index = dict.fromkeys(self.prefixes)
+        # Puts of reads older than this index are refused, by prefix
+        self._synced_index = dict.fromkeys(self.prefixes, 0)
+
+    def _prefix(self, key):
+        for prefix in self.prefixes:
+            if key == prefix or key.startswith(prefix + "/"):
+                return prefix
+        return None
+
+    def _resync(self, prefix):
+        # Nothing seen before the current index can be in the cache
+        _etcd_index = etcd_utils.index()
+        self.invalidate(prefix)
+        self._synced_index[prefix] = _etcd_index
+        self._etcd_index[prefix] = _etcd_index
+
+    def _watch(self, prefix):
+        while not self._complete.is_set():
+            try:
+                if self._etcd_index[prefix] is None:
+                    self._resync(prefix)
+                resp = etcd_utils.watch(prefix, self._etcd_index[prefix],
+                                        timeout=self.watch_timeout)
+                self.invalidate(resp.key, resp.modifiedIndex)
+                self._etcd_index[prefix] = resp.modifiedIndex
+            except etcd.EtcdWatchTimedOut:
+                continue
+            except etcd.EtcdEventIndexCleared:
+                # Missed events, resync from the current index
+                self._etcd_index[prefix] = None
+            except (etcd.EtcdConnectionFailed, etcd.EtcdException):
+                sys.stderr.write("Central store cache watcher lost "
+                                 "connection, resyncing...\n")
+                # Already retried on a reconnected client (see
+                # connection.call)
+                self._etcd_index[prefix] = None
+                gevent.sleep(1)
+
+
+def agent_prefixes():
+    """Keys of the node of the agent and, once it is known, of its cluster
+
+    :rtype: list(str)
+    """
+    _prefixes = []
+    _node_context = NS.get("node_context")
+    if _node_context is not None and \
+            getattr(_node_context, "node_id", None):
+        _prefixes.append("/nodes/%s" % _node_context.node_id)
+    _tendrl_context = NS.get("tendrl_context")
+    if _tendrl_context is not None and \
+            getattr(_tendrl_context, "integration_id", None):
+        _prefixes.append("/clusters/%s" % _tendrl_context.integration_id)
+    return _prefixes
+
+
+def _overlaps(key, other):
+    # A change at key affects the object at other, or the other way round
+    return key == other or key.startswith(other + "/") or \
+        other.startswith(key + "/")
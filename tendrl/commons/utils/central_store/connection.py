@@ -0,0 +1,235 @@
+"""
+Central store (etcd) client connections.
+"""
+
+import random
+import sys
+import urlparse
+
+import etcd
+import gevent
+import gevent.event
+import gevent.lock
+
+# Errors which are not worth a reconnect, the central store answered
+NOT_RETRIED_ERRORS = (etcd.EtcdKeyError, etcd.EtcdValueError,
+                      etcd.EtcdEventIndexCleared, etcd.EtcdWatchTimedOut)
+
+
+# Attempts of call(), and base of its backoff between attempts
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.1
+
+
+def backoff(attempt, base=0.5, cap=30):
+    """Seconds to wait before the attempt (counted from 0) of a retry
+
+    Exponential backoff with full jitter, so that the agents losing their
+    connection together (eg: on an etcd leader change) do not reconnect
+    together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def etcd_hosts(endpoints, default_port=2379):
+    """(host, port) of each endpoint ("host" or "host:port") of the central
+
+    store, in the form etcd.Client(host=...) takes several hosts
+    """
+    _hosts = []
+    for endpoint in endpoints:
+        _host, _, _port = str(endpoint).rpartition(":")
+        if not _host:
+            _host, _port = _port, default_port
+        _hosts.append((_host, int(_port)))
+    return tuple(_hosts)
+
+
+def call(client, method, *args, **kwargs):
+    """Calls a method of NS._int.{client}, retrying on connection errors
+
+    The client is reconnected and the call retried, after a jittered
+    backoff, up to RETRY_ATTEMPTS times in all. Errors answered by the
+    central store (eg: etcd.EtcdKeyNotFound) are raised at once.
+
+    :param client: "client" (reads, watches) or "wclient" (writes, TTL
+                   refresh)
+    :type client: str
+    :param method: Name of the etcd.Client method
+    :type method: str
+    :returns: The result of the method
+    """
+    attempt = 1
+    while True:
+        try:
+            return getattr(NS._int[client], method)(*args, **kwargs)
+        except NOT_RETRIED_ERRORS:
+            raise
+        except (etcd.EtcdConnectionFailed, etcd.EtcdException):
+            if attempt >= RETRY_ATTEMPTS:
+                raise
+            if client == "wclient":
+                NS._int.wreconnect()
+            else:
+                NS._int.reconnect()
+            gevent.sleep(backoff(attempt, base=RETRY_BACKOFF))
+            attempt += 1
+
+
+class ConnectionManager(object):
+    """Connects the central store clients of the process, NS._int.client
+
+    (reads, watches) and NS._int.wclient (writes, TTL refresh). Each client
+    keeps a pool of pool_size HTTP connections shared by all greenlets.
+
+    Reconnects of a client are serialized: greenlets failing while another
+    one reconnects the client wait for it and use its new client, instead
+    of replacing the client again. Failed connects are retried with
+    backoff(), on gevent.sleep so that the hub keeps running. Once started,
+    a health check greenlet probes both clients every health_interval
+    seconds and reconnects the failing ones.
+
+    etcd_kwargs may list several hosts (see etcd_hosts()), the clients
+    then fail over to the other members of the cluster. Each read client
+    connects to a random member so that the reads of the agents spread
+    over the cluster, and the write client connects to the leader, which
+    a member would otherwise forward the writes to. The write client
+    follows the leader on reconnects and health checks.
+    """
+
+    def __init__(self, etcd_kwargs, pool_size=10, health_interval=30):
+        """Initializes a new ConnectionManager instance.
+
+        :param etcd_kwargs: Arguments of etcd.Client()
+        :type etcd_kwargs: dict
+        :param pool_size: Max HTTP connections kept open per client
+        :type pool_size: int
+        :param health_interval: Seconds between two health checks
+        :type health_interval: int
+        """
+        self.etcd_kwargs = dict(etcd_kwargs, per_host_pool_size=pool_size)
+        self.health_interval = health_interval
+        self.connects = 0
+        self.connect_failures = 0
+        self.reconnects = 0
+        self.shared_reconnects = 0
+        self.health_failures = 0
+        self.leader_changes = 0
+        # (host, port) of the leader, last seen by the write client
+        self._leader = None
+        self._reconnecting = {"client": gevent.lock.BoundedSemaphore(),
+                              "wclient": gevent.lock.BoundedSemaphore()}
+        self._health_checker = None
+        self._complete = gevent.event.Event()
+
+    def connect(self, name="client"):
+        """Creates a new client, retrying until the central store is up
+
+        :param name: "client" or "wclient"
+        :type name: str
+        :rtype: etcd.Client
+        """
+        attempt = 0
+        while True:
+            try:
+                _client = etcd.Client(**self._client_kwargs(name))
+                if name == "wclient" and self._multi_endpoint() and \
+                        not self._on_leader(_client):
+                    _client = etcd.Client(**self._client_kwargs(name))
+                self.connects += 1
+                return _client
+            except etcd.EtcdException:
+                self.connect_failures += 1
+                sys.stdout.write(
+                    "Error connecting to central store (etcd), trying "
+                    "again...")
+                gevent.sleep(backoff(attempt))
+                attempt += 1
+
+    def reconnect(self, name="client"):
+        """Replaces NS._int.{name} with a new client
+
+        :param name: "client" or "wclient"
+        :type name: str
+        """
+        _lock = self._reconnecting[name]
+        if _lock.locked():
+            # Reconnected by another greenlet meanwhile
+            with _lock:
+                self.shared_reconnects += 1
+                return
+        with _lock:
+            self.reconnects += 1
+            NS._int[name] = self.connect(name)
+
+    def stats(self):
+        return dict(connects=self.connects,
+                    connect_failures=self.connect_failures,
+                    reconnects=self.reconnects,
+                    shared_reconnects=self.shared_reconnects,
+                    health_failures=self.health_failures,
+                    leader_changes=self.leader_changes)
+
+    def start(self):
+        if self._health_checker is not None and \
+                not self._health_checker.dead:
+            return
+        self._complete.clear()
+        self._health_checker = gevent.spawn(self._check_health)
+
+    def stop(self):
+        self._complete.set()
+        if self._health_checker is not None:
+            self._health_checker.kill(block=False)
+        self._health_checker = None
+
+    def _multi_endpoint(self):
+        _hosts = self.etcd_kwargs.get("host")
+        return isinstance(_hosts, tuple) and len(_hosts) > 1
+
+    def _client_kwargs(self, name):
+        if not self._multi_endpoint():
+            return self.etcd_kwargs
+        _hosts = self.etcd_kwargs["host"]
+        if name == "wclient":
+            if self._leader is not None:
+                _hosts = (self._leader,) + tuple(
+                    host for host in _hosts if host != self._leader)
+        else:
+            _first = random.randrange(len(_hosts))
+            _hosts = _hosts[_first:] + _hosts[:_first]
+        return dict(self.etcd_kwargs, host=_hosts)
+
+    def _on_leader(self, client):
+        """The client is connected to the leader, as far as it is known
+
+        Records the leader, which the next write client connects to.
+        """
+        try:
+            _url = urlparse.urlparse(client.leader["clientURLs"][0])
+        except (etcd.EtcdException, KeyError, IndexError):
+            # Leader unknown (eg: election running), members forward the
+            # writes meanwhile
+            return True
+        _leader = (_url.hostname, _url.port)
+        if _leader != self._leader:
+            self._leader = _leader
+            self.leader_changes += 1
+        return (client.host, client.port) == _leader
+
+    def _check_health(self):
+        while not self._complete.wait(timeout=self.health_interval):
+            for name in ["client", "wclient"]:
+                try:
+                    # Local member stats, the cheapest request served
+                    NS._int[name].stats
+                except (etcd.EtcdConnectionFailed, etcd.EtcdException):
+                    self.health_failures += 1
+                    sys.stderr.write("Central store %s failed its health "
+                                     "check, reconnecting...\n" % name)
+                    self.reconnect(name)
+                    continue
+                # The write client follows the leader
+                if name == "wclient" and self._multi_endpoint() and \
+                        not self._on_leader(NS._int.wclient):
+                    self.reconnect(name)
@@ -0,0 +1,149 @@
+"""
+Lease based locks on central store keys.
+"""
+
+import sys
+
+import etcd
+import gevent
+import gevent.event
+
+from tendrl.commons.utils import etcd_utils
+
+# Creates of a key expiring between the create and the read of its owner
+CREATE_ATTEMPTS = 3
+
+
+class LockHeldError(Exception):
+    def __init__(self, key, owner):
+        super(LockHeldError, self).__init__(
+            "%s is already locked by %s" % (key, owner))
+        self.key = key
+        self.owner = owner
+
+
+class Lock(object):
+    """Lock over a set of central store keys, each key holding the owner.
+
+    etcd v2 has no multi-key transaction: all keys are created at once
+    with prevExist=False and the ones obtained are rolled back if any
+    other key is held, so the lock is taken on all keys or on none of
+    them. Keys are leased for ttl seconds and kept alive by a heartbeat
+    greenlet, a crashed holder loses the lock when the lease expires.
+    """
+
+    def __init__(self, keys, owner, ttl=60, shared_with=None):
+        """Initializes a new Lock instance.
+
+        :param keys: Central store keys to lock
+        :type keys: list(str)
+        :param owner: Value identifying the holder (eg: a job id)
+        :type owner: str
+        :param ttl: Seconds after which an unrefreshed key is released
+        :type ttl: int
+        :param shared_with: Owners whose locks are entered without being
+                            taken over (eg: the parent job of owner)
+        :type shared_with: list(str)
+        """
+        self.keys = list(keys)
+        self.owner = owner
+        self.ttl = ttl
+        self.shared_with = shared_with or []
+        # Keys actually created by this lock
+        self.owned = []
+        self._heartbeat = None
+        self._released = gevent.event.Event()
+
+    def acquire(self):
+        """Takes the lock on all keys
+
+        :raises LockHeldError: when a key is held by another owner
+        """
+        _greenlets = [gevent.spawn(self._create, key) for key in self.keys]
+        gevent.joinall(_greenlets, raise_error=True)
+        self.owned = [key for key, _greenlet in zip(self.keys, _greenlets)
+                      if _greenlet.value]
+
+        for key, _greenlet in zip(self.keys, _greenlets):
+            if _greenlet.value:
+                continue
+            _owner = self._owner(key)
+            if _owner not in self.shared_with:
+                self.release()
+                raise LockHeldError(key, _owner)
+
+        self._released.clear()
+        self._heartbeat = gevent.spawn(self._refresh)
+
+    def release(self):
+        """Deletes the keys still held by this lock
+
+        :returns: The released keys
+        :rtype: list(str)
+        """
+        self._released.set()
+        if self._heartbeat is not None:
+            self._heartbeat.kill(block=False)
+            self._heartbeat = None
+        _greenlets = [gevent.spawn(self._delete, key) for key in self.owned]
+        gevent.joinall(_greenlets, raise_error=True)
+        _released = [key for key, _greenlet in zip(self.owned, _greenlets)
+                     if _greenlet.value]
+        self.owned = []
+        return _released
+
+    def _create(self, key):
+        """Creates key holding the owner
+
+        :returns: False if the key is held by another owner
+        :rtype: bool
+        """
+        for _ in range(CREATE_ATTEMPTS):
+            try:
+                _write(key, self.owner, ttl=self.ttl, prev_exist=False)
+                return True
+            except etcd.EtcdAlreadyExist:
+                _owner = self._owner(key)
+                if _owner == self.owner:
+                    # Created by the first attempt of a retried write
+                    return True
+                if _owner is not None:
+                    return False
+                # Expired since, create it again
+        return False
+
+    def _delete(self, key):
+        try:
+            _delete(key, prev_value=self.owner)
+        except (etcd.EtcdKeyNotFound, etcd.EtcdCompareFailed):
+            # Lease expired, or the key was taken over since
+            return False
+        return True
+
+    def _owner(self, key):
+        try:
+            return etcd_utils.read(key,
+                                   consistency=etcd_utils.QUORUM).value
+        except etcd.EtcdKeyNotFound:
+            return None
+
+    def _refresh(self):
+        while not self._released.wait(timeout=self.ttl / 3.0):
+            for key in list(self.owned):
+                try:
+                    _write(key, self.owner, ttl=self.ttl,
+                           prev_value=self.owner)
+                except (etcd.EtcdKeyNotFound, etcd.EtcdCompareFailed):
+                    sys.stderr.write("Lost lock on %s\n" % key)
+                    self.owned.remove(key)
+                except (etcd.EtcdConnectionFailed, etcd.EtcdException):
+                    # Try again on the next beat, the lease outlives it
+                    pass
+
+
+def _write(key, value, **kwargs):
+    etcd_utils.write(key, value, **kwargs)
+
+
+def _delete(key, **kwargs):
+    etcd_utils.delete(key, **kwargs)
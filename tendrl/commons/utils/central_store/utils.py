@@ -1,8 +1,6 @@
 import datetime
-import etcd
-import sys
-import time
 
+from tendrl.commons.utils.central_store import connection
 from tendrl.commons.utils.central_store import fields
 
 PY_TO_TENDRL_TYPE_MAP = {dict: fields.DictField,
@@ -22,25 +20,56 @@ def to_tendrl_field(name, value, tendrl_type=None):
     return PY_TO_TENDRL_TYPE_MAP[type(value)](name, value)
 
 
+def _render_value(name, value):
+    return [(name, value, False)]
+
+
+def _render_datetime(name, value):
+    return [(name, str(value.isoformat()), False)]
+
+
+def _render_list(name, value):
+    if value:
+        value = list(set(value))
+    return [(name, value, False)]
+
+
+def _render_dict(name, value):
+    return [('{0}/{1}'.format(name, x), value[x], True) for x in value]
+
+
+PY_TYPE_RENDERERS = {dict: _render_dict,
+                     str: _render_value,
+                     int: _render_value,
+                     bool: _render_value,
+                     unicode: _render_value,
+                     datetime.datetime: _render_datetime,
+                     list: _render_list}
+
+
+def render_field(name, value, tendrl_type=None):
+    """Renders an attr the way to_tendrl_field(name, value,
+
+    tendrl_type).render() does, without building the Field instance
+
+    :returns: The items to store, relative to the object key
+    :rtype: list((key, value, dir))
+    """
+    if tendrl_type == 'json':
+        return _render_value(name, value)
+    return PY_TYPE_RENDERERS[type(value)](name, value)
+
+
+def _connection():
+    if NS._int.get("connection") is None:
+        NS._int.connection = connection.ConnectionManager(
+            NS._int.etcd_kwargs)
+    return NS._int.connection
+
+
 def wreconnect():
-    NS._int.wclient = None
-    while not NS._int.wclient:
-        try:
-            NS._int.wclient = etcd.Client(**NS._int.etcd_kwargs)
-        except etcd.EtcdException:
-            sys.stdout.write(
-                "Error connecting to central store (etcd), trying "
-                "again...")
-            time.sleep(2)
+    _connection().reconnect("wclient")
 
 
 def reconnect():
-    NS._int.client = None
-    while not NS._int.client:
-        try:
-            NS._int.client = etcd.Client(**NS._int.etcd_kwargs)
-        except etcd.EtcdException:
-            sys.stdout.write(
-                "Error connecting to central store (etcd), trying "
-                "again...")
-            time.sleep(2)
+    _connection().reconnect("client")
@@ -0,0 +1,183 @@
+"""
+Write-behind queue of central store object saves.
+"""
+
+import collections
+import sys
+
+import etcd
+import gevent
+import gevent.event
+
+from tendrl.commons.utils import etcd_utils
+
+
+class WriteBehindQueue(object):
+    """Coalescing queue of pending object writes keyed by object path.
+
+    Saves of objects defined with "write_behind: true" are queued here
+    instead of being written by the caller. Pending writes of an object
+    are merged, the last write of a key wins, and a flusher greenlet
+    writes them out in batches every flush_interval seconds. Once
+    max_size objects are pending the caller flushes the queue itself, so
+    the queue stays bounded.
+    """
+
+    def __init__(self, max_size=1024, flush_interval=5):
+        """Initializes a new WriteBehindQueue instance.
+
+        :param max_size: Max number of objects pending
+        :type max_size: int
+        :param flush_interval: Seconds between two flushes
+        :type flush_interval: int
+        """
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.queued = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.failures = 0
+        # {obj_key: (OrderedDict(key: value), ttl, hash_cas)}
+        self._pending = collections.OrderedDict()
+        self._flusher = None
+        self._complete = gevent.event.Event()
+
+    @property
+    def enabled(self):
+        """Saves are queued only while the flusher is running
+
+        """
+        return self._flusher is not None and not self._flusher.dead
+
+    def put(self, obj_key, items, ttl=None, hash_cas=None):
+        """Queues the items of a save of the object at obj_key
+
+        :param obj_key: Central store key of the object directory
+        :type obj_key: str
+        :param items: The (key, value) items to write
+        :type items: list((key, value))
+        :param ttl: Refresh the object with this TTL once written
+        :type ttl: int
+        :param hash_cas: (key, digest, prev_hash) of the hash of a
+                         partial save, see etcd_utils.write_hash()
+        :type hash_cas: tuple
+        """
+        _items, _ttl, _hash_cas = self._pending.pop(obj_key,
+                                                    (None, None, None))
+        if _items is None:
+            _items = collections.OrderedDict()
+        else:
+            self.coalesced += 1
+        _items.update(items)
+        self._pending[obj_key] = (_items, ttl or _ttl,
+                                  _merge_hash_cas(_items, _hash_cas,
+                                                  hash_cas))
+        self.queued += 1
+        if len(self._pending) >= self.max_size:
+            self.flush()
+
+    def pending(self, obj_key):
+        return obj_key in self._pending
+
+    def flush(self, obj_key=None):
+        """Writes out the pending objects (or only the one at obj_key)
+
+        :returns: Number of objects written
+        :rtype: int
+        """
+        if obj_key is not None:
+            if obj_key not in self._pending:
+                return 0
+            _pending = collections.OrderedDict(
+                [(obj_key, self._pending.pop(obj_key))])
+        else:
+            _pending, self._pending = self._pending, \
+                collections.OrderedDict()
+        if not _pending:
+            return 0
+
+        _items = []
+        for _obj_items, _ttl, _hash_cas in _pending.itervalues():
+            _items.extend(_obj_items.iteritems())
+        try:
+            etcd_utils.write_many(_items)
+            for _obj_items, _ttl, _hash_cas in _pending.itervalues():
+                if _hash_cas:
+                    etcd_utils.write_hash(*_hash_cas)
+        except (etcd.EtcdConnectionFailed, etcd.EtcdException):
+            self._requeue(_pending)
+            raise
+
+        _cache = NS._int.get("cache") if "_int" in NS else None
+        for _obj_key, (_obj_items, _ttl, _hash_cas) in _pending.iteritems():
+            if _ttl:
+                etcd_utils.refresh(_obj_key, _ttl)
+            if _cache is not None:
+                _cache.invalidate(_obj_key)
+        self.flushed += len(_pending)
+        return len(_pending)
+
+    def _requeue(self, pending):
+        # Writes queued since the failed flush are newer, they win
+        for obj_key, (_items, _ttl, _hash_cas) in pending.iteritems():
+            if obj_key in self._pending:
+                _newer, _newer_ttl, _newer_cas = self._pending.pop(obj_key)
+                _items.update(_newer)
+                _ttl = _newer_ttl or _ttl
+                _hash_cas = _merge_hash_cas(_items, _hash_cas, _newer_cas)
+            self._pending[obj_key] = (_items, _ttl, _hash_cas)
+
+    def stats(self):
+        return dict(queued=self.queued,
+                    coalesced=self.coalesced,
+                    flushed=self.flushed,
+                    failures=self.failures,
+                    size=len(self._pending))
+
+    def start(self):
+        if self.enabled:
+            return
+        self._complete.clear()
+        self._flusher = gevent.spawn(self._run)
+
+    def stop(self):
+        """Stops the flusher and writes out the pending objects
+
+        """
+        self._complete.set()
+        if self._flusher is not None:
+            self._flusher.kill(block=False)
+        self._flusher = None
+        self.flush()
+
+    def _run(self):
+        while not self._complete.wait(timeout=self.flush_interval):
+            try:
+                self.flush()
+            except (etcd.EtcdConnectionFailed, etcd.EtcdException):
+                # Pending objects were requeued, retry on the next flush
+                # (the writes were retried on a reconnected client
+                # already, see connection.call)
+                self.failures += 1
+                sys.stderr.write("Central store write-behind flush "
+                                 "failed, retrying...\n")
+
+
+def _merge_hash_cas(items, queued_cas, hash_cas):
+    """The hash write of two coalesced saves of an object
+
+    :param items: The merged items of the saves
+    :param queued_cas: hash_cas of the queued save, if partial
+    :param hash_cas: hash_cas of the newer save, if partial
+    """
+    if hash_cas is None:
+        # Full write, its hash is part of the items
+        return None
+    if queued_cas is None:
+        if hash_cas[0] in items:
+            # Partial write over a queued full write: a full write
+            items[hash_cas[0]] = hash_cas[1]
+            return None
+        return hash_cas
+    # Compare with the hash stored before the first of the saves
+    return hash_cas[0], hash_cas[1], queued_cas[2]
@@ -1,10 +1,83 @@
 import etcd
 
+from tendrl.commons.utils.central_store import backend
+from tendrl.commons.utils.central_store import connection
+
+'''
+   Central store backend of the process
+   input params:
+       None
+
+   return param:
+       backend.Backend - > NS._int.backend, etcd v2 through the
+                           NS._int clients by default
+'''
+
+_default_backend = backend.Etcd2Backend()
+
+
+def store():
+    return NS._int.get("backend") or _default_backend
+
+
+'''
+   Call a central store client method, retrying on connection errors
+   input params:
+       client : type  - >  string
+                value - >  "client" (reads, watches) or "wclient"
+                           (writes, TTL refresh)
+       method : type  - >  string
+                value - >  name of the etcd.Client method
+       args, kwargs     -  arguments of the method
+
+   return param:
+       The result of the method
+
+   Note: the client is reconnected and the call retried, after a
+   jittered backoff, up to RETRY_ATTEMPTS times in all. Errors answered
+   by the central store (eg: etcd.EtcdKeyNotFound) are raised at once.
+'''
+
+RETRY_ATTEMPTS = connection.RETRY_ATTEMPTS
+RETRY_BACKOFF = connection.RETRY_BACKOFF
+call = connection.call
+
+'''
+   Options of an etcd read of the given consistency
+   input params:
+       consistency: type  - >  string
+                    value - >  QUORUM: linearizable read, served through
+                                       the etcd leader (job status, locks,
+                                       objects other agents write)
+                               SERIALIZABLE: served by the member the
+                                             client is connected to, may
+                                             miss the latest writes
+                                             (inventory, reloads of
+                                             objects this agent writes)
+
+   return param:
+       dict - > keyword arguments of etcd.Client.read()
+'''
+
+QUORUM = backend.QUORUM
+SERIALIZABLE = backend.SERIALIZABLE
+CONSISTENCY_LEVELS = backend.CONSISTENCY_LEVELS
+
+
+def read_options(consistency):
+    return {"quorum": backend.check_consistency(consistency) == QUORUM}
+
 '''
    Read from etcd
    input params:
-       key  : type  - >  string
-              value - >  attr to be fetched
+       key        : type  - >  string
+                    value - >  attr to be fetched
+       recursive  : type  - >  bool
+                    value - >  read the whole directory tree
+                               default : False
+       consistency: type  - >  string
+                    value - >  QUORUM or SERIALIZABLE
+                               default : SERIALIZABLE
 
    return param:
        dict - > if read is successful
@@ -12,42 +85,41 @@ import etcd
 '''
 
 
-def read(key):
-    try:
-        return NS._int.client.read(key)
-    except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-        if type(ex) != etcd.EtcdKeyNotFound:
-            NS._int.reconnect()
-            return NS._int.client.read(key)
-        else:
-            raise etcd.EtcdKeyNotFound
+def read(key, recursive=False, consistency=SERIALIZABLE):
+    return store().read(key, recursive=recursive, consistency=consistency)
 
 
 '''
    Write to etcd
    input params:
-       key   : type  - >  string
-               value - >  attr to be inserted
-       value : type  - >  string/int etc
-               value - >  value of attr to be inserted
-       quorum: type  - >  bool
-               value - >  value for quorum (True/False)
-                          default : True
+       key       : type  - >  string
+                   value - >  attr to be inserted
+       value     : type  - >  string/int etc
+                   value - >  value of attr to be inserted
+       quorum    : type  - >  bool
+                   value - >  unused, writes always go through the leader
+                              default : True
+       ttl       : type  - >  int
+                   value - >  seconds after which the key expires
+                              default : None (never)
+       prev_value: type  - >  string
+                   value - >  write only if the key holds this value
+                              (etcd.EtcdCompareFailed otherwise)
+                              default : None
+       prev_exist: type  - >  bool
+                   value - >  False: write only if the key does not exist
+                              (etcd.EtcdAlreadyExist otherwise)
+                              default : None
 
    return param:
        None
 '''
 
 
-def write(key, value, quorum=True):
-    try:
-        NS._int.wclient.write(key, value, quorum=quorum)
-    except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-        if type(ex) != etcd.EtcdKeyNotFound:
-            NS._int.wreconnect()
-            NS._int.wclient.write(key, value, quorum=quorum)
-        else:
-            raise etcd.EtcdKeyNotFound
+def write(key, value, quorum=True, ttl=None, prev_value=None,
+          prev_exist=None):
+    store().write(key, value, ttl=ttl, prev_value=prev_value,
+                  prev_exist=prev_exist)
 
 
 '''
@@ -64,11 +136,115 @@ def write(key, value, quorum=True):
 
 
 def refresh(value, ttl):
-    try:
-        NS._int.wclient.refresh(value, ttl=ttl)
-    except (etcd.EtcdConnectionFailed, etcd.EtcdException) as ex:
-        if type(ex) != etcd.EtcdKeyNotFound:
-            NS._int.wreconnect()
-            NS._int.wclient.refresh(value, ttl=ttl)
-        else:
-            raise etcd.EtcdKeyNotFound
+    store().refresh(value, ttl)
+
+
+'''
+   Delete from etcd
+   input params:
+       key       : type  - >  string
+                   value - >  etcd path
+       recursive : type  - >  bool
+                   value - >  delete the whole directory tree
+                              default : False
+       prev_value: type  - >  string
+                   value - >  delete only if the key holds this value
+                              (etcd.EtcdCompareFailed otherwise)
+                              default : None
+
+   return param:
+       None
+'''
+
+
+def delete(key, recursive=False, prev_value=None):
+    store().delete(key, recursive=recursive, prev_value=prev_value)
+
+
+'''
+   Write many keys to etcd in a single batch
+   input params:
+       items : type  - >  list of (key, value) tuples
+               value - >  keys and values to be inserted
+       quorum: type  - >  bool
+               value - >  unused, writes always go through the leader
+                          default : True
+
+   return param:
+       None
+
+   Note: the object hashes (keys ending with /hash) are written once all
+   the other items are, so that a failed batch never leaves a hash
+   describing attrs which were not written. etcd v3 writes small batches
+   in a single transaction.
+'''
+
+
+def write_many(items, quorum=True):
+    store().write_many(items)
+
+
+'''
+   Write the digest of a partially written object
+   input params:
+       key      : type  - >  string
+                  value - >  etcd path of the object hash
+       digest   : type  - >  string
+                  value - >  digest of the object as saved
+       prev_hash: type  - >  string
+                  value - >  stored hash the object was read with
+
+   return param:
+       bool - > False if the stored hash was blanked
+
+   Note: the stored values of the attrs which were not written may have
+   been changed by another writer since the object was read, the digest
+   is written only if the stored hash is still prev_hash. Else the hash
+   is blanked, so that it matches no object until the next full write.
+'''
+
+
+def write_hash(key, digest, prev_hash):
+    if prev_hash:
+        try:
+            write(key, digest, prev_value=prev_hash)
+            return True
+        except (etcd.EtcdCompareFailed, etcd.EtcdKeyNotFound):
+            pass
+    write(key, "")
+    return False
+
+
+'''
+   Current etcd index
+   input params:
+       None
+
+   return param:
+       int - > etcd index (v2) or revision (v3) of the central store
+'''
+
+
+def index():
+    return store().index()
+
+
+'''
+   Wait for a change below a directory
+   input params:
+       prefix : type  - >  string
+                value - >  etcd path of the directory
+       index  : type  - >  int
+                value - >  changes made after this etcd index
+       timeout: type  - >  int
+                value - >  seconds to wait (etcd.EtcdWatchTimedOut then)
+                           default : None (the client's timeout)
+
+   return param:
+       The changed key, with its action ("set", "delete"...) and
+       modifiedIndex
+'''
+
+
+def watch(prefix, index, timeout=None):
+    return store().watch(prefix, index, timeout=timeout)
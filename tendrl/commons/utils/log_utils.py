@@ -1,10 +1,10 @@
 """Handles logging functionality."""
-from inspect import getframeinfo
-from inspect import stack
 import sys
 
 from tendrl.commons.event import Event
+from tendrl.commons.message import get_caller
 from tendrl.commons.message import Message
+from tendrl.commons.message import priority_enabled
 
 
 def log(log_priority, publisher_id, log_payload, job_id=None,
@@ -17,10 +17,9 @@ def log(log_priority, publisher_id, log_payload, job_id=None,
         log_payload [Type: Dict] : Payload can contain /
                                    parameters like message that is to be logged
     """
-    caller_details = getframeinfo(stack()[1][0])
-    caller_details = {"filename": caller_details.filename,
-                      "line_no": caller_details.lineno,
-                      "function": caller_details.function}
+    if not priority_enabled(log_priority):
+        return
+    caller_details = get_caller(log_priority)
     try:
         Event(
             Message(